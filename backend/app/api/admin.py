@@ -0,0 +1,221 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import Optional, Literal
+from datetime import datetime
+from app.database import get_db, SessionLocal
+from app.services.database_service import db_service
+from app.services.retention_service import retention_service
+from app.services.connection_manager import connection_manager
+from app.services.email_outbox import email_outbox
+from app.services.loop_monitor import loop_monitor
+from app.models.lead import Lead
+import csv
+import io
+import json
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+LEAD_EXPORT_FIELDS = [
+    "id", "session_id", "name", "email", "phone", "purpose", "selected_category",
+    "location", "budget", "timeline", "property_type", "lead_status", "lead_score",
+    "is_qualified", "created_at", "updated_at"
+]
+
+
+class LeadFilters:
+    """Query-string filters shared by the listing and export endpoints"""
+
+    def __init__(
+        self,
+        lead_status: Optional[str] = None,
+        is_qualified: Optional[bool] = None,
+        purpose: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None
+    ):
+        self.lead_status = lead_status
+        self.is_qualified = is_qualified
+        self.purpose = purpose
+        self.created_from = created_from
+        self.created_to = created_to
+
+    def as_dict(self) -> dict:
+        return {
+            "lead_status": self.lead_status,
+            "is_qualified": self.is_qualified,
+            "purpose": self.purpose,
+            "created_from": self.created_from,
+            "created_to": self.created_to
+        }
+
+
+@router.get("/leads")
+async def get_all_leads(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    filters: LeadFilters = Depends(),
+    db: Session = Depends(get_db)
+):
+    """Admin endpoint to view leads, newest first. Pass `next_cursor` back as `cursor` for the next page."""
+    try:
+        page = db_service.get_leads_page(db, limit=limit, cursor=cursor, **filters.as_dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "total": db_service.count_leads(db, **filters.as_dict()),
+        "count": len(page["leads"]),
+        "next_cursor": page["next_cursor"],
+        "leads": [_serialize_lead(lead) for lead in page["leads"]]
+    }
+
+
+@router.get("/leads/export")
+async def export_leads(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    filters: LeadFilters = Depends()
+):
+    """Stream every matching lead as NDJSON or CSV without loading them all into memory"""
+
+    if format == "csv":
+        body = _stream_leads_csv(filters.as_dict())
+        media_type = "text/csv"
+    else:
+        body = _stream_leads_ndjson(filters.as_dict())
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="leads.{format}"'}
+    )
+
+
+@router.get("/sessions/{session_id}/transcript")
+async def get_transcript(session_id: str, db: Session = Depends(get_db)):
+    """Full transcript for a session, including messages moved to the archive"""
+    messages = retention_service.get_transcript(db, session_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="No messages found for this session")
+
+    return {
+        "session_id": session_id,
+        "count": len(messages),
+        "messages": messages
+    }
+
+
+class HandoffRequest(BaseModel):
+    agent_name: str
+    message: Optional[str] = None
+
+
+@router.post("/sessions/{session_id}/handoff")
+async def handoff_session(session_id: str, request: HandoffRequest, db: Session = Depends(get_db)):
+    """Hand a session over to a human agent, notifying the widget if it is connected over WebSocket"""
+    if not db_service.get_session_snapshot(db, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    message = request.message or f"Hi! {request.agent_name} from our team is joining the chat now. 👋"
+    db_service.save_message(db, session_id, "assistant", message, intent="AGENT_HANDOFF")
+
+    delivered = await connection_manager.push(session_id, {
+        "type": "handoff",
+        "agent_name": request.agent_name,
+        "message": message
+    })
+    return {"session_id": session_id, "delivered": delivered}
+
+
+@router.post("/retention/run")
+def run_retention(older_than_days: Optional[int] = Query(None, ge=0), db: Session = Depends(get_db)):
+    """Archive messages of sessions ended more than `older_than_days` ago (defaults to settings)"""
+    return retention_service.archive_ended_sessions(db, older_than_days=older_than_days)
+
+
+@router.post("/retention/enable-incremental-vacuum")
+def enable_incremental_vacuum():
+    """One-off conversion of existing database files to incremental auto_vacuum (full VACUUM; run off-peak)"""
+    return retention_service.enable_incremental_vacuum()
+
+
+@router.get("/outbox")
+def get_outbox_stats(db: Session = Depends(get_db)):
+    """Email outbox row counts by status"""
+    return email_outbox.stats(db)
+
+
+@router.post("/outbox/drain")
+def drain_outbox(db: Session = Depends(get_db)):
+    """Send every due outbox email now instead of waiting for the worker"""
+    return email_outbox.drain(db)
+
+
+@router.post("/outbox/digest")
+def flush_digest(db: Session = Depends(get_db)):
+    """Send the pending lead digest now, without waiting for its window to close"""
+    return {"outcome": email_outbox.flush_digest(db, force=True)}
+
+
+@router.get("/debug/loop-stalls")
+async def get_loop_stalls():
+    """Event loop stalls over the threshold: most frequent (route, blocking call) pairs and recent stacks"""
+    return loop_monitor.report()
+
+
+# ==================== HELPER METHODS ====================
+
+def _serialize_lead(lead: Lead) -> dict:
+    """Lead fields shown in the admin listing"""
+    return {
+        "id": lead.id,
+        "name": lead.name,
+        "email": lead.email,
+        "phone": lead.phone,
+        "purpose": lead.purpose,
+        "location": lead.location,
+        "budget": lead.budget,
+        "timeline": lead.timeline,
+        "lead_status": lead.lead_status,
+        "is_qualified": lead.is_qualified,
+        "created_at": lead.created_at.isoformat()
+    }
+
+
+def _export_row(lead: Lead) -> dict:
+    """All exported lead fields, JSON/CSV friendly"""
+    row = {field: getattr(lead, field) for field in LEAD_EXPORT_FIELDS}
+    for field in ("created_at", "updated_at"):
+        if row[field]:
+            row[field] = row[field].isoformat()
+    return row
+
+
+def _stream_leads_ndjson(filters: dict):
+    # The request's DB session is closed before the body streams, so use our own
+    db = SessionLocal()
+    try:
+        for lead in db_service.iter_leads(db, **filters):
+            yield json.dumps(_export_row(lead)) + "\n"
+    finally:
+        db.close()
+
+
+def _stream_leads_csv(filters: dict):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=LEAD_EXPORT_FIELDS)
+
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    db = SessionLocal()
+    try:
+        for lead in db_service.iter_leads(db, **filters):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(_export_row(lead))
+            yield buffer.getvalue()
+    finally:
+        db.close()
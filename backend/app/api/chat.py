@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from app.database import get_db
 from app.services.conversation_service import conversation_service
 from app.services.database_service import db_service
-from app.services.email_service import email_service  # Add this import
+from app.services.admission import LLMOverloaded
+from app.api.deps import client_info
+from app.services.email_service import email_service
 from typing import Optional
+from datetime import datetime
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
@@ -22,7 +25,7 @@ class ChatResponse(BaseModel):
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage, db: Session = Depends(get_db)):
+async def chat(message: ChatMessage, request: Request, db: Session = Depends(get_db)):
     """
     Main chat endpoint - handles conversation with lead qualification
     """
@@ -31,7 +34,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
         # Get or create session
         session_id = message.session_id
         if not session_id:
-            session_id = db_service.create_session(db)
+            session_id = db_service.create_session(db, **client_info(request))
         
         # Save user message
         db_service.save_message(
@@ -54,7 +57,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
         ]
         
         # Get existing lead data
-        lead = db_service.get_lead_by_session(db, session_id)
+        lead = db_service.get_lead_snapshot(db, session_id)
         lead_data = {}
         if lead:
             lead_data = {
@@ -86,43 +89,41 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
         
         # Update lead data if new information was extracted
         if result["extracted_data"]:
-            # Get previous lead state (before update)
+            # Get previous lead state (before update), from the database so another worker's capture counts
             previous_lead = db_service.get_lead_by_session(db, session_id)
-            had_contact_info_before = previous_lead and (previous_lead.email or previous_lead.phone)
+            had_contact_info_before = bool(previous_lead and (previous_lead.email or previous_lead.phone))
             
-            # Update the lead
-            updated_lead = db_service.create_or_update_lead(
-                db=db,
-                session_id=session_id,
-                lead_data=result["extracted_data"]
-            )
-            
-            # Check if contact info was just captured (NEW contact info)
-            has_contact_info_now = updated_lead and (updated_lead.email or updated_lead.phone)
-            
-            if has_contact_info_now and not had_contact_info_before:
-                print(f"🎯 NEW LEAD QUALIFIED - Sending email notification")
-                # This is a newly qualified lead - send notification
-                lead_data_for_email = {
-                    "name": updated_lead.name,
-                    "email": updated_lead.email,
-                    "phone": updated_lead.phone,
-                    "purpose": updated_lead.purpose,
-                    "location": updated_lead.location,
-                    "budget": updated_lead.budget,
-                    "timeline": updated_lead.timeline,
-                    "property_type": updated_lead.property_type
-                }
-                
-                email_sent = await email_service.send_lead_notification(
-                    lead_data=lead_data_for_email,
-                    session_id=session_id
+            # Update the lead, queueing the notification in the same transaction
+            with db_service.transaction(db, session_id):
+                updated_lead = db_service.create_or_update_lead(
+                    db=db,
+                    session_id=session_id,
+                    lead_data=result["extracted_data"]
                 )
                 
-                if email_sent:
-                    print(f"✅ EMAIL SENT FOR LEAD: {lead_data_for_email.get('name', 'Unknown')}")
-                else:
-                    print(f"❌ EMAIL FAILED FOR LEAD: {lead_data_for_email.get('name', 'Unknown')}")
+                # Check if contact info was just captured (NEW contact info)
+                has_contact_info_now = updated_lead and (updated_lead.email or updated_lead.phone)
+                
+                if has_contact_info_now and not had_contact_info_before:
+                    print(f"🎯 NEW LEAD QUALIFIED - Queueing email notification")
+                    # This is a newly qualified lead - the outbox worker sends the email
+                    lead_data_for_email = {
+                        "name": updated_lead.name,
+                        "email": updated_lead.email,
+                        "phone": updated_lead.phone,
+                        "purpose": updated_lead.purpose,
+                        "location": updated_lead.location,
+                        "budget": updated_lead.budget,
+                        "timeline": updated_lead.timeline,
+                        "property_type": updated_lead.property_type,
+                        "lead_score": updated_lead.lead_score
+                    }
+                    
+                    email_service.enqueue_lead_notification(
+                        db=db,
+                        lead_data=lead_data_for_email,
+                        session_id=session_id
+                    )
         
         return ChatResponse(
             response=result["response"],
@@ -130,28 +131,53 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
             stage=result["stage"]
         )
         
+    except LLMOverloaded:
+        raise  # Served as 503 by the app's handler
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 
 @router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str, db: Session = Depends(get_db)):
-    """Get conversation history for a session"""
+async def get_chat_history(
+    session_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Get conversation history for a session.
     
-    history = db_service.get_conversation_history(db, session_id)
+    Pass `before` to page back through older messages, or `after` / `since`
+    to poll for messages newer than the last one the client has seen.
+    """
+    
+    try:
+        page = db_service.get_conversation_page(
+            db, session_id, limit=limit, before=before, after=after, since=since
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "session_id": session_id,
         "messages": [
             {
+                "id": msg.id,
                 "role": msg.role,
                 "message": msg.message,
                 "timestamp": msg.timestamp.isoformat(),
                 "intent": msg.intent
             }
-            for msg in history
-        ]
+            for msg in page["messages"]
+        ],
+        "has_more": page["has_more"],
+        "cursors": {
+            "before": page["before"],
+            "after": page["after"]
+        }
     }
     
 @router.post("/chat/select-category")
@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from starlette.requests import HTTPConnection
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, EmailStr
-from typing import Optional, Literal, Dict, Any
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from fastapi.encoders import jsonable_encoder
+from typing import Optional, Literal, Dict, Any, Union, List
 from app.database import get_db
+from app.api.deps import client_info
 from app.services.conversation_service_v2 import conversation_service_v2
 from app.services.flow_manager import flow_manager
+from app.services.state_machine import FlowState
+from app.services.flow_state_store import flow_state_store, SessionFlowState, StaleStateError
+from app.services.payload_cache import payload_cache, encode_json
 from app.services.database_service import db_service
 from app.services.email_service import email_service
 from app.services.property_service import property_service
 from app.services.ai_service import ai_service
-from app.models.lead import Lead
+from app.services.ai_prefetch import ai_prefetcher, CANNED_QUESTIONS, personalize
+from app.services.admission import LLMOverloaded
 import json
 import sys
 
@@ -42,7 +49,8 @@ class UserInputRequest(BaseModel):
     session_id: str
     input_type: str  # "button", "form", "text"
     input_data: Any  # Button value, form data dict, or text string
-    current_state: str
+    current_state: Optional[str] = None  # Only used if the server has no state for the session
+    state_version: Optional[int] = None  # Version the client acted on; stale versions get a 409
 
 
 class MenuRequest(BaseModel):
@@ -50,6 +58,18 @@ class MenuRequest(BaseModel):
     session_id: str
 
 
+class BatchAction(BaseModel):
+    """One action of a batch: the body of the matching endpoint, minus session_id"""
+    type: Literal["select_category", "submit_lead", "input", "menu", "property_action", "end"]
+    data: Dict[str, Any] = Field(default_factory=dict)
+
+
+class BatchRequest(BaseModel):
+    """Ordered actions for one session, run in a single transaction"""
+    session_id: str
+    actions: List[BatchAction] = Field(min_length=1, max_length=10)
+
+
 class ChatResponse(BaseModel):
     """Standard chat response"""
     session_id: str
@@ -59,6 +79,7 @@ class ChatResponse(BaseModel):
     ui_component: Optional[Dict[str, Any]]
     show_menu_button: bool
     metadata: Optional[Dict[str, Any]] = None
+    state_version: Optional[int] = None
 
 
 # ==================== ENDPOINTS ====================
@@ -66,14 +87,15 @@ class ChatResponse(BaseModel):
 @router.post("/chat/init", response_model=ChatResponse)
 async def initialize_chat(
     request: ChatInitRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    connection: HTTPConnection = None
 ):
     """
     Initialize a new chat session and return greeting with categories
     """
     try:
-        # Create new session
-        session_id = db_service.create_session(db)
+        # Create new session (recording the client, which rate limits are also keyed by)
+        session_id = db_service.create_session(db, **client_info(connection))
         
         # Get greeting with categories
         greeting = conversation_service_v2.get_greeting()
@@ -87,18 +109,21 @@ async def initialize_chat(
             intent="GREETING"
         )
         
-        return ChatResponse(
+        flow_state = await flow_state_store.set(session_id, "greeting")
+        
+        return _chat_response(
             session_id=session_id,
             message=greeting["message"],
             current_state="greeting",
             next_state="category_selection",
-            ui_component={
+            ui_component=payload_cache.static("category_buttons", lambda: {
                 "type": "category_buttons",
                 "data": {
                     "categories": greeting["categories"]
                 }
-            },
-            show_menu_button=False
+            }),
+            show_menu_button=False,
+            state_version=flow_state.version
         )
         
     except Exception as e:
@@ -125,7 +150,7 @@ async def select_category(
         )
     
         
-        lead = db.query(Lead).filter(Lead.session_id == request.session_id).first()
+        lead = db_service.get_lead_snapshot(db, request.session_id)
         
         if not lead:
             # Get lead capture form
@@ -140,30 +165,36 @@ async def select_category(
                 intent="LEAD_CAPTURE"
             )
             
-            return ChatResponse(
+            flow_state = await flow_state_store.set(request.session_id, "lead_capture")
+            
+            return _chat_response(
                 session_id=request.session_id,
                 message=form_response["message"],
                 current_state="lead_capture",
                 next_state="lead_submitted",
-                ui_component={
+                ui_component=payload_cache.static("lead_form", lambda: {
                     "type": "lead_form",
                     "data": {
                         "fields": form_response["form_fields"]
                     }
-                },
-                show_menu_button=True
+                }),
+                show_menu_button=True,
+                state_version=flow_state.version
             )
             
         else:
             # Lead already exists, skip to category flow
+            lead_context = {
+                "name": lead.name,
+                "email": lead.email,
+                "phone": lead.phone
+            }
             flow_response = flow_manager.start_category_flow(
                 category=request.category["id"],
-                lead_data={
-                    "name": lead.name,
-                    "email": lead.email,
-                    "phone": lead.phone
-                }
+                lead_data=lead_context
             )
+            flow_state = await flow_state_store.set(request.session_id, flow_response["current_state"], lead_context)
+            await _prefetch_for_state(db, request.session_id, flow_state.state)
             
             # Save assistant's response
             db_service.save_message(
@@ -174,14 +205,15 @@ async def select_category(
                 intent=flow_response["current_state"]
             )
             
-            return ChatResponse(
+            return _chat_response(
                 session_id=request.session_id,
                 message=flow_response["message"],
                 current_state=flow_response["current_state"],
                 next_state=flow_response["next_state"],
-                ui_component=flow_response["ui_component"],
+                ui_component=payload_cache.ui_component(flow_response["current_state"], flow_response["ui_component"]),
                 show_menu_button=flow_response["show_menu_button"],
-                metadata={"lead_captured": True}
+                metadata={"lead_captured": True},
+                state_version=flow_state.version
             )
         
     except Exception as e:
@@ -219,7 +251,7 @@ async def submit_lead(
         })
         
         if not validation["valid"]:
-            return ChatResponse(
+            return _chat_response(
                 session_id=request.session_id,
                 message=" ".join(validation["errors"]),
                 current_state="lead_capture",
@@ -234,19 +266,40 @@ async def submit_lead(
                 show_menu_button=True
             )
         
-        # Save lead information
+        # Save lead information, queueing the notification in the same transaction
         cleaned_data = validation["cleaned_data"]
-        lead = db_service.create_or_update_lead(
-            db=db,
-            session_id=request.session_id,
-            lead_data={
-                "name": cleaned_data["name"],
-                "email": cleaned_data["email"],
-                "phone": cleaned_data["phone"],
-                "selected_category": request.category,
-                "is_qualified": True
-            }
-        )
+        # Read from the database, not the cache: another worker may have captured the lead already
+        previous_lead = db_service.get_lead_by_session(db, request.session_id)
+        had_contact_info = bool(previous_lead and (previous_lead.email or previous_lead.phone))
+        with db_service.transaction(db, request.session_id):
+            lead = db_service.create_or_update_lead(
+                db=db,
+                session_id=request.session_id,
+                lead_data={
+                    "name": cleaned_data["name"],
+                    "email": cleaned_data["email"],
+                    "phone": cleaned_data["phone"],
+                    "selected_category": request.category,
+                    "is_qualified": True
+                }
+            )
+            if not had_contact_info:
+                email_service.enqueue_lead_notification(
+                    db=db,
+                    lead_data={
+                        "name": lead.name,
+                        "email": lead.email,
+                        "phone": lead.phone,
+                        "purpose": request.category,
+                        "selected_category": request.category,
+                        "location": lead.location,
+                        "budget": lead.budget,
+                        "timeline": lead.timeline,
+                        "property_type": lead.property_type,
+                        "lead_score": lead.lead_score
+                    },
+                    session_id=request.session_id
+                )
         
         # Save user's form submission as message
         db_service.save_message(
@@ -257,23 +310,13 @@ async def submit_lead(
             intent="LEAD_SUBMITTED"
         )
         
-        """ # Send email notification (lead captured!)
-        await email_service.send_lead_notification(
-            lead_data={
-                "name": cleaned_data["name"],
-                "email": cleaned_data["email"],
-                "phone": cleaned_data["phone"],
-                "purpose": request.category,
-                "selected_category": request.category
-            },
-            session_id=request.session_id
-        ) """
-        
         # Start category-specific flow using state machine
         flow_response = flow_manager.start_category_flow(
             category=request.category,
             lead_data=cleaned_data
         )
+        flow_state = await flow_state_store.set(request.session_id, flow_response["current_state"], cleaned_data)
+        await _prefetch_for_state(db, request.session_id, flow_state.state)
         
         # Save assistant's response
         db_service.save_message(
@@ -284,14 +327,15 @@ async def submit_lead(
             intent=flow_response["current_state"]
         )
         
-        return ChatResponse(
+        return _chat_response(
             session_id=request.session_id,
             message=flow_response["message"],
             current_state=flow_response["current_state"],
             next_state=flow_response["next_state"],
-            ui_component=flow_response["ui_component"],
+            ui_component=payload_cache.ui_component(flow_response["current_state"], flow_response["ui_component"]),
             show_menu_button=flow_response["show_menu_button"],
-            metadata={"lead_captured": True}
+            metadata={"lead_captured": True},
+            state_version=flow_state.version
         )
         
     except Exception as e:
@@ -308,20 +352,54 @@ async def handle_user_input(
     Handle user input during flow (button clicks, form submissions, text)
     """
     try:
-        # Get lead data for context
-
-        lead = db_service.get_lead_by_session(db, request.session_id)
-        if not lead or not lead.name:
-            raise HTTPException(
-                status_code=400,
-                detail="Lead information not found. Please start over."
-            )
+        # The server's record of where this session is wins over the client's claim
+        flow_state = await flow_state_store.get(request.session_id)
+        if flow_state and (
+            (request.state_version is not None and request.state_version != flow_state.version)
+            or (request.current_state and request.current_state != flow_state.state)
+        ):
+            raise _stale_state_error(flow_state)
+        
+        if flow_state and flow_state.context:
+            context = dict(flow_state.context)
+        else:
+            # Get lead data for context
+            lead = db_service.get_lead_snapshot(db, request.session_id)
+            if not lead or not lead.name:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Lead information not found. Please start over."
+                )
+            
+            context = {
+                "name": lead.name,
+                "email": lead.email,
+                "phone": lead.phone
+            }
         
-        context = {
-            "name": lead.name,
-            "email": lead.email,
-            "phone": lead.phone
-        }
+        current_state = (
+            flow_state.state if flow_state
+            else request.current_state or flow_manager.state_machine.flow.menu_state
+        )
+        
+        # Process input through flow manager (pure; nothing is written yet)
+        flow_response = flow_manager.handle_user_input(
+            current_state=current_state,
+            user_input=request.input_data,
+            context=context
+        )
+        
+        # Claim the transition before any side effects so a replayed submission is rejected
+        try:
+            new_flow_state = await flow_state_store.advance(
+                request.session_id,
+                expected_version=flow_state.version if flow_state else None,
+                state=flow_response["current_state"],
+                context=context
+            )
+        except StaleStateError as e:
+            raise _stale_state_error(e.current)
+        await _prefetch_for_state(db, request.session_id, new_flow_state.state)
         
         if(request.input_type != "assisstant"):
             # Save user input
@@ -331,52 +409,9 @@ async def handle_user_input(
                 session_id=request.session_id,
                 role="user",
                 message=user_message,
-                intent=request.current_state
+                intent=current_state
             )
         
-        if request.input_type == "button" and request.input_data == "show_more":
-            return {
-                "message": "Want to see more properties? Let me know your preferences to narrow it down:",
-                "current_state": "explore_show_more",
-                "ui_component": {
-                    "type": "preference_form",
-                    "data": {
-                        "fields": [
-                            {
-                                "name": "budget",
-                                "label": "💰 Budget Range",
-                                "type": "dropdown",
-                                "options": [
-                                    {"value": "under_50", "label": "Under ₹50 Lakhs"},
-                                    {"value": "50_100", "label": "₹50L - ₹1 Crore"},
-                                    {"value": "100_200", "label": "₹1 Cr - ₹2 Crore"},
-                                    {"value": "200_plus", "label": "₹2 Crore+"}
-                                ],
-                                "required": False
-                            },
-                            {
-                                "name": "location",
-                                "label": "📍 Preferred Location",
-                                "type": "multiselect_chips",
-                                "options": ["OMR", "ECR", "Velachery", "Anna Nagar", "T Nagar"],
-                                "required": False
-                            }
-                        ],
-                        "submit_label": "Show Matching Properties"
-                    }
-                },
-                "show_menu_button": True
-            }
-        
-            
-            
-        # Process input through flow manager
-        flow_response = flow_manager.handle_user_input(
-            current_state=request.current_state,
-            user_input=request.input_data,
-            context=context
-        )
-        
         # Update lead with any new data collected
         if flow_response.get("user_data"):
             _update_lead_from_flow_data(
@@ -394,16 +429,20 @@ async def handle_user_input(
             intent=flow_response["current_state"]
         )
         
-        return ChatResponse(
+        if flow_response["current_state"] == FlowState.ENDED.value:
+            db_service.end_session(db, request.session_id)
+        
+        return _chat_response(
             session_id=request.session_id,
             message=flow_response["message"],
             current_state=flow_response["current_state"],
             next_state=flow_response["next_state"],
-            ui_component=flow_response["ui_component"],
-            show_menu_button=flow_response["show_menu_button"]
+            ui_component=payload_cache.ui_component(flow_response["current_state"], flow_response["ui_component"]),
+            show_menu_button=flow_response["show_menu_button"],
+            state_version=new_flow_state.version
         )
         
-    except HTTPException:
+    except (HTTPException, LLMOverloaded):
         raise
     except Exception as e:
         # Get the exception details (type, value, traceback object)
@@ -443,6 +482,8 @@ async def back_to_menu(
         
         # Get menu response
         menu_response = flow_manager.go_to_main_menu()
+        flow_state = await flow_state_store.set(request.session_id, menu_response["current_state"])
+        await _prefetch_for_state(db, request.session_id, flow_state.state)
         
         # Save assistant response
         db_service.save_message(
@@ -453,13 +494,14 @@ async def back_to_menu(
             intent="MENU"
         )
         
-        return ChatResponse(
+        return _chat_response(
             session_id=request.session_id,
             message=menu_response["message"],
             current_state=menu_response["current_state"],
             next_state=menu_response["next_state"],
-            ui_component=menu_response["ui_component"],
-            show_menu_button=False
+            ui_component=payload_cache.ui_component(menu_response["current_state"], menu_response["ui_component"]),
+            show_menu_button=False,
+            state_version=flow_state.version
         )
         
     except Exception as e:
@@ -476,7 +518,7 @@ async def end_chat(
     End the chat session
     """
     try:
-        lead = db_service.get_lead_by_session(db, session_id)
+        lead = db_service.get_lead_snapshot(db, session_id)
         
         handoff_message = f"Thank you for chatting with us, {lead.name if lead else 'there'}! Our team will be in touch soon. Have a great day! 🙏✨"
         
@@ -491,6 +533,8 @@ async def end_chat(
         
         # Mark session as ended
         db_service.end_session(db, session_id)
+        await flow_state_store.discard(session_id)
+        ai_prefetcher.cancel(session_id)
         
         return {
             "message": handoff_message,
@@ -504,6 +548,51 @@ async def end_chat(
 
 # ==================== HELPER METHODS ====================
 
+def _chat_response(
+    session_id: str,
+    message: str,
+    current_state: str,
+    next_state: Optional[str],
+    ui_component: Union[bytes, Dict[str, Any], None],
+    show_menu_button: bool,
+    metadata: Optional[Dict[str, Any]] = None,
+    state_version: Optional[int] = None
+) -> Response:
+    """
+    Encode a ChatResponse-shaped body directly, skipping model validation.
+    A pre-encoded ui_component (bytes from payload_cache) is spliced in as-is.
+    """
+    body = encode_json({
+        "session_id": session_id,
+        "message": message,
+        "current_state": current_state,
+        "next_state": next_state,
+        "show_menu_button": show_menu_button,
+        "metadata": metadata,
+        "state_version": state_version
+    })
+    if not isinstance(ui_component, bytes):
+        ui_component = encode_json(ui_component)
+    
+    return Response(
+        content=body[:-1] + b',"ui_component":' + ui_component + b'}',
+        media_type="application/json"
+    )
+
+
+def _stale_state_error(flow_state: SessionFlowState) -> HTTPException:
+    """409 telling the client where the session actually is, so it can resync"""
+    return HTTPException(
+        status_code=409,
+        detail={
+            "code": "stale_state",
+            "message": "Conversation state has moved on; refresh and try again.",
+            "current_state": flow_state.state,
+            "state_version": flow_state.version
+        }
+    )
+
+
 def _format_user_input(input_type: str, input_data: Any) -> str:
     """Format user input for saving to database"""
     if input_type == "button":
@@ -545,17 +634,17 @@ def _update_lead_from_flow_data(db: Session, session_id: str, flow_data: Dict[st
     # Notes - append any additional info
     notes_items = []
     for key, value in flow_data.items():
-        if key not in ["budget", "location", "property_type", "timeline", "name", "email", "phone"]:
+        if key not in ["budget", "location", "property_type", "timeline", "name", "email", "phone", "preferences"] and not key.endswith("_label"):
             notes_items.append(f"{key}: {value}")
     
     if notes_items:
-        existing_lead = db_service.get_lead_by_session(db, session_id)
+        existing_lead = db_service.get_lead_snapshot(db, session_id)
         existing_notes = existing_lead.notes if existing_lead and existing_lead.notes else ""
         new_notes = "; ".join(notes_items)
         lead_update["notes"] = f"{existing_notes}; {new_notes}" if existing_notes else new_notes
     
     if lead_update:
-        db_service.create_or_update_lead(db, session_id, lead_update)
+        db_service.update_lead(db, session_id, lead_update)
         
 @router.get("/properties/{property_type}")
 async def get_properties(property_type: str, limit: int = 6):
@@ -574,40 +663,73 @@ async def filter_properties(filters: dict):
     return {"properties": properties, "count": len(properties)}
 
 
+# Ask-AI button values and the questions they stand for
+AI_QUESTION_MAP = {
+    **CANNED_QUESTIONS,
+    "custom": "I have a custom question"
+}
+
+ASK_STATES = {
+    FlowState.ASK_START.value,
+    FlowState.ASK_QUERY_RECEIVED.value,
+    FlowState.ASK_RESPONSE.value,
+    FlowState.ASK_FOLLOWUP.value
+}
+
+
 @router.post("/chat/ask-ai")
 async def ask_ai(request: dict, db: Session = Depends(get_db)):
     """Handle AI question"""
     session_id = request.get("session_id")
-    question = request.get("question")
-    
-    # Map button values to actual questions
-    question_map = {
-        "omr_projects": "What are the ongoing projects near OMR?",
-        "3bhk_price": "What's the price of your 3BHK apartments?",
-        "ecr_plots": "Do you have plots available in ECR?",
-        "custom": "I have a custom question"
-    }
     
     # If it's a button value, convert it
-    if question in question_map:
-        question = question_map[question]
+    question = AI_QUESTION_MAP.get(request.get("question"), request.get("question"))
     
-    # Get conversation history for context
-    history = db_service.get_conversation_history(db, session_id)
-    gemini_history = [
-        {"role": msg.role, "parts": [msg.message]}
-        for msg in history[-5:]
-    ]
-    
-    # Get AI response
-    response = await ai_service.answer_question(question, gemini_history)
+    # Get AI response (quick replies are usually prefetched already)
+    response = await _answer(db, session_id, request.get("question"), question)
     
     # Save messages
     db_service.save_message(db, session_id, "user", question, intent="ai_question")
     db_service.save_message(db, session_id, "assistant", response, intent="ai_answer")
     
+    return _ai_answer_response(response)
+
+
+async def _answer(db: Session, session_id: str, key: str, question: str) -> str:
+    """Answer a question, using the prefetched answer for a quick reply when there is one"""
+    if key not in CANNED_QUESTIONS:
+        return await ai_service.answer_question(question, _ai_history(db, session_id))
+    
+    response = await ai_prefetcher.take(session_id, key)
+    if response is None:
+        # Not prefetched here (e.g. it was prefetched on another worker): it may still be in the answer cache
+        question = personalize(question, db_service.get_lead_snapshot(db, session_id))
+        response = await ai_service.cached_answer(question)
+    if response is None:
+        response = await ai_service.answer_question(question, _ai_history(db, session_id))
+    return response
+
+
+async def _prefetch_for_state(db: Session, session_id: str, state: str):
+    """Start answering the quick replies on the Ask AI screen; drop them once the session leaves the flow"""
+    if state == FlowState.ASK_START.value:
+        await ai_prefetcher.start(session_id, db_service.get_lead_snapshot(db, session_id))
+    elif state not in ASK_STATES:
+        ai_prefetcher.cancel(session_id)
+
+
+def _ai_history(db: Session, session_id: str) -> list:
+    """Last few messages of the conversation, in Gemini's history format"""
+    history = db_service.get_conversation_history(db, session_id)
+    return [
+        {"role": msg.role, "parts": [msg.message]}
+        for msg in history[-5:]
+    ]
+
+
+def _ai_answer_response(message: str) -> dict:
     return {
-        "message": response,
+        "message": message,
         "ui_component": {
             "type": "buttons",
             "data": {
@@ -633,13 +755,14 @@ async def property_action(request: dict, db: Session = Depends(get_db)):
         return {"message": "Property not found", "current_state": "explore_start"}
     
     # Check if lead exists
-    lead = db_service.get_lead_by_session(db, session_id)
+    lead = db_service.get_lead_snapshot(db, session_id)
     
     if lead and (lead.email or lead.phone):
         # Lead already exists - send confirmation
         message = f"✅ Perfect! We'll send you detailed information about {property_data['name']} shortly.\n\nWhat else can I help you with?"
         
         # Send notification email here if needed
+        flow_state = await flow_state_store.set(session_id, "explore_property_action")
         
         return {
             "message": message,
@@ -653,10 +776,13 @@ async def property_action(request: dict, db: Session = Depends(get_db)):
                     ]
                 }
             },
-            "show_menu_button": False
+            "show_menu_button": False,
+            "state_version": flow_state.version
         }
     else:
         # Need to capture lead first
+        flow_state = await flow_state_store.set(session_id, "lead_capture")
+        
         return {
             "message": f"I'd love to share details about {property_data['name']}!\n\nPlease provide your contact information:",
             "current_state": "lead_capture",
@@ -671,5 +797,73 @@ async def property_action(request: dict, db: Session = Depends(get_db)):
                 }
             },
             "show_menu_button": True,
-            "metadata": {"property_id": property_id, "action": action}
-        }
\ No newline at end of file
+            "metadata": {"property_id": property_id, "action": action},
+            "state_version": flow_state.version
+        }
+
+
+# Actions that can be run outside their own HTTP request (batch, WebSocket): (request model, endpoint)
+ACTIONS = {
+    "select_category": (CategorySelectRequest, select_category),
+    "submit_lead": (LeadCaptureRequest, submit_lead),
+    "input": (UserInputRequest, handle_user_input),
+    "menu": (MenuRequest, back_to_menu),
+    "property_action": (dict, property_action),
+}
+
+
+async def run_action(db: Session, action_type: str, data: Dict[str, Any]) -> Union[Response, Dict[str, Any]]:
+    """Run one v2 action through its endpoint. Raises HTTPException / ValidationError like the endpoint would."""
+    if action_type == "end":
+        return await end_chat(session_id=data.get("session_id"), db=db)
+    
+    if action_type not in ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown action '{action_type}'")
+    
+    model, endpoint = ACTIONS[action_type]
+    request = data if model is dict else model.model_validate(data)
+    return await endpoint(request, db=db)
+
+
+@router.post("/chat/batch")
+async def batch_actions(request: BatchRequest, db: Session = Depends(get_db)):
+    """
+    Run several actions for one session in order, in a single DB transaction,
+    and return every response together. If any action fails, none of them
+    take effect and the error names the failing action's index.
+    """
+    flow_state = await flow_state_store.get(request.session_id)
+    bodies = []
+    
+    try:
+        with db_service.transaction(db, request.session_id):
+            for index, action in enumerate(request.actions):
+                try:
+                    result = await run_action(db, action.type, {**action.data, "session_id": request.session_id})
+                except HTTPException as e:
+                    raise HTTPException(status_code=e.status_code, detail={"failed_action": index, "detail": e.detail})
+                except ValidationError as e:
+                    raise HTTPException(
+                        status_code=422,
+                        detail={"failed_action": index, "detail": jsonable_encoder(e.errors(include_url=False, include_context=False))}
+                    )
+                bodies.append(result.body if isinstance(result, Response) else encode_json(result))
+    except Exception as e:
+        # Nothing was committed, so the session is still where it started
+        if flow_state:
+            await flow_state_store.restore(request.session_id, flow_state)
+        else:
+            await flow_state_store.discard(request.session_id)
+        
+        if isinstance(e, HTTPException) and e.status_code == 409 and flow_state:
+            # Report the restored state, not the one the rolled-back actions reached
+            raise HTTPException(
+                status_code=409,
+                detail={"failed_action": e.detail["failed_action"], "detail": _stale_state_error(flow_state).detail}
+            )
+        raise
+    
+    return Response(
+        content=b'{"session_id":' + encode_json(request.session_id) + b',"responses":[' + b",".join(bodies) + b']}',
+        media_type="application/json"
+    )
@@ -0,0 +1,223 @@
+from fastapi import APIRouter, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional, Union
+from app.config import get_settings
+from app.database import SessionLocal, db_initialized, ensure_db
+from app.api import chat, chat_v2
+from app.api.chat_v2 import AI_QUESTION_MAP, _answer, _ai_history, _ai_answer_response
+from app.services.ai_prefetch import CANNED_QUESTIONS
+from app.services.connection_manager import connection_manager
+from app.services.database_service import db_service
+from app.services.flow_state_store import flow_state_store
+from app.services.payload_cache import encode_json
+from app.services.ai_service import ai_service
+from app.services.rate_limiter import rate_limiter, client_ip
+from app.services.admission import LLMOverloaded
+import asyncio
+import json
+import math
+import time
+
+settings = get_settings()
+
+router = APIRouter(prefix="/api/v2", tags=["chat-v2"])
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """
+    The v2 chat protocol over one connection per widget.
+
+    Client frames: {"id": any, "type": op, "data": {...}} where op is one of
+    init, select_category, submit_lead, input, menu, property_action, ask_ai,
+    end, resume, ping or pong. "data" is the body the matching HTTP endpoint
+    takes; session_id may be omitted once the connection has one.
+
+    Server frames:
+    - {"id", "type": "response", "data": <the HTTP endpoint's JSON>}
+    - {"id", "type": "error", "status", "detail"}
+    - {"id", "type": "ai_chunk", "text"} while an ask_ai answer streams
+    - {"type": "ping"} after ws_heartbeat_interval_seconds of silence (reply "pong")
+    - pushed events such as {"type": "handoff", ...}
+
+    After a reconnect, send {"type": "resume", "data": {"session_id", "after"}}
+    to rebind the session and get the flow state plus any missed messages.
+    """
+    await websocket.accept()
+
+    if not db_initialized():
+        await asyncio.to_thread(ensure_db)  # Connected before the startup warm-up finished
+    session_id: Optional[str] = None
+    last_seen = time.monotonic()
+
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(
+                    websocket.receive_text(),
+                    timeout=settings.ws_heartbeat_interval_seconds
+                )
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_seen > settings.ws_idle_timeout_seconds:
+                    await websocket.close(code=1001)
+                    break
+                await websocket.send_json({"type": "ping"})
+                continue
+
+            last_seen = time.monotonic()
+
+            try:
+                frame = json.loads(raw)
+                op = frame["type"]
+                message_id = frame.get("id")
+                data = dict(frame.get("data") or {})
+            except (ValueError, KeyError, TypeError):
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Malformed frame"})
+                continue
+
+            if op == "pong":
+                continue
+            if op == "ping":
+                await websocket.send_json({"id": message_id, "type": "pong"})
+                continue
+
+            if session_id and op != "resume":
+                data.setdefault("session_id", session_id)
+
+            # A DB session per frame: between frames the connection holds no pooled connection or open transaction
+            db = SessionLocal()
+            try:
+                result = await _dispatch(websocket, db, op, message_id, data)
+                body = result.body if isinstance(result, Response) else encode_json(result)
+            except HTTPException as e:
+                await websocket.send_json({"id": message_id, "type": "error", "status": e.status_code, "detail": e.detail})
+                continue
+            except LLMOverloaded as e:
+                await websocket.send_json({
+                    "id": message_id,
+                    "type": "error",
+                    "status": 503,
+                    "detail": "The assistant is busy right now; please try again shortly",
+                    "retry_after": e.retry_after
+                })
+                continue
+            except ValidationError as e:
+                await websocket.send_json({
+                    "id": message_id,
+                    "type": "error",
+                    "status": 422,
+                    "detail": jsonable_encoder(e.errors(include_url=False, include_context=False))
+                })
+                continue
+            except Exception as e:
+                print(f"Error handling WebSocket '{op}': {e}")
+                await websocket.send_json({"id": message_id, "type": "error", "status": 500, "detail": str(e)})
+                continue
+            finally:
+                db.close()  # Rolls back whatever the frame left uncommitted
+
+            await websocket.send_text(
+                (b'{"id":' + encode_json(message_id) + b',"type":"response","data":' + body + b'}').decode("utf-8")
+            )
+
+            # Bind the connection to its session so events can be pushed to it
+            bound = json.loads(body)["session_id"] if op == "init" else data.get("session_id")
+            if op in ("init", "resume") and bound != session_id:
+                if session_id:
+                    connection_manager.unregister(session_id, websocket)
+                session_id = bound
+                connection_manager.register(session_id, websocket)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if session_id:
+            connection_manager.unregister(session_id, websocket)
+
+
+async def _dispatch(
+    websocket: WebSocket,
+    db: Session,
+    op: str,
+    message_id: Any,
+    data: Dict[str, Any]
+) -> Union[Response, Dict[str, Any]]:
+    """Run one operation through the same code as its HTTP endpoint"""
+    wait = await rate_limiter.check(
+        "llm" if op == "ask_ai" else "default",
+        client_ip(websocket.scope),
+        data.get("session_id")
+    )
+    if wait:
+        raise HTTPException(status_code=429, detail=f"Too many requests; retry in {max(1, math.ceil(wait))} seconds")
+    
+    if op == "init":
+        return await chat_v2.initialize_chat(chat_v2.ChatInitRequest(), db=db, connection=websocket)
+    if op == "resume":
+        return await _resume(db, data)
+    if op == "ask_ai":
+        return await _stream_ai_answer(websocket, db, message_id, data)
+
+    _require_session(data)
+    return await chat_v2.run_action(db, op, data)
+
+
+async def _resume(db: Session, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Flow state and messages after `after` (latest page if omitted) for a reconnecting widget"""
+    session_id = _require_session(data)
+    session = db_service.get_session_snapshot(db, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    history = await chat.get_chat_history(
+        session_id,
+        limit=min(int(data.get("limit", 50)), 100),
+        before=None,
+        after=data.get("after"),
+        since=None,
+        db=db
+    )
+
+    flow_state = await flow_state_store.get(session_id)
+    return {
+        **history,
+        "is_active": session.is_active,
+        "current_state": flow_state.state if flow_state else None,
+        "state_version": flow_state.version if flow_state else None
+    }
+
+
+async def _stream_ai_answer(
+    websocket: WebSocket,
+    db: Session,
+    message_id: Any,
+    data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """ask_ai, pushing the answer to the widget chunk by chunk as Gemini generates it"""
+    session_id = _require_session(data)
+    question = AI_QUESTION_MAP.get(data.get("question"), data.get("question"))
+
+    if data.get("question") in CANNED_QUESTIONS:
+        # Quick replies are usually prefetched, so there is nothing to stream
+        response = await _answer(db, session_id, data.get("question"), question)
+        await websocket.send_json({"id": message_id, "type": "ai_chunk", "text": response})
+    else:
+        chunks = []
+        async for chunk in ai_service.stream_answer(question, _ai_history(db, session_id)):
+            chunks.append(chunk)
+            await websocket.send_json({"id": message_id, "type": "ai_chunk", "text": chunk})
+        response = "".join(chunks)
+
+    # Save messages
+    db_service.save_message(db, session_id, "user", question, intent="ai_question")
+    db_service.save_message(db, session_id, "assistant", response, intent="ai_answer")
+
+    return _ai_answer_response(response)
+
+
+def _require_session(data: Dict[str, Any]) -> str:
+    session_id = data.get("session_id")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id is required (send init or resume first)")
+    return session_id
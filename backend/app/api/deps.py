@@ -0,0 +1,13 @@
+from starlette.requests import HTTPConnection
+from typing import Dict, Optional
+from app.services.rate_limiter import client_ip
+
+
+def client_info(connection: Optional[HTTPConnection]) -> Dict[str, Optional[str]]:
+    """user_ip / user_agent of the HTTP request or WebSocket that started a session"""
+    if connection is None:
+        return {}
+    return {
+        "user_ip": client_ip(connection.scope),
+        "user_agent": (connection.headers.get("user-agent") or "")[:500] or None
+    }
@@ -12,13 +12,107 @@ class Settings(BaseSettings):
     
     # Database Configuration
     database_url: str = "sqlite:///./chatbot.db"
+    shard_count: int = 1  # >1 routes session data to shard files by hash(session_id)
+    shard_url_template: str = "sqlite:///./chatbot_shard{shard}.db"
     
-    # Email Configuration (we'll use this later)
+    # Email Configuration
     smtp_server: str 
     smtp_port: int
     smtp_username: str 
     smtp_password: str 
     admin_email: str 
+    smtp_starttls: bool = True  # Off for a local SMTP stand-in
+    smtp_timeout_seconds: int = 30
+    smtp_pool_size: int = 2  # Open SMTP connections reused by the outbox worker
+    
+    # Email Outbox Configuration
+    email_outbox_enabled: bool = True
+    email_outbox_poll_seconds: float = 2
+    email_outbox_batch_size: int = 50
+    email_max_attempts: int = 6  # Then the message is marked failed
+    email_retry_base_seconds: int = 30  # Backoff doubles from here on each failed attempt
+    email_retry_max_seconds: int = 3600
+    
+    # Lead Digest Configuration (one email per window instead of one per lead)
+    email_digest_enabled: bool = False
+    email_digest_window_seconds: int = 900
+    email_digest_max_leads: int = 500  # Per digest email; the rest go in the next one
+    email_digest_immediate_score: int = 80  # Leads scoring at least this are still sent right away
+    
+    # Shared Cache Configuration (flow state, idempotency keys, rate limits and AI answers)
+    cache_backend: str = "memory"  # 'memory' (per worker) or 'redis' (shared by all workers)
+    redis_url: str = "redis://localhost:6379/0"
+    cache_key_prefix: str = "chatbot:"
+    
+    # Session Cache Configuration (always per worker; reads through to the database)
+    session_cache_size: int = 10000  # Lead + session snapshots kept in memory
+    session_cache_ttl_seconds: int = 300
+    
+    # Flow State Configuration
+    flow_state_store_size: int = 50000  # Sessions whose flow state is held in memory
+    flow_state_ttl_seconds: int = 86400  # Idle sessions are forgotten after this
+    
+    # Ask AI Prefetch Configuration
+    ai_prefetch_enabled: bool = True  # Answer the quick-reply questions before they are clicked
+    ai_prefetch_max_per_session: int = 3
+    ai_prefetch_max_in_flight: int = 10  # Speculative Gemini calls running at once, all sessions
+    ai_prefetch_per_minute: int = 30  # Speculative Gemini calls per minute, all sessions
+    ai_prefetch_ttl_seconds: int = 600
+    ai_answer_cache_ttl_seconds: int = 3600  # Quick-reply answers reused across sessions (and workers)
+    ai_answer_cache_size: int = 5000
+    
+    # Idempotency Configuration
+    idempotency_store_size: int = 10000  # Responses kept for Idempotency-Key retries
+    idempotency_ttl_seconds: int = 3600
+    idempotency_wait_seconds: int = 30  # How long a retry waits for the original request to finish
+    
+    # WebSocket Configuration
+    ws_heartbeat_interval_seconds: int = 25  # Server pings a connection that has been quiet this long
+    ws_idle_timeout_seconds: int = 75  # Connections silent for longer than this are closed
+    
+    # Retention Configuration
+    retention_enabled: bool = False
+    retention_days: int = 90  # Archive messages of sessions ended longer ago than this
+    retention_interval_hours: int = 24
+    retention_batch_size: int = 200  # Sessions archived per transaction
+    retention_vacuum_pages: int = 2000  # Free pages returned to the OS per run (incremental auto_vacuum only)
+    
+    # Rate Limit Configuration (token buckets per client IP and per session; LLM endpoints budgeted separately)
+    rate_limit_enabled: bool = True
+    rate_limit_llm_session_per_minute: float = 10
+    rate_limit_llm_session_burst: int = 5
+    rate_limit_llm_ip_per_minute: float = 30  # Several sessions can share an office / NAT address
+    rate_limit_llm_ip_burst: int = 15
+    rate_limit_session_per_minute: float = 120
+    rate_limit_session_burst: int = 30
+    rate_limit_ip_per_minute: float = 600
+    rate_limit_ip_burst: int = 120
+    # Comma-separated IPs / CIDRs of the reverse proxies or load balancers in front of the app (e.g.
+    # "10.0.0.0/8,127.0.0.1"). Requests from them are attributed to the client they name in
+    # X-Forwarded-For / Forwarded; those headers are ignored from anyone else. Empty: the socket peer.
+    trusted_proxies: str = ""
+    
+    # LLM Admission Configuration (per worker; excess Gemini calls queue briefly, then get a 503)
+    llm_max_concurrent: int = 8
+    llm_max_queue: int = 32
+    llm_max_queue_wait_seconds: float = 10
+    llm_retry_after_seconds: int = 5
+    
+    # Metrics Configuration
+    metrics_enabled: bool = True  # Serve Prometheus metrics at /metrics
+    
+    # Event Loop Monitor Configuration (stacks of whatever blocks the loop, at /api/admin/debug/loop-stalls)
+    loop_monitor_enabled: bool = True
+    loop_monitor_interval_seconds: float = 0.1  # Heartbeat period; lag is how late each beat runs
+    loop_monitor_threshold_seconds: float = 0.1  # Lag at which the blocking stack is captured
+    loop_monitor_history: int = 100  # Recent stalls kept for the debug endpoint
+    
+    # Tracing Configuration
+    tracing_enabled: bool = False
+    tracing_sample_rate: float = 0.1  # Fraction of new traces recorded (callers' traceparent decisions are kept)
+    tracing_exporter: str = "file"  # 'file', 'otlp' or 'both'
+    tracing_file_path: str = "./traces.jsonl"  # OTLP/JSON, one export request per line
+    tracing_otlp_endpoint: str = "http://localhost:4318"  # OTLP/HTTP collector
     
     class Config:
         env_file = ".env"
@@ -1,21 +1,129 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
 from app.config import get_settings
 from app.models.lead import Base
+import threading
+import zlib
 
 settings = get_settings()
 
-# Create SQLite engine
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False}  # Needed for SQLite
-)
+
+def _create_engine(url: str):
+    return create_engine(
+        url,
+        connect_args={"check_same_thread": False}  # Needed for SQLite
+    )
+
+
+# Create SQLite engine(s). In sharded mode every table lives in each shard file
+# and session-scoped rows are routed by a hash of their session_id.
+if settings.shard_count > 1:
+    engines = {
+        str(n): _create_engine(settings.shard_url_template.format(shard=n))
+        for n in range(settings.shard_count)
+    }
+else:
+    engines = {"0": _create_engine(settings.database_url)}
+
+engine = engines["0"]
+
+# Each shard hands out lead ids from its own range, so ids stay unique across shards
+SHARD_ID_SPAN = 2 ** 40
+
+
+def shard_ids() -> list:
+    """All shard identifiers (a single "0" when sharding is off)"""
+    return list(engines)
+
+
+def shard_id_range(shard_id: str) -> tuple:
+    """(exclusive low, inclusive high) bounds of the lead ids a shard hands out"""
+    low = int(shard_id) * SHARD_ID_SPAN
+    return low, low + SHARD_ID_SPAN
+
+
+def shard_for(session_id: str) -> str:
+    """Stable shard for a session (crc32, so every worker process agrees)"""
+    return str(zlib.crc32(session_id.encode("utf-8")) % len(engines))
+
+
+def _session_ids_in(statement) -> set:
+    """session_id values a statement's WHERE clause pins it to (`==` or `IN`)"""
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return set()
+
+    session_ids = set()
+    for element in visitors.iterate(whereclause):
+        if not isinstance(element, BinaryExpression):
+            continue
+        if getattr(element.left, "key", None) != "session_id" or not isinstance(element.right, BindParameter):
+            continue
+
+        value = element.right.effective_value
+        if element.operator is operators.eq:
+            session_ids.add(value)
+        elif element.operator is operators.in_op:
+            session_ids.update(value)
+    return session_ids
+
+
+def _shard_chooser(mapper, instance, clause=None):
+    session_id = getattr(instance, "session_id", None)
+    if session_id is None:
+        raise ValueError(f"Cannot pick a shard for {instance!r}; pass bind_arguments={{'shard_id': ...}}")
+    return shard_for(session_id)
+
+
+def _identity_chooser(mapper, primary_key, *, lazy_loaded_from, **kw):
+    if lazy_loaded_from:
+        return [lazy_loaded_from.identity_token]
+    return shard_ids()
+
+
+def _execute_chooser(context):
+    session_ids = _session_ids_in(context.statement)
+    if session_ids:
+        return sorted({shard_for(session_id) for session_id in session_ids})
+    # Not scoped to a session: fan out to every shard
+    return shard_ids()
+
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if len(engines) > 1:
+    SessionLocal = sessionmaker(
+        class_=ShardedSession,
+        autoflush=False,
+        shards=engines,
+        shard_chooser=_shard_chooser,
+        identity_chooser=_identity_chooser,
+        execute_chooser=_execute_chooser
+    )
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def db_initialized() -> bool:
+    return _initialized
+
+
+def ensure_db():
+    """init_db() unless it already ran; a request that beats the startup warm-up waits for it here"""
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            init_db()
 
-# Database dependency
+# Database dependency (a sync dependency, so FastAPI runs it - and any wait in ensure_db - in a worker thread)
 def get_db():
+    ensure_db()
     db = SessionLocal()
     try:
         yield db
@@ -24,5 +132,41 @@ def get_db():
 
 # Initialize database (create all tables)
 def init_db():
-    Base.metadata.create_all(bind=engine)
-    print("✅ Database initialized successfully!")
\ No newline at end of file
+    global _initialized
+    for shard_engine in engines.values():
+        with shard_engine.begin() as conn:
+            if shard_engine.dialect.name == "sqlite":
+                # Only takes effect while the file has no tables (a new database); retention frees pages
+                # with incremental_vacuum. Existing files: POST /api/admin/retention/enable-incremental-vacuum
+                conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            Base.metadata.create_all(bind=conn)
+
+        # create_all skips columns and indexes on tables that already exist, so add any new ones
+        existing = inspect(shard_engine)
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns and column.nullable:
+                    column_type = column.type.compile(dialect=shard_engine.dialect)
+                    with shard_engine.begin() as conn:
+                        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=shard_engine, checkfirst=True)
+
+    if len(engines) > 1:
+        # Leads created before ids were shard-qualified: move them into their shard's range
+        for shard_id, shard_engine in engines.items():
+            low, _ = shard_id_range(shard_id)
+            if low:
+                with shard_engine.begin() as conn:
+                    conn.execute(text("UPDATE leads SET id = id + :low WHERE id <= :low"), {"low": low})
+
+    from app.services.database_service import db_service
+    db = SessionLocal()
+    try:
+        db_service.seed_counters(db)
+    finally:
+        db.close()
+
+    _initialized = True
+    print(f"✅ Database initialized successfully! ({len(engines)} shard(s))")
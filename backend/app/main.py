@@ -1,14 +1,31 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import get_settings
 from app.services.gemini_service import gemini_service
 from pydantic import BaseModel
-from app.database import init_db, get_db
-from sqlalchemy.orm import Session
-from app.services.database_service import db_service
+from app.database import ensure_db, engines
 from app.api import chat
 from app.api import chat_v2 
+from app.api import chat_ws
+from app.api import admin
 from app.services.conversation_service_v2 import conversation_service_v2
+from app.services.retention_service import retention_service
+from app.services.email_outbox import email_outbox
+from app.services.email_service import email_service
+from app.services.idempotency import IdempotencyMiddleware, idempotency_store
+from app.services.rate_limiter import RateLimitMiddleware, rate_limiter
+from app.services.admission import LLMOverloaded
+from app.services.session_cache import session_cache
+from app.services.ai_prefetch import ai_prefetcher
+from app.services.ai_service import ai_service
+from app.services.metrics import registry, Counter, Gauge, MetricsMiddleware, instrument_engine
+from app.services.tracing import tracer, TracingMiddleware
+from app.services.warmup import warm_up
+from app.services.loop_monitor import LoopMonitorMiddleware, loop_monitor
+from app.services.property_service import property_service
+from app.services.state_machine import state_machine
+import asyncio
 
 
 settings = get_settings()
@@ -18,12 +35,52 @@ app = FastAPI(
     version=settings.app_version
 )
 
+warm_up.add("database", ensure_db)
+warm_up.add("gemini", lambda: gemini_service.model)
+warm_up.add("properties", property_service.load)
+warm_up.add("flows", state_machine.load)
+
+
+async def _warm_up_then_start_jobs():
+    await warm_up.run()
+    # Background jobs need the schema, so they start once it exists
+    if settings.retention_enabled:
+        asyncio.create_task(retention_service.run_periodically())
+    if settings.email_outbox_enabled:
+        asyncio.create_task(email_outbox.run_periodically())
+    print(f"✅ Warm-up finished: {warm_up.report()['status']}")
+
+
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    loop_monitor.start()
+    asyncio.create_task(_warm_up_then_start_jobs())
     print(f"🚀 {settings.app_name} v{settings.app_version} started successfully!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    email_service.pool.close_all()
+    if tracer.exporter is not None:
+        tracer.exporter.flush()
+
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request, exc: LLMOverloaded):
+    """Shed LLM work fails fast with 503 + Retry-After instead of hanging on a saturated Gemini"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The assistant is busy right now; please try again shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+# Rate limits (inside idempotency, so replayed retries don't spend budget)
+app.add_middleware(RateLimitMiddleware)
+
+# Idempotency-Key replays (inside CORS, so replayed responses still get fresh CORS headers)
+app.add_middleware(IdempotencyMiddleware, path_prefix="/api/v2/")
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -33,8 +90,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Event loop stall attribution (which request a blocking task was serving)
+if settings.loop_monitor_enabled:
+    app.add_middleware(LoopMonitorMiddleware)
+
+# Tracing (root span per request)
+if settings.tracing_enabled:
+    app.add_middleware(TracingMiddleware)
+
+# Metrics (outermost, so timings include every other middleware)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    for shard_engine in engines.values():
+        instrument_engine(shard_engine)
+
+    # Cache stats are read from the caches themselves at scrape time
+    registry.register(Counter("cache_hits_total", "Cache hits by cache", ("cache",), fn=lambda: {
+        "session": session_cache.hits,
+        "ai_prefetch": ai_prefetcher.hits,
+        "idempotency": idempotency_store.hits,
+        "ai_answer": ai_service.cache_hits
+    }))
+    registry.register(Counter("cache_misses_total", "Cache misses by cache", ("cache",), fn=lambda: {
+        "session": session_cache.misses,
+        "ai_prefetch": ai_prefetcher.misses,
+        "idempotency": idempotency_store.misses,
+        "ai_answer": ai_service.cache_misses
+    }))
+    registry.register(Counter("rate_limited_requests_total", "Requests rejected with 429",
+                              fn=lambda: {(): rate_limiter.rejected}))
+    registry.register(Gauge("ai_prefetch_in_flight", "Speculative Ask AI answers being generated",
+                            fn=lambda: {(): ai_prefetcher.stats()["in_flight"]}))
+
 app.include_router(chat.router)  
 app.include_router(chat_v2.router)
+app.include_router(chat_ws.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
@@ -46,8 +137,24 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving (it may still be warming up)"""
     return {"status": "ok"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the startup warm-up finished, 503 (with per-step status) until then"""
+    report = warm_up.report()
+    if not warm_up.ready:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/test-gemini")
 async def test_gemini():
     """Test endpoint to verify Gemini API connection"""
@@ -60,36 +167,12 @@ class ChatRequest(BaseModel):
 @app.post("/api/chat-test")
 async def chat_test(request: ChatRequest):
     """Simple test endpoint for chatting with Gemini"""
-    response = await gemini_service.generate_response(request.message)
+    response = await gemini_service.generate_response(request.message, call_site="test")
     return {
         "user_message": request.message,
         "ai_response": response
     }
     
-@app.get("/api/admin/leads")
-async def get_all_leads(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Admin endpoint to view all leads"""
-    leads = db_service.get_all_leads(db, skip=skip, limit=limit)
-    return {
-        "total": len(leads),
-        "leads": [
-            {
-                "id": lead.id,
-                "name": lead.name,
-                "email": lead.email,
-                "phone": lead.phone,
-                "purpose": lead.purpose,
-                "location": lead.location,
-                "budget": lead.budget,
-                "timeline": lead.timeline,
-                "lead_status": lead.lead_status,
-                "is_qualified": lead.is_qualified,
-                "created_at": lead.created_at.isoformat()
-            }
-            for lead in leads
-        ]
-    }
-    
 @app.get("/api/test/greeting")
 async def test_greeting():
     """Test new greeting with categories"""
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -7,7 +7,7 @@ Base = declarative_base()
 class Lead(Base):
     __tablename__ = "leads"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True)  # With sharding, shard * 2**40 + n (unique across shards)
     session_id = Column(String(100), unique=True, index=True)
     
     # Lead Information
@@ -34,6 +34,14 @@ class Lead(Base):
     
     # Additional Info
     notes = Column(Text, nullable=True)  # Any additional information captured
+    
+    __table_args__ = (
+        # Admin listing: keyset order by (created_at, id), optionally filtered
+        Index("ix_leads_created_at_id", "created_at", "id"),
+        Index("ix_leads_status_created_at_id", "lead_status", "created_at", "id"),
+        Index("ix_leads_qualified_created_at_id", "is_qualified", "created_at", "id"),
+        Index("ix_leads_purpose_created_at_id", "purpose", "created_at", "id"),
+    )
 
 
 class ChatMessage(Base):
@@ -50,6 +58,11 @@ class ChatMessage(Base):
     # Metadata
     intent = Column(String(100), nullable=True)  # Detected intent: 'greeting', 'inquiry', 'objection', etc.
     sentiment = Column(String(50), nullable=True)  # 'positive', 'neutral', 'negative'
+    
+    __table_args__ = (
+        # Covers history reads: filter by session, keyset order by (timestamp, id)
+        Index("ix_chat_messages_session_timestamp_id", "session_id", "timestamp", "id"),
+    )
 
 
 class ChatSession(Base):
@@ -60,7 +73,7 @@ class ChatSession(Base):
     
     # Session Info
     started_at = Column(DateTime, default=datetime.utcnow)
-    ended_at = Column(DateTime, nullable=True)
+    ended_at = Column(DateTime, nullable=True, index=True)
     is_active = Column(Boolean, default=True)
     
     # Tracking
@@ -72,4 +85,56 @@ class ChatSession(Base):
     
     # User Info (optional, for analytics)
     user_ip = Column(String(50), nullable=True)
-    user_agent = Column(String(500), nullable=True)
\ No newline at end of file
+    user_agent = Column(String(500), nullable=True)
+
+
+class ChatArchive(Base):
+    __tablename__ = "chat_archives"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(100), unique=True, index=True)
+    
+    # Archive Info
+    message_count = Column(Integer, default=0)
+    first_message_at = Column(DateTime, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    # gzip-compressed JSON list of the session's messages, oldest first
+    payload = Column(LargeBinary)
+
+
+class Counter(Base):
+    __tablename__ = "counters"
+    
+    # Maintained row counts (e.g. 'leads'), updated in the same transaction as the rows
+    name = Column(String(100), primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(100), index=True)  # Keeps the row on its lead's shard
+    
+    # Message
+    kind = Column(String(50))  # 'lead_notification', 'lead_digest_item'
+    to_email = Column(String(200))
+    subject = Column(String(500))
+    body_html = Column(Text)  # Digest items hold just the lead's fragments
+    body_text = Column(Text, nullable=True)  # Plain-text alternative
+    payload = Column(Text, nullable=True)  # JSON of the data the email was rendered from
+    
+    # Delivery
+    status = Column(String(20), default="pending")  # 'pending', 'digest', 'digest_sending', 'sent', 'failed'
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # The worker's due-message scan
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
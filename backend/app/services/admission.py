@@ -0,0 +1,107 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from app.config import get_settings
+from app.services.metrics import registry, Counter, Gauge, Histogram
+import asyncio
+import time
+
+settings = get_settings()
+
+
+class LLMOverloaded(Exception):
+    """The LLM path is saturated; the request was shed instead of queued (served as 503)"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM capacity exhausted ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps concurrent LLM calls at `max_concurrent`, with a FIFO queue of at
+    most `max_queue` waiters, each waiting at most `max_wait_seconds`.
+    A call that finds the queue full (or times out in it) fails fast with
+    LLMOverloaded, so a slow Gemini can't pile up unbounded requests; work
+    that doesn't call the LLM never touches this and keeps flowing.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 32, max_wait_seconds: float = 10, retry_after: int = 5):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, wait: bool = True):
+        """Hold one LLM slot for the block; `wait=False` sheds instead of queueing (speculative work)"""
+        await self.acquire(wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, wait: bool = True):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return
+        if not wait:
+            return self._shed("busy")
+        if len(self._waiters) >= self.max_queue:
+            return self._shed("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            # release() hands its slot straight to the first waiter, so `active` is already counted
+            await asyncio.wait_for(waiter, self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            return self._shed("timeout")
+        except asyncio.CancelledError:
+            self._discard(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # Got the slot just as we were cancelled
+            raise
+        finally:
+            llm_queue_wait.observe(time.perf_counter() - start)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _shed(self, reason: str):
+        llm_shed.inc(reason=reason)
+        raise LLMOverloaded(reason, self.retry_after)
+
+
+llm_queue_wait = registry.register(Histogram("llm_queue_wait_seconds", "Time LLM calls spent queued for a slot"))
+llm_shed = registry.register(Counter("llm_shed_total", "LLM calls rejected by admission control, by reason", ("reason",)))
+
+# Singleton instance
+llm_admission = AdmissionController(
+    max_concurrent=settings.llm_max_concurrent,
+    max_queue=settings.llm_max_queue,
+    max_wait_seconds=settings.llm_max_queue_wait_seconds,
+    retry_after=settings.llm_retry_after_seconds
+)
+
+registry.register(Gauge("llm_in_flight", "LLM calls holding a slot", fn=lambda: {(): llm_admission.active}))
+registry.register(Gauge("llm_queue_depth", "LLM calls waiting for a slot", fn=lambda: {(): llm_admission.queued}))
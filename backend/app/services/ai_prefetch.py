@@ -0,0 +1,174 @@
+from collections import deque
+from typing import Dict, Optional
+from app.config import get_settings
+from app.services.ai_service import ai_service
+from app.services.session_cache import LeadSnapshot
+import asyncio
+import functools
+import time
+
+settings = get_settings()
+
+# Quick-reply questions offered on the Ask AI screen (button value -> question)
+CANNED_QUESTIONS = {
+    "omr_projects": "What are the ongoing projects near OMR?",
+    "3bhk_price": "What's the price of your 3BHK apartments?",
+    "ecr_plots": "Do you have plots available in ECR?",
+}
+
+
+def personalize(question: str, lead: Optional[LeadSnapshot]) -> str:
+    """Add the lead's stated location / budget to a canned question"""
+    if not lead:
+        return question
+
+    details = []
+    if lead.location:
+        details.append(f"I'm interested in {lead.location}")
+    if lead.budget:
+        details.append(f"my budget is {lead.budget}")
+    if not details:
+        return question
+    return f"{question} ({' and '.join(details)})"
+
+
+class AIPrefetcher:
+    """
+    Speculatively answers the canned Ask AI questions in the background as
+    soon as a session reaches the Ask AI screen, so the answer is ready (or
+    nearly) when the button is clicked.
+
+    Bounded three ways: at most `max_per_session` prefetches per session,
+    `max_in_flight` Gemini calls at once and `per_minute` calls per minute
+    across all sessions, so speculation never eats the quota real questions
+    need. Unclaimed answers are cancelled when the session leaves the flow
+    and expire after `ttl_seconds`.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_per_session: int = 3,
+        max_in_flight: int = 10,
+        per_minute: int = 30,
+        ttl_seconds: float = 600
+    ):
+        self.enabled = enabled
+        self.max_per_session = max_per_session
+        self.max_in_flight = max_in_flight
+        self.per_minute = per_minute
+        self.ttl_seconds = ttl_seconds
+        self._tasks: Dict[str, Dict[str, asyncio.Task]] = {}
+        self._expires: Dict[str, float] = {}
+        self._started: Dict[str, int] = {}  # Prefetches started per session, until it expires
+        self._recent = deque()  # Start times of prefetches in the last minute
+        self._next_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self, session_id: str, lead: Optional[LeadSnapshot]) -> int:
+        """Begin prefetching answers for a session; returns how many were started"""
+        if not self.enabled:
+            return 0
+        self._purge_expired()
+
+        tasks = self._tasks.setdefault(session_id, {})
+        self._expires[session_id] = time.monotonic() + self.ttl_seconds
+        started = 0
+
+        for key, question in CANNED_QUESTIONS.items():
+            if key in tasks:
+                continue
+            personalized = personalize(question, lead)
+            cached = await ai_service.cached_answer(personalized)
+            if cached is not None:
+                # Already answered for another session (or by another worker): no Gemini call needed
+                tasks[key] = asyncio.get_running_loop().create_future()
+                tasks[key].set_result(cached)
+                continue
+            if self._started.get(session_id, 0) >= self.max_per_session or not self._has_quota():
+                break
+
+            task = asyncio.create_task(
+                ai_service.answer_question(personalized, call_site="ask_ai_prefetch", cache=True)
+            )
+            task.add_done_callback(functools.partial(self._on_done, session_id, key))
+            tasks[key] = task
+            self._started[session_id] = self._started.get(session_id, 0) + 1
+            self._recent.append(time.monotonic())
+            started += 1
+
+        return started
+
+    async def take(self, session_id: str, key: str) -> Optional[str]:
+        """Claim a prefetched answer (waiting if it's still being generated); None if there isn't one"""
+        self._purge_expired()
+        task = self._tasks.get(session_id, {}).pop(key, None)
+        if task is None or task.cancelled():
+            self.misses += 1
+            return None
+
+        try:
+            answer = await task
+        except Exception as e:
+            print(f"Prefetched answer failed for session {session_id}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return answer
+
+    def cancel(self, session_id: str):
+        """Drop a session's unclaimed prefetches (it left the Ask AI flow)"""
+        for task in self._tasks.pop(session_id, {}).values():
+            task.cancel()
+        self._purge_expired()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._tasks),
+            "in_flight": self._in_flight(),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _has_quota(self) -> bool:
+        cutoff = time.monotonic() - 60
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        return len(self._recent) < self.per_minute and self._in_flight() < self.max_in_flight
+
+    def _in_flight(self) -> int:
+        return sum(not task.done() for tasks in self._tasks.values() for task in tasks.values())
+
+    def _on_done(self, session_id: str, key: str, task: asyncio.Task):
+        """Drop a prefetch that failed (e.g. shed under load), so it isn't left unclaimed or counted"""
+        if task.cancelled() or task.exception() is None:
+            return
+        print(f"Prefetch of '{key}' failed for session {session_id}: {task.exception()}")
+        tasks = self._tasks.get(session_id)
+        if tasks is not None and tasks.get(key) is task:
+            del tasks[key]
+        if self._started.get(session_id):
+            self._started[session_id] -= 1
+
+    def _purge_expired(self):
+        """Forget sessions past their TTL (scans every session, so at most once a second)"""
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + 1
+        for session_id in [s for s, expires in self._expires.items() if expires < now]:
+            for task in self._tasks.pop(session_id, {}).values():
+                task.cancel()
+            del self._expires[session_id]
+            self._started.pop(session_id, None)
+
+
+# Singleton instance
+ai_prefetcher = AIPrefetcher(
+    enabled=settings.ai_prefetch_enabled,
+    max_per_session=settings.ai_prefetch_max_per_session,
+    max_in_flight=settings.ai_prefetch_max_in_flight,
+    per_minute=settings.ai_prefetch_per_minute,
+    ttl_seconds=settings.ai_prefetch_ttl_seconds
+)
@@ -1,17 +1,73 @@
-from app.services.gemini_service import gemini_service
+from typing import AsyncIterator, Optional
+from app.config import get_settings
+from app.services.gemini_service import gemini_service, FALLBACK_RESPONSE
 from app.services.property_service import property_service
+from app.services.shared_cache import shared_cache
+import hashlib
 import json
 
+settings = get_settings()
+
 class AIService:
     
-    async def answer_question(self, question: str, conversation_history: list = None) -> str:
-        """Answer user question using property context + LLM"""
+    def __init__(self, answer_cache=None, answer_ttl_seconds: float = 3600):
+        # Answers that depend on the prompt alone (no history), shared by sessions and, with redis, workers
+        self.answer_cache = answer_cache
+        self.answer_ttl_seconds = answer_ttl_seconds
+        self.cache_hits = 0
+        self.cache_misses = 0
+    
+    async def answer_question(self, question: str, conversation_history: list = None, call_site: str = "ask_ai",
+                              cache: bool = False) -> str:
+        """Answer user question using property context + LLM (`cache`: reuse / store a history-free answer)"""
+        
+        prompt = self._build_prompt(question)
+        if cache:
+            cached = await self._cached(prompt)
+            if cached is not None:
+                return cached
+        
+        response = await gemini_service.generate_response(
+            prompt=prompt,
+            conversation_history=conversation_history or [],
+            call_site=call_site
+        )
+        
+        if cache and not conversation_history and response != FALLBACK_RESPONSE and self.answer_cache is not None:
+            await self.answer_cache.set(_prompt_key(prompt), response.encode("utf-8"), self.answer_ttl_seconds)
+        return response
+    
+    async def cached_answer(self, question: str) -> Optional[str]:
+        """A previously generated answer to exactly this question, if one is cached"""
+        return await self._cached(self._build_prompt(question))
+    
+    async def _cached(self, prompt: str) -> Optional[str]:
+        if self.answer_cache is None:
+            return None
+        raw = await self.answer_cache.get(_prompt_key(prompt))
+        if raw is None:
+            self.cache_misses += 1
+            return None
+        self.cache_hits += 1
+        return raw.decode("utf-8")
+    
+    async def stream_answer(self, question: str, conversation_history: list = None) -> AsyncIterator[str]:
+        """Same as answer_question, yielding the answer in chunks as it is generated"""
+        async for chunk in gemini_service.stream_response(
+            prompt=self._build_prompt(question),
+            conversation_history=conversation_history or [],
+            call_site="ask_ai_stream"
+        ):
+            yield chunk
+    
+    def _build_prompt(self, question: str) -> str:
+        """Prompt with the property context relevant to the question"""
         
         # Get property context (simple keyword matching for now)
         property_context = self._get_relevant_properties(question)
         
         # Build prompt with context
-        prompt = f"""You are Maya, a helpful real estate assistant for DreamHome Realty in Chennai.
+        return f"""You are Maya, a helpful real estate assistant for DreamHome Realty in Chennai.
 
 USER QUESTION: {question}
 
@@ -26,13 +82,6 @@ Instructions:
 - If relevant, mention specific properties by name
 
 Your response:"""
-        
-        response = await gemini_service.generate_response(
-            prompt=prompt,
-            conversation_history=conversation_history or []
-        )
-        
-        return response
     
     def _get_relevant_properties(self, question: str) -> str:
         """Get relevant properties based on question keywords"""
@@ -71,5 +120,13 @@ Description: {p.get('description', 'N/A')}
         
         return "\n".join(context)
 
+
+def _prompt_key(prompt: str) -> str:
+    # The prompt embeds the property context, so a catalog change also changes the key
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
 # Singleton
-ai_service = AIService()
\ No newline at end of file
+ai_service = AIService(
+    answer_cache=shared_cache("answers", max_entries=settings.ai_answer_cache_size),
+    answer_ttl_seconds=settings.ai_answer_cache_ttl_seconds
+)
\ No newline at end of file
@@ -0,0 +1,44 @@
+from collections import defaultdict
+from typing import Any, Dict, Set
+from fastapi import WebSocket
+
+
+class ConnectionManager:
+    """
+    Open widget WebSockets by session_id, so server-side events (agent
+    handoff, ...) can be pushed to a session. Per process: with several
+    workers an event only reaches connections held by the worker it runs in.
+    """
+
+    def __init__(self):
+        self._connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+
+    def register(self, session_id: str, websocket: WebSocket):
+        self._connections[session_id].add(websocket)
+
+    def unregister(self, session_id: str, websocket: WebSocket):
+        connections = self._connections.get(session_id)
+        if connections is None:
+            return
+        connections.discard(websocket)
+        if not connections:
+            del self._connections[session_id]
+
+    def is_connected(self, session_id: str) -> bool:
+        return session_id in self._connections
+
+    async def push(self, session_id: str, event: Dict[str, Any]) -> int:
+        """Send an event to every connection of a session; returns how many received it"""
+        delivered = 0
+        for websocket in list(self._connections.get(session_id, ())):
+            try:
+                await websocket.send_json(event)
+                delivered += 1
+            except Exception as e:
+                print(f"Dropping WebSocket for session {session_id}: {e}")
+                self.unregister(session_id, websocket)
+        return delivered
+
+
+# Singleton instance
+connection_manager = ConnectionManager()
@@ -1,4 +1,5 @@
 from app.services.gemini_service import gemini_service
+from app.services.admission import LLMOverloaded
 
 import json
 import re
@@ -42,7 +43,8 @@ class ConversationService:
         # Generate response
         response = await gemini_service.generate_response(
             prompt=full_prompt,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            call_site="answer"
         )
         
         return {
@@ -105,7 +107,7 @@ class ConversationService:
         )
         
         try:
-            stage = await gemini_service.generate_response(prompt)
+            stage = await gemini_service.generate_response(prompt, call_site="stage")
             stage = stage.strip().upper()
             
             # Validate stage
@@ -117,6 +119,8 @@ class ConversationService:
             else:
                 return "QUALIFICATION"  # Default fallback
                 
+        except LLMOverloaded:
+            raise  # Shed the whole turn rather than guess the stage
         except Exception as e:
             print(f"Error detecting stage: {e}")
             return "QUALIFICATION"
@@ -131,7 +135,7 @@ class ConversationService:
         )
         
         try:
-            response = await gemini_service.generate_response(prompt)
+            response = await gemini_service.generate_response(prompt, call_site="extraction")
             
             # Clean the response - remove markdown code blocks if present
             cleaned_response = response.strip()
@@ -159,6 +163,8 @@ class ConversationService:
             print(f"JSON decode error: {je}")
             print(f"Response was: {response}")
             return {}
+        except LLMOverloaded:
+            raise
         except Exception as e:
             print(f"Error extracting lead data: {e}")
             print(f"Response was: {response if 'response' in locals() else 'No response'}")
@@ -1,4 +1,5 @@
 from app.services.gemini_service import gemini_service
+from app.services.admission import LLMOverloaded
 from app.prompts.system_prompts import (
     GREETING_MESSAGE,
     LEAD_CAPTURE_MESSAGE,
@@ -118,7 +119,8 @@ class ConversationServiceV2:
         try:
             response = await gemini_service.generate_response(
                 prompt=full_prompt,
-                conversation_history=conversation_history or []
+                conversation_history=conversation_history or [],
+                call_site="category_answer"
             )
             
             return {
@@ -127,6 +129,8 @@ class ConversationServiceV2:
                 "category": category
             }
             
+        except LLMOverloaded:
+            raise
         except Exception as e:
             print(f"Error generating response: {e}")
             return {
@@ -1,9 +1,18 @@
+from sqlalchemy import and_, or_, update, insert, select, func
 from sqlalchemy.orm import Session
-from app.models.lead import Lead, ChatMessage, ChatSession
+from app.database import shard_ids, shard_for, shard_id_range
+from app.models.lead import Lead, ChatMessage, ChatSession, Counter
+from app.services.session_cache import session_cache, LeadSnapshot, SessionSnapshot, MISSING
+from app.services.tracing import tracer
+from contextlib import contextmanager
+from dataclasses import replace
 from datetime import datetime
 import uuid
 import json
-from typing import Any
+from typing import Any, Iterator, Optional
+
+# Session.info flag set while transaction() is open: writers flush instead of committing
+UNIT_OF_WORK = "unit_of_work"
 
 class DatabaseService:
     
@@ -18,7 +27,9 @@ class DatabaseService:
             user_agent=user_agent
         )
         db.add(chat_session)
-        db.commit()
+        DatabaseService._commit(db)
+        
+        session_cache.set("session", session_id, SessionSnapshot(session_id=session_id))
         
         return session_id
     
@@ -33,21 +44,100 @@ class DatabaseService:
         )
         db.add(chat_message)
         
-        # Update session message count
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        if session:
-            session.message_count += 1
+        # Update session message count in place (no SELECT)
+        db.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id)
+            .values(message_count=ChatSession.message_count + 1)
+        )
         
-        db.commit()
+        DatabaseService._commit(db)
     
     @staticmethod
-    def get_conversation_history(db: Session, session_id: str, limit: int = 20) -> list:
-        """Get conversation history for a session"""
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.timestamp.desc()).limit(limit).all()
+    def get_conversation_history(
+        db: Session,
+        session_id: str,
+        limit: int = 20,
+        before: str = None,
+        after: str = None,
+        since: datetime = None
+    ) -> list:
+        """Get conversation history for a session (oldest first)"""
+        page = DatabaseService.get_conversation_page(
+            db, session_id, limit=limit, before=before, after=after, since=since
+        )
+        return page["messages"]
+    
+    @staticmethod
+    def get_conversation_page(
+        db: Session,
+        session_id: str,
+        limit: int = 20,
+        before: str = None,
+        after: str = None,
+        since: datetime = None
+    ) -> dict:
+        """
+        Keyset-paginated conversation history, served from the
+        (session_id, timestamp, id) index.
+        
+        - no cursor: latest `limit` messages
+        - before: `limit` messages older than the cursor
+        - after / since: `limit` messages newer than the cursor / timestamp
+        
+        Messages are always returned oldest first. Raises ValueError on a bad cursor.
+        """
+        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        
+        if before:
+            ts, msg_id = DatabaseService.decode_cursor(before)
+            query = query.filter(or_(
+                ChatMessage.timestamp < ts,
+                and_(ChatMessage.timestamp == ts, ChatMessage.id < msg_id)
+            ))
+        if after:
+            ts, msg_id = DatabaseService.decode_cursor(after)
+            query = query.filter(or_(
+                ChatMessage.timestamp > ts,
+                and_(ChatMessage.timestamp == ts, ChatMessage.id > msg_id)
+            ))
+        if since:
+            query = query.filter(ChatMessage.timestamp > since)
+        
+        # Walk forward when polling for newer messages, backward otherwise
+        forward = bool(after or since) and not before
+        if forward:
+            query = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+        else:
+            query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
         
-        return list(reversed(messages))
+        # Fetch one extra row to know whether another page exists
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+        if not forward:
+            messages.reverse()
+        
+        return {
+            "messages": messages,
+            "has_more": has_more,
+            "before": DatabaseService.encode_cursor(messages[0].timestamp, messages[0].id) if messages else before,
+            "after": DatabaseService.encode_cursor(messages[-1].timestamp, messages[-1].id) if messages else after
+        }
+    
+    @staticmethod
+    def encode_cursor(timestamp: datetime, row_id: int) -> str:
+        """Opaque keyset cursor pointing at a (timestamp, id) position"""
+        return f"{timestamp.isoformat()}_{row_id}"
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        """Decode a cursor produced by encode_cursor"""
+        try:
+            ts, row_id = cursor.rsplit("_", 1)
+            return datetime.fromisoformat(ts), int(row_id)
+        except (ValueError, AttributeError):
+            raise ValueError(f"Invalid cursor: {cursor}")
     
     @staticmethod
     def create_or_update_lead(db: Session, session_id: str, lead_data: dict) -> Lead:
@@ -63,29 +153,271 @@ class DatabaseService:
         else:
             # Create new lead
             lead = Lead(session_id=session_id, **lead_data)
+            if len(shard_ids()) > 1:
+                lead.id = DatabaseService._next_lead_id(shard_for(session_id))
             db.add(lead)
-        
-        db.commit()
-        db.refresh(lead)
+            DatabaseService._increment_counter(db, "leads", shard_for(session_id))
         
         # Mark session as lead captured
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        if session:
-            session.lead_captured = True
-            db.commit()
+        db.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id)
+            .values(lead_captured=True)
+        )
+        
+        DatabaseService._commit(db)
+        
+        db.refresh(lead)
+        session_cache.set("lead", session_id, LeadSnapshot.from_lead(lead))
+        session_cache.invalidate("session", session_id)
         
         return lead
     
+    @staticmethod
+    def update_lead(db: Session, session_id: str, lead_data: dict) -> LeadSnapshot:
+        """
+        Update fields of an existing lead with a single UPDATE (no SELECT) and
+        return the refreshed snapshot. Creates the lead if it doesn't exist yet.
+        """
+        values = {key: value for key, value in lead_data.items() if value is not None}
+        values["updated_at"] = datetime.utcnow()
+        
+        result = db.execute(
+            update(Lead).where(Lead.session_id == session_id).values(**values)
+        )
+        if result.rowcount == 0:
+            lead = DatabaseService.create_or_update_lead(db, session_id, lead_data)
+            return LeadSnapshot.from_lead(lead)
+        
+        DatabaseService._commit(db)
+        
+        cached = session_cache.get("lead", session_id)
+        if cached is None:
+            return DatabaseService.get_lead_snapshot(db, session_id)
+        
+        snapshot_fields = {k: v for k, v in values.items() if k in LeadSnapshot.__dataclass_fields__}
+        snapshot = replace(cached, **snapshot_fields)
+        session_cache.set("lead", session_id, snapshot)
+        return snapshot
+    
     @staticmethod
     def get_lead_by_session(db: Session, session_id: str) -> Lead:
         """Get lead by session_id"""
         return db.query(Lead).filter(Lead.session_id == session_id).first()
     
+    @staticmethod
+    def get_lead_snapshot(db: Session, session_id: str) -> Optional[LeadSnapshot]:
+        """
+        Cached, read-only view of a session's lead (None if there is no lead yet).
+        Only an existing lead is cached: another worker may create it at any
+        moment, and a cached "no lead" would re-ask for it and re-notify.
+        """
+        cached = session_cache.get("lead", session_id)
+        if cached is not None:
+            return cached
+        
+        lead = DatabaseService.get_lead_by_session(db, session_id)
+        if not lead:
+            return None
+        
+        snapshot = LeadSnapshot.from_lead(lead)
+        session_cache.set("lead", session_id, snapshot)
+        return snapshot
+    
+    @staticmethod
+    def get_session_snapshot(db: Session, session_id: str) -> Optional[SessionSnapshot]:
+        """Cached, read-only view of a chat session (None if it doesn't exist)"""
+        cached = session_cache.get("session", session_id)
+        if cached is not None:
+            return None if cached is MISSING else cached
+        
+        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        if not session:
+            session_cache.set("session", session_id, MISSING)
+            return None
+        
+        context = {}
+        if session.context_data:
+            try:
+                context = json.loads(session.context_data)
+            except ValueError:
+                context = {}
+        
+        snapshot = SessionSnapshot(
+            session_id=session_id,
+            is_active=session.is_active,
+            lead_captured=session.lead_captured,
+            context=context
+        )
+        session_cache.set("session", session_id, snapshot)
+        return snapshot
+    
     @staticmethod
     def get_all_leads(db: Session, skip: int = 0, limit: int = 100):
         """Get all leads (for admin dashboard)"""
         return db.query(Lead).order_by(Lead.created_at.desc()).offset(skip).limit(limit).all()
     
+    @staticmethod
+    def get_leads_page(
+        db: Session,
+        limit: int = 100,
+        cursor: str = None,
+        lead_status: str = None,
+        is_qualified: bool = None,
+        purpose: str = None,
+        created_from: datetime = None,
+        created_to: datetime = None
+    ) -> dict:
+        """
+        Newest-first page of leads, keyset-paginated on (created_at, id).
+        With sharding on, each shard returns its own page and they're merged.
+        Raises ValueError on a bad cursor.
+        """
+        stmt = DatabaseService._filter_leads(
+            select(Lead), lead_status, is_qualified, purpose, created_from, created_to
+        )
+        
+        if cursor:
+            ts, lead_id = DatabaseService.decode_cursor(cursor)
+            stmt = stmt.filter(or_(
+                Lead.created_at < ts,
+                and_(Lead.created_at == ts, Lead.id < lead_id)
+            ))
+        
+        stmt = stmt.order_by(Lead.created_at.desc(), Lead.id.desc()).limit(limit + 1)
+        
+        rows = []
+        for shard_id in shard_ids():
+            rows.extend(db.execute(stmt, bind_arguments={"shard_id": shard_id}).scalars().all())
+        if len(shard_ids()) > 1:
+            rows.sort(key=lambda lead: (lead.created_at, lead.id), reverse=True)
+            rows = rows[:limit + 1]
+        
+        leads = rows[:limit]
+        
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = DatabaseService.encode_cursor(leads[-1].created_at, leads[-1].id)
+        
+        return {"leads": leads, "next_cursor": next_cursor}
+    
+    @staticmethod
+    def iter_leads(
+        db: Session,
+        batch_size: int = 1000,
+        lead_status: str = None,
+        is_qualified: bool = None,
+        purpose: str = None,
+        created_from: datetime = None,
+        created_to: datetime = None
+    ) -> Iterator[Lead]:
+        """Yield every matching lead newest first, one keyset batch at a time"""
+        cursor = None
+        while True:
+            page = DatabaseService.get_leads_page(
+                db,
+                limit=batch_size,
+                cursor=cursor,
+                lead_status=lead_status,
+                is_qualified=is_qualified,
+                purpose=purpose,
+                created_from=created_from,
+                created_to=created_to
+            )
+            yield from page["leads"]
+            
+            # Drop the batch from the identity map so memory stays flat
+            db.expunge_all()
+            
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+    
+    @staticmethod
+    def count_leads(
+        db: Session,
+        lead_status: str = None,
+        is_qualified: bool = None,
+        purpose: str = None,
+        created_from: datetime = None,
+        created_to: datetime = None
+    ) -> int:
+        """Total leads matching the filters; unfiltered totals come from the counter"""
+        filters = (lead_status, is_qualified, purpose, created_from, created_to)
+        if all(f is None for f in filters):
+            return DatabaseService.get_counter(db, "leads")
+        
+        stmt = DatabaseService._filter_leads(select(func.count(Lead.id)), *filters)
+        return sum(
+            db.execute(stmt, bind_arguments={"shard_id": shard_id}).scalar()
+            for shard_id in shard_ids()
+        )
+    
+    @staticmethod
+    def _filter_leads(
+        query,
+        lead_status: Optional[str],
+        is_qualified: Optional[bool],
+        purpose: Optional[str],
+        created_from: Optional[datetime],
+        created_to: Optional[datetime]
+    ):
+        """Apply admin lead filters (each backed by a leads index)"""
+        if lead_status is not None:
+            query = query.filter(Lead.lead_status == lead_status)
+        if is_qualified is not None:
+            query = query.filter(Lead.is_qualified == is_qualified)
+        if purpose is not None:
+            query = query.filter(Lead.purpose == purpose)
+        if created_from is not None:
+            query = query.filter(Lead.created_at >= created_from)
+        if created_to is not None:
+            query = query.filter(Lead.created_at < created_to)
+        return query
+    
+    @staticmethod
+    def get_counter(db: Session, name: str) -> int:
+        """Read a maintained counter (summed across shards)"""
+        stmt = select(Counter.value).where(Counter.name == name)
+        return sum(
+            db.execute(stmt, bind_arguments={"shard_id": shard_id}).scalar() or 0
+            for shard_id in shard_ids()
+        )
+    
+    @staticmethod
+    def seed_counters(db: Session):
+        """Initialise counters from the tables they track if they don't exist yet"""
+        for shard_id in shard_ids():
+            bind_arguments = {"shard_id": shard_id}
+            exists = db.execute(
+                select(Counter.name).where(Counter.name == "leads"), bind_arguments=bind_arguments
+            ).first()
+            if not exists:
+                count = db.execute(select(func.count(Lead.id)), bind_arguments=bind_arguments).scalar()
+                db.execute(insert(Counter).values(name="leads", value=count), bind_arguments=bind_arguments)
+        DatabaseService._commit(db)
+    
+    @staticmethod
+    def _next_lead_id(shard_id: str):
+        """Next id in the shard's own range, computed inside the INSERT (so under its write lock)"""
+        low, high = shard_id_range(shard_id)
+        return (
+            select(func.coalesce(func.max(Lead.id), low) + 1)
+            .where(Lead.id > low, Lead.id <= high)
+            .scalar_subquery()
+        )
+    
+    @staticmethod
+    def _increment_counter(db: Session, name: str, shard_id: str, amount: int = 1):
+        """Bump a counter on one shard inside the caller's transaction"""
+        bind_arguments = {"shard_id": shard_id}
+        updated = db.execute(
+            update(Counter).where(Counter.name == name).values(value=Counter.value + amount),
+            bind_arguments=bind_arguments
+        ).rowcount
+        if not updated:
+            db.execute(insert(Counter).values(name=name, value=amount), bind_arguments=bind_arguments)
+    
     @staticmethod
     def end_session(db: Session, session_id: str):
         """Mark a session as ended"""
@@ -93,40 +425,83 @@ class DatabaseService:
         if session:
             session.is_active = False
             session.ended_at = datetime.utcnow()
-            db.commit()
+            DatabaseService._commit(db)
+        session_cache.invalidate("session", session_id)
             
     @staticmethod
     def update_session_context(db: Session, session_id: str, context_key: str, context_value: Any):
-        """Update session context data"""
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        if session:
-            # Parse existing context
-            context = {}
-            if session.context_data:
-                try:
-                    context = json.loads(session.context_data)
-                except:
-                    context = {}
-            
-            # Update context
-            context[context_key] = context_value
-            session.context_data = json.dumps(context)
-            db.commit()
+        """
+        Set one key of the session's context data. Patched in place with
+        json_set, so keys other workers wrote meanwhile are kept.
+        """
+        row = db.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id)
+            .values(context_data=func.json_set(
+                func.coalesce(ChatSession.context_data, "{}"),
+                "$." + json.dumps(context_key),
+                func.json(json.dumps(context_value))
+            ))
+            .returning(ChatSession.context_data)
+        ).first()
+        DatabaseService._commit(db)
+        
+        snapshot = session_cache.get("session", session_id)
+        if row and snapshot and snapshot is not MISSING:
+            session_cache.set("session", session_id, replace(snapshot, context=json.loads(row.context_data)))
+        else:
+            session_cache.invalidate("session", session_id)
 
     @staticmethod
     def get_session_context(db: Session, session_id: str, context_key: str = None):
         """Get session context data"""
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        if not session or not session.context_data:
+        snapshot = DatabaseService.get_session_snapshot(db, session_id)
+        if not snapshot or not snapshot.context:
             return None
         
+        if context_key:
+            return snapshot.context.get(context_key)
+        return dict(snapshot.context)
+
+    @staticmethod
+    @contextmanager
+    def transaction(db: Session, session_id: str) -> Iterator[Session]:
+        """
+        Run several service calls for one session as a single transaction.
+        
+        The methods above commit after each write (through _commit); inside
+        this block they only flush, and one real commit happens on exit. On
+        error everything is rolled back and the session's cached snapshots
+        dropped, since they may describe writes that never landed. Nested
+        blocks join the outer transaction.
+        """
+        if db.info.get(UNIT_OF_WORK):
+            yield db
+            return
+
+        db.info[UNIT_OF_WORK] = True
         try:
-            context = json.loads(session.context_data)
-            if context_key:
-                return context.get(context_key)
-            return context
-        except:
-            return None
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            session_cache.invalidate("lead", session_id)
+            session_cache.invalidate("session", session_id)
+            raise
+        finally:
+            del db.info[UNIT_OF_WORK]
+    
+    @staticmethod
+    def _commit(db: Session):
+        """Commit a write, or only flush it inside transaction(), which commits once on exit"""
+        if db.info.get(UNIT_OF_WORK):
+            db.flush()
+        else:
+            db.commit()
+
+# Span per service call when tracing is on. Skipped: the pure cursor helpers, and the
+# context manager / generator, whose work happens after the call returns
+tracer.trace_methods(DatabaseService, "db", exclude=("transaction", "iter_leads", "encode_cursor", "decode_cursor"))
 
 # Create singleton instance
 db_service = DatabaseService()
\ No newline at end of file
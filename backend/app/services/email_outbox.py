@@ -0,0 +1,211 @@
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.orm import Session
+from app.models.lead import EmailOutbox
+from app.config import get_settings
+from app.database import SessionLocal, shard_ids
+from app.services.email_service import email_service
+from datetime import datetime, timedelta
+import asyncio
+import random
+
+settings = get_settings()
+
+
+class EmailOutboxWorker:
+    """
+    Delivers queued emails from the email_outbox table.
+
+    Each due message is claimed with a conditional UPDATE (pushing its
+    next_attempt_at out by a lease), so several workers never send the same
+    row; a worker that dies mid-send leaves the row to be retried once the
+    lease runs out. Failures back off exponentially (with jitter) until
+    `max_attempts`, then the message is marked failed.
+
+    In digest mode, queued digest items (status 'digest') are held until the
+    oldest has waited `email_digest_window_seconds`, then all of them go out
+    as one email built from their pre-rendered fragments.
+
+    To try it locally, point SMTP_SERVER/SMTP_PORT at a stand-in such as
+    `python -m aiosmtpd -n -l localhost:1025` with SMTP_STARTTLS=false.
+    """
+
+    lease_seconds = 300
+
+    def __init__(self):
+        self.poll_seconds = settings.email_outbox_poll_seconds
+        self.batch_size = settings.email_outbox_batch_size
+        self.max_attempts = settings.email_max_attempts
+        self.retry_base_seconds = settings.email_retry_base_seconds
+        self.retry_max_seconds = settings.email_retry_max_seconds
+        self.digest_max_leads = settings.email_digest_max_leads
+
+    def drain(self, db: Session) -> dict:
+        """Send every message that is due; returns counts by outcome"""
+        result = {"sent": 0, "retrying": 0, "failed": 0}
+
+        for shard_id in shard_ids():
+            bind_arguments = {"shard_id": shard_id}
+            due = db.execute(
+                select(
+                    EmailOutbox.id, EmailOutbox.to_email, EmailOutbox.subject,
+                    EmailOutbox.body_html, EmailOutbox.body_text, EmailOutbox.attempts, EmailOutbox.next_attempt_at
+                ).where(
+                    EmailOutbox.status == "pending",
+                    EmailOutbox.next_attempt_at <= datetime.utcnow()
+                ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(self.batch_size),
+                bind_arguments=bind_arguments
+            ).all()
+
+            for row in due:
+                if not self._claim(db, row, bind_arguments):
+                    continue  # Another worker got it
+
+                outcome = self._deliver(db, row, bind_arguments)
+                result[outcome] += 1
+
+        outcome = self.flush_digest(db)
+        if outcome:
+            result[outcome] += 1
+
+        if any(result.values()):
+            print(f"📧 Outbox: {result['sent']} sent, {result['retrying']} to retry, {result['failed']} failed")
+        return result
+
+    def flush_digest(self, db: Session, force: bool = False) -> str:
+        """
+        Send queued digest items as one email once the oldest is due (or now,
+        if `force`). Returns the outcome, or None if nothing was sent.
+        """
+        now = datetime.utcnow()
+        claimable = or_(
+            EmailOutbox.status == "digest",
+            and_(EmailOutbox.status == "digest_sending", EmailOutbox.next_attempt_at <= now)  # Lease ran out
+        )
+
+        items = []
+        for shard_id in shard_ids():
+            items.extend(
+                (shard_id, row) for row in db.execute(
+                    select(EmailOutbox.id, EmailOutbox.next_attempt_at, EmailOutbox.created_at)
+                    .where(claimable).order_by(EmailOutbox.created_at).limit(self.digest_max_leads),
+                    bind_arguments={"shard_id": shard_id}
+                )
+            )
+        if not items or not (force or min(row.next_attempt_at for _, row in items) <= now):
+            return None
+        items = sorted(items, key=lambda item: item[1].created_at)[:self.digest_max_leads]
+
+        # Claim with a lease value unique to this flush, then read back what we got
+        lease = now + timedelta(seconds=self.lease_seconds, microseconds=random.randrange(1000000))
+        claimed = []
+        for shard_id in {shard_id for shard_id, _ in items}:
+            bind_arguments = {"shard_id": shard_id}
+            db.execute(
+                update(EmailOutbox).where(
+                    EmailOutbox.id.in_([row.id for s, row in items if s == shard_id]), claimable
+                ).values(status="digest_sending", attempts=EmailOutbox.attempts + 1, next_attempt_at=lease),
+                bind_arguments=bind_arguments
+            )
+            db.commit()
+            claimed.extend(
+                (shard_id, row) for row in db.execute(
+                    select(EmailOutbox.id, EmailOutbox.to_email, EmailOutbox.body_html, EmailOutbox.body_text,
+                           EmailOutbox.attempts, EmailOutbox.created_at)
+                    .where(EmailOutbox.status == "digest_sending", EmailOutbox.next_attempt_at == lease),
+                    bind_arguments=bind_arguments
+                )
+            )
+        if not claimed:
+            return None  # Another worker got them
+
+        claimed.sort(key=lambda item: item[1].created_at)
+        subject, body, text = email_service.create_digest([(row.body_html, row.body_text or "") for _, row in claimed])
+        attempts = max(row.attempts for _, row in claimed)
+        try:
+            email_service.send(claimed[0][1].to_email, subject, body, text)
+        except Exception as e:
+            failed = attempts >= self.max_attempts
+            values = {"status": "failed" if failed else "digest", "last_error": f"{type(e).__name__}: {e}"[:1000]}
+            if not failed:
+                values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=self._backoff(attempts))
+            outcome = "failed" if failed else "retrying"
+            print(f"❌ Digest of {len(claimed)} leads, attempt {attempts} failed: {e}")
+        else:
+            values = {"status": "sent", "sent_at": datetime.utcnow(), "last_error": None}
+            outcome = "sent"
+
+        for shard_id in {shard_id for shard_id, _ in claimed}:
+            db.execute(
+                update(EmailOutbox).where(EmailOutbox.status == "digest_sending", EmailOutbox.next_attempt_at == lease).values(**values),
+                bind_arguments={"shard_id": shard_id}
+            )
+        db.commit()
+        return outcome
+
+    def stats(self, db: Session) -> dict:
+        """Outbox row counts by status (all shards)"""
+        counts = {}
+        for shard_id in shard_ids():
+            for status, count in db.execute(
+                select(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status),
+                bind_arguments={"shard_id": shard_id}
+            ):
+                counts[status] = counts.get(status, 0) + count
+        return counts
+
+    async def run_periodically(self):
+        """Background loop: drain the outbox every `poll_seconds` (SMTP runs in a worker thread)"""
+        while True:
+            db = SessionLocal()
+            try:
+                await asyncio.to_thread(self.drain, db)
+            except Exception as e:
+                print(f"Error draining email outbox: {e}")
+            finally:
+                db.close()
+
+            await asyncio.sleep(self.poll_seconds)
+
+    def _claim(self, db: Session, row, bind_arguments: dict) -> bool:
+        claimed = db.execute(
+            update(EmailOutbox).where(
+                EmailOutbox.id == row.id,
+                EmailOutbox.status == "pending",
+                EmailOutbox.next_attempt_at == row.next_attempt_at
+            ).values(
+                attempts=EmailOutbox.attempts + 1,
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+            ),
+            bind_arguments=bind_arguments
+        ).rowcount
+        db.commit()
+        return claimed == 1
+
+    def _deliver(self, db: Session, row, bind_arguments: dict) -> str:
+        attempts = row.attempts + 1
+        try:
+            email_service.send(row.to_email, row.subject, row.body_html, row.body_text)
+        except Exception as e:
+            failed = attempts >= self.max_attempts
+            values = {"last_error": f"{type(e).__name__}: {e}"[:1000]}
+            if failed:
+                values["status"] = "failed"
+            else:
+                values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=self._backoff(attempts))
+            outcome = "failed" if failed else "retrying"
+            print(f"❌ Email {row.id} attempt {attempts} failed: {e}")
+        else:
+            values = {"status": "sent", "sent_at": datetime.utcnow(), "last_error": None}
+            outcome = "sent"
+
+        db.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(**values), bind_arguments=bind_arguments)
+        db.commit()
+        return outcome
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_base_seconds * 2 ** (attempts - 1), self.retry_max_seconds)
+        return delay * random.uniform(0.8, 1.2)
+
+
+# Singleton instance
+email_outbox = EmailOutboxWorker()
@@ -1,11 +1,114 @@
 import smtplib
+import json
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from sqlalchemy.orm import Session
 from app.config import get_settings
-from datetime import datetime
+from app.models.lead import EmailOutbox
+from app.services.email_templates import EmailTemplate
+from app.services.metrics import smtp_send_duration
+from app.services.tracing import tracer, KIND_CLIENT
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
 
 settings = get_settings()
 
+# Compiled once at import; the single-lead chrome is pre-rendered so only the lead block varies
+_TEMPLATES = {name: EmailTemplate.load(name) for name in ("layout.html", "layout.txt", "lead.html", "lead.txt")}
+_LEAD_CHROME = {"title": "🎯 New Lead Alert!", "intro": "A new potential customer has shown interest"}
+_LEAD_HTML = _TEMPLATES["layout.html"].partial(**_LEAD_CHROME)
+_LEAD_TEXT = _TEMPLATES["layout.txt"].partial(**_LEAD_CHROME)
+
+
+def score_lead(lead_data: dict) -> int:
+    """
+    0-100 priority of a lead for notification routing: its stored
+    lead_score if one was set, otherwise how complete its details are.
+    """
+    if lead_data.get("lead_score"):
+        return lead_data["lead_score"]
+    
+    weights = {"email": 20, "phone": 20, "budget": 20, "timeline": 20, "location": 10, "property_type": 10}
+    return sum(weight for field, weight in weights.items() if lead_data.get(field))
+
+
+class SMTPPool:
+    """
+    Reusable SMTP connections, so connect + STARTTLS + login is paid once
+    per connection rather than once per email. Idle connections are checked
+    with NOOP before reuse; a connection that errors is closed, not returned.
+    """
+
+    def __init__(self, server: str, port: int, username: str, password: str,
+                 starttls: bool = True, timeout: float = 30, size: int = 2):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            self._close(conn)
+            raise
+        self._checkin(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(conn)
+
+    def _checkin(self, conn: smtplib.SMTP):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password)
+        except Exception:
+            self._close(conn)
+            raise
+        return conn
+
+    @staticmethod
+    def _close(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
 
 class EmailService:
     
@@ -15,172 +118,117 @@ class EmailService:
         self.smtp_username = settings.smtp_username
         self.smtp_password = settings.smtp_password
         self.admin_email = settings.admin_email
+        self.pool = SMTPPool(
+            server=self.smtp_server,
+            port=self.smtp_port,
+            username=self.smtp_username,
+            password=self.smtp_password,
+            starttls=settings.smtp_starttls,
+            timeout=settings.smtp_timeout_seconds,
+            size=settings.smtp_pool_size
+        )
     
-    async def send_lead_notification(self, lead_data: dict, session_id: str):
-        """Send email notification when a new lead is captured"""
+    def enqueue_lead_notification(self, db: Session, lead_data: dict, session_id: str) -> bool:
+        """
+        Queue the new-lead email in the outbox. Nothing is sent here and nothing
+        is committed: the caller commits, normally in the same transaction as
+        the lead, and the outbox worker delivers it.
+        
+        In digest mode only the lead's fragments are queued, to go out in
+        the next digest; high-score leads still get their own email.
+        """
         
         if not self._is_configured():
             print("⚠️ Email not configured - skipping notification")
             return False
         
-        try:
-            subject = f"🏡 New Real Estate Lead: {lead_data.get('name', 'Unknown')}"
-            
-            body = self._create_lead_email_body(lead_data, session_id)
-            
-            success = self._send_email(
+        fragment_html, fragment_text = self.render_lead(lead_data, session_id, datetime.now())
+        payload = json.dumps(lead_data, default=str)
+        
+        if settings.email_digest_enabled and score_lead(lead_data) < settings.email_digest_immediate_score:
+            db.add(EmailOutbox(
+                session_id=session_id,
+                kind="lead_digest_item",
                 to_email=self.admin_email,
-                subject=subject,
-                body=body
-            )
-            
-            if success:
-                print(f"✅ Lead notification sent for session: {session_id}")
-            else:
-                print(f"❌ Failed to send lead notification for session: {session_id}")
-            
-            return success
-            
-        except Exception as e:
-            print(f"Error sending lead notification: {e}")
-            return False
+                subject=lead_data.get('name') or 'Unknown',
+                body_html=fragment_html,
+                body_text=fragment_text,
+                payload=payload,
+                status="digest",
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=settings.email_digest_window_seconds)
+            ))
+            return True
+        
+        db.add(EmailOutbox(
+            session_id=session_id,
+            kind="lead_notification",
+            to_email=self.admin_email,
+            subject=f"🏡 New Real Estate Lead: {lead_data.get('name') or 'Unknown'}",
+            body_html=_LEAD_HTML.render(content=fragment_html),
+            body_text=_LEAD_TEXT.render(content=fragment_text),
+            payload=payload
+        ))
+        return True
+    
+    def render_lead(self, lead_data: dict, session_id: str, captured_at: datetime) -> Tuple[str, str]:
+        """The HTML and plain-text blocks for one lead, rendered once and reused by digests"""
+        fields = {
+            "name": lead_data.get('name') or 'Not provided',
+            "email": lead_data.get('email') or 'Not provided',
+            "phone": lead_data.get('phone') or 'Not provided',
+            "purpose": lead_data.get('purpose') or 'Not specified',
+            "location": lead_data.get('location') or 'Not specified',
+            "budget": lead_data.get('budget') or 'Not specified',
+            "timeline": lead_data.get('timeline') or 'Not specified',
+            "property_type": lead_data.get('property_type') or 'Not specified',
+            "session_id": session_id,
+            "captured_at": captured_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        return _TEMPLATES["lead.html"].render(**fields), _TEMPLATES["lead.txt"].render(**fields)
+    
+    def create_digest(self, fragments: List[Tuple[str, str]]) -> Tuple[str, str, str]:
+        """Subject, HTML and plain-text body of a digest of already-rendered lead fragments"""
+        count = len(fragments)
+        subject = f"🏡 {count} New Real Estate Lead{'s' if count != 1 else ''}"
+        chrome = {"title": f"🎯 {count} New Leads", "intro": "Leads captured since the last digest"}
+        return (
+            subject,
+            _TEMPLATES["layout.html"].render(content="\n".join(html for html, _ in fragments), **chrome),
+            _TEMPLATES["layout.txt"].render(content="\n".join(text for _, text in fragments), **chrome)
+        )
     
-    def _create_lead_email_body(self, lead_data: dict, session_id: str) -> str:
-        """Create HTML email body for lead notification"""
+    def send(self, to_email: str, subject: str, body: str, text: Optional[str] = None):
+        """Send an HTML email (with an optional plain-text alternative) over a pooled connection. Raises on failure."""
         
-        html = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                           color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }}
-                .lead-info {{ background: white; padding: 20px; border-radius: 8px; margin: 20px 0; }}
-                .info-row {{ padding: 10px 0; border-bottom: 1px solid #eee; }}
-                .label {{ font-weight: bold; color: #667eea; display: inline-block; width: 150px; }}
-                .value {{ color: #333; }}
-                .footer {{ text-align: center; margin-top: 30px; color: #666; font-size: 12px; }}
-                .badge {{ display: inline-block; padding: 5px 15px; background: #4CAF50; 
-                         color: white; border-radius: 20px; font-size: 12px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🎯 New Lead Alert!</h1>
-                    <p>A new potential customer has shown interest</p>
-                </div>
-                
-                <div class="content">
-                    <div class="lead-info">
-                        <h2>Lead Information</h2>
-                        
-                        <div class="info-row">
-                            <span class="label">Name:</span>
-                            <span class="value">{lead_data.get('name', 'Not provided')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Email:</span>
-                            <span class="value">{lead_data.get('email', 'Not provided')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Phone:</span>
-                            <span class="value">{lead_data.get('phone', 'Not provided')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Purpose:</span>
-                            <span class="value">{lead_data.get('purpose', 'Not specified')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Location:</span>
-                            <span class="value">{lead_data.get('location', 'Not specified')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Budget:</span>
-                            <span class="value">{lead_data.get('budget', 'Not specified')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Timeline:</span>
-                            <span class="value">{lead_data.get('timeline', 'Not specified')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Property Type:</span>
-                            <span class="value">{lead_data.get('property_type', 'Not specified')}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Session ID:</span>
-                            <span class="value" style="font-size: 11px;">{session_id}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <span class="label">Captured At:</span>
-                            <span class="value">{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</span>
-                        </div>
-                    </div>
-                    
-                    <p style="margin-top: 20px;">
-                        <strong>Next Steps:</strong><br>
-                        • Review the lead details<br>
-                        • Contact within 24 hours for best conversion<br>
-                        • Check conversation history for context
-                    </p>
-                </div>
-                
-                <div class="footer">
-                    <p>This is an automated notification from DreamHome Realty Lead Chatbot</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        # Create message
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.smtp_username or self.admin_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
         
-        return html
-    
-    def _send_email(self, to_email: str, subject: str, body: str) -> bool:
-        """Send an email"""
+        # Attach plain-text alternative, then HTML body (clients show the last part they support)
+        if text:
+            msg.attach(MIMEText(text, 'plain'))
+        html_part = MIMEText(body, 'html')
+        msg.attach(html_part)
         
+        # Send email
+        start = time.perf_counter()
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['From'] = self.smtp_username
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Attach HTML body
-            html_part = MIMEText(body, 'html')
-            msg.attach(html_part)
-            
-            # Send email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
+            with tracer.span("smtp.send", KIND_CLIENT, **{"smtp.server": self.smtp_server}), self.pool.connection() as server:
                 server.send_message(msg)
-            
-            return True
-            
-        except Exception as e:
-            print(f"Error sending email: {e}")
-            return False
+        except Exception:
+            smtp_send_duration.observe(time.perf_counter() - start, outcome="error")
+            raise
+        smtp_send_duration.observe(time.perf_counter() - start, outcome="ok")
     
     def _is_configured(self) -> bool:
-        """Check if email is properly configured"""
+        """Check if email is properly configured (login is optional, e.g. for a local SMTP stand-in)"""
         return bool(
             self.smtp_server and 
-            self.smtp_username and 
-            self.smtp_password and 
             self.admin_email
         )
 
 
 # Singleton instance
-email_service = EmailService()
\ No newline at end of file
+email_service = EmailService()
@@ -0,0 +1,52 @@
+from pathlib import Path
+import html
+import re
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+
+# {{ field }} is escaped (in HTML templates); {{ field|safe }} is inserted as is
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)(\|safe)?\s*\}\}")
+
+
+class EmailTemplate:
+    """
+    A template compiled once into its literal text and the fields between
+    them, so rendering is a single join. HTML templates autoescape every
+    value not marked |safe.
+    """
+
+    def __init__(self, source: str, autoescape: bool):
+        self.autoescape = autoescape
+        pieces = _PLACEHOLDER.split(source)
+        self._literals = pieces[0::3]
+        self._fields = list(zip(pieces[1::3], pieces[2::3]))
+
+    @classmethod
+    def load(cls, name: str) -> "EmailTemplate":
+        return cls((TEMPLATE_DIR / name).read_text(encoding="utf-8"), autoescape=name.endswith(".html"))
+
+    def render(self, **values) -> str:
+        out = [self._literals[0]]
+        for (field, safe), literal in zip(self._fields, self._literals[1:]):
+            out.append(self._value(values[field], safe))
+            out.append(literal)
+        return "".join(out)
+
+    def partial(self, **values) -> "EmailTemplate":
+        """Pre-render the given fields, leaving a template of the rest"""
+        compiled = EmailTemplate.__new__(EmailTemplate)
+        compiled.autoescape = self.autoescape
+        compiled._fields = []
+        literals = [self._literals[0]]
+        for (field, safe), literal in zip(self._fields, self._literals[1:]):
+            if field in values:
+                literals[-1] += self._value(values[field], safe) + literal
+            else:
+                compiled._fields.append((field, safe))
+                literals.append(literal)
+        compiled._literals = literals
+        return compiled
+
+    def _value(self, value, safe: str) -> str:
+        value = "" if value is None else str(value)
+        return html.escape(value) if self.autoescape and not safe else value
@@ -1,60 +1,27 @@
 from typing import Dict, Any, Optional
-from app.services.state_machine import state_machine, FlowState
-from app.prompts.system_prompts import CATEGORIES
+from app.services.state_machine import state_machine
+from app.services.property_service import property_service
 
 class FlowManager:
     """Manages conversation flow and state transitions"""
-    
+
     def __init__(self):
         self.state_machine = state_machine
-    
+
     def start_category_flow(self, category: str, lead_data: Dict[str, Any]) -> Dict[str, Any]:
         """Start flow for selected category"""
-        
-        category_to_state = {
-            "brochure": FlowState.BROCHURE_SEND,
-            "booking": FlowState.BOOKING_START,
-            "explore": FlowState.EXPLORE_START,
-            "question": FlowState.ASK_START
-        }
 
-        start_state = category_to_state.get(category, FlowState.ASK_START)
-        
+        flow = self.state_machine.flow
+        start_state = flow.categories.get(category, flow.categories[flow.default_category])
+
         context = {
             "name": lead_data.get("name", "there"),
             "email": lead_data.get("email", ""),
             "phone": lead_data.get("phone", "")
         }
-        
-        # Get start state response
-        start_response = self.state_machine.get_state_response(start_state, context)
-        
-        # IMPORTANT: If start state has no UI but next state does, fetch next state
-        #if not start_response.ui_component and start_response.next_state:
-        #    next_response = self.state_machine.get_state_response(start_response.next_state, context)
-            
-            # Combine messages
-        #    combined_message = f"{start_response.message}\n\n{next_response.message}"
-            
-        #    return {
-        #        "message": combined_message,
-        #        "current_state": start_response.next_state.value,  # Use next state
-        #        "next_state": next_response.next_state.value if next_response.next_state else None,
-        #        "ui_component": self._serialize_ui_component(next_response.ui_component),
-        #        "show_menu_button": next_response.show_menu_button,
-        #        "requires_llm": next_response.requires_llm
-        #    }
-    
-        # Otherwise return start state as-is
-        return {
-            "message": start_response.message,
-            "current_state": start_state.value,
-            "next_state": start_response.next_state.value if start_response.next_state else None,
-            "ui_component": self._serialize_ui_component(start_response.ui_component),
-            "show_menu_button": start_response.show_menu_button,
-            "requires_llm": start_response.requires_llm
-        }
-    
+
+        return self._state_result(start_state, context)
+
     def handle_user_input(
         self,
         current_state: str,
@@ -62,137 +29,83 @@ class FlowManager:
         context: Dict[str, Any] = None
     ) -> Dict[str, Any]:
         """Handle user input in current state and transition to next"""
-        
-        try:
-            state_enum = FlowState(current_state)
-        except ValueError:
-            state_enum = FlowState.GREETING
-        
-        # Special handling for EXPLORE_START (property type selection)
-        if state_enum == FlowState.EXPLORE_START:
-            property_type = user_input
-            property_type_labels = {
-                "apartment": "Apartments",
-                "villa": "Villas",
-                "plot": "Residential Plots",
-                "commercial": "Commercial Spaces"
-            }
-            
-            return {
-                "message": f"Here are some available {property_type_labels.get(property_type, 'Properties')} in Chennai:",
-                "current_state": FlowState.EXPLORE_PROPERTY_TYPE.value,
-                "next_state": FlowState.EXPLORE_SHOW_MORE.value,
-                "ui_component": {
-                    "type": "property_cards",
-                    "data": {
-                        "property_type": property_type,
-                        "limit": 6
-                    }
-                },
-                "show_menu_button": True,
-                "requires_llm": False
-            }
-        
-        # Get next state
-        next_state = self.state_machine.get_next_state(state_enum, user_input)
-        
-        if next_state=="handoff":
-            if user_input["value"]=="explore_properties":
-                next_state=FlowState.EXPLORE_START
-            if user_input["value"]=="back_to_menu":
-                categories = [
-                        {
-                            "id": key,
-                            "label": value["label"],
-                            "emoji": value["emoji"]
-                        }
-                        for key, value in CATEGORIES.items()
-                    ]
-                
-                return {
-                    "message": "",
-                    "type": "greeting",
-                    "show_categories": True,
-                    "current_state":"greeting",
-                    "next_state":"category_selection",
-                    "ui_component":{
-                        "type": "category_buttons",
-                        "data": {
-                            "categories":categories
-                        }
-                    },
-                    "show_menu_button": False
-                }
-        
+
+        action = self._action_of(user_input)
+
+        # Look up the transition in the compiled flow table
+        flow = self.state_machine.flow
+        next_state = flow.next_state(current_state, action)
+
         # Prepare context with user input
-        full_context = context or {}
-        full_context.update(self._process_user_input(state_enum, user_input))
-        
-        # Get response for next state
-        response = self.state_machine.get_state_response(next_state, full_context)
-        
+        full_context = dict(context or {})
+        full_context.update(self._process_user_input(user_input))
+        full_context.update(flow.capture(current_state, action))
+
+        result = self._state_result(next_state, full_context)
+        result["user_data"] = full_context
+        return result
+
+    def _state_result(self, state: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Render a state's response into the dict shape the API returns"""
+        response = self.state_machine.get_state_response(state, context)
+
         return {
             "message": response.message,
-            "current_state": next_state.value,
-            "next_state": response.next_state.value if response.next_state else None,
+            "current_state": state,
+            "next_state": response.next_state,
             "ui_component": self._serialize_ui_component(response.ui_component),
             "show_menu_button": response.show_menu_button,
-            "requires_llm": response.requires_llm,
-            "user_data": full_context
+            "requires_llm": response.requires_llm
         }
-    
-    def _process_user_input(self, state: FlowState, user_input: Any) -> Dict[str, Any]:
+
+    def _action_of(self, user_input: Any) -> Optional[str]:
+        """The action a user input triggers: a button's value, the text itself, or None for forms"""
+        if isinstance(user_input, dict):
+            value = user_input.get("value")
+            return value.strip() if isinstance(value, str) else None
+        if isinstance(user_input, str):
+            return user_input.strip()
+        return None
+
+    def _process_user_input(self, user_input: Any) -> Dict[str, Any]:
         """Process and structure user input based on state"""
-        
+
         processed = {}
-        
+
         if isinstance(user_input, dict):
             processed.update(user_input)
+            if "value" not in user_input:
+                # Form submission (e.g. preference form)
+                processed["preferences"] = user_input
         elif isinstance(user_input, str):
             processed["user_response"] = user_input
-            
-            # Handle property type selection in Explore flow
-            if state == FlowState.EXPLORE_START:
-                processed["property_type"] = user_input
-                processed["property_type_label"] = {
-                    "apartment": "Apartments",
-                    "villa": "Villas", 
-                    "plot": "Residential Plots",
-                    "commercial": "Commercial Spaces"
-                }.get(user_input, "Properties")
-        
+
         return processed
-    
+
     def _serialize_ui_component(self, component) -> Optional[Dict[str, Any]]:
         """Serialize UI component to dict"""
         if not component:
             return None
+
+        data = component.data
+        if component.type == "property_cards" and data.get("property_type"):
+            # Embed the cards so the widget doesn't need a second request
+            data = {
+                **data,
+                "properties": property_service.get_property_cards(data["property_type"], data.get("limit", 6))
+            }
         
         return {
             "type": component.type,
-            "data": component.data
+            "data": data
         }
-    
+
     def go_to_main_menu(self) -> Dict[str, Any]:
         """Return to main menu (category selection)"""
-        from app.services.conversation_service_v2 import conversation_service_v2
-        
-        greeting = conversation_service_v2.get_greeting()
-        
-        return {
-            "message": "What else can I help you with? 🏠",
-            "current_state": FlowState.CATEGORY_SELECTION.value,
-            "next_state": None,
-            "ui_component": {
-                "type": "category_buttons",
-                "data": {
-                    "categories": greeting["categories"]
-                }
-            },
-            "show_menu_button": False,
-            "requires_llm": False
-        }
+        result = self._state_result(self.state_machine.flow.menu_state, {})
+        result["next_state"] = None
+        return result
 
 
 # Singleton instance
-flow_manager = FlowManager()
\ No newline at end of file
+flow_manager = FlowManager()
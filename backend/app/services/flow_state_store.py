@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from app.config import get_settings
+from app.services.payload_cache import encode_json
+from app.services.shared_cache import shared_cache
+import json
+
+settings = get_settings()
+
+
+@dataclass(frozen=True)
+class SessionFlowState:
+    """Where a session is in the flow, as recorded by the server"""
+    state: str
+    version: int
+    context: Dict[str, Any] = field(default_factory=dict)  # Lead context: name, email, phone
+
+
+class StaleStateError(Exception):
+    """The client acted on a state version the server has already moved past"""
+
+    def __init__(self, current: SessionFlowState):
+        super().__init__(f"Stale state: session is at '{current.state}' (version {current.version})")
+        self.current = current
+
+
+class FlowStateStore:
+    """
+    Server-side flow state per session with optimistic versioning.
+
+    Every transition bumps the version; advance() is a compare-and-set, so
+    a replayed or double-clicked submission carrying an old version is
+    rejected before any side effects run. Kept in the shared cache with an
+    idle TTL, so with the redis backend every worker sees the same state and
+    the compare-and-set holds across workers.
+    """
+
+    def __init__(self, backend, ttl_seconds: float = 86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, session_id: str) -> Optional[SessionFlowState]:
+        return _decode(await self.backend.get(session_id))
+
+    async def set(self, session_id: str, state: str, context: Dict[str, Any] = None) -> SessionFlowState:
+        """Record a state unconditionally (context is kept unless a new one is given)"""
+        return await self._transition(session_id, None, state, context)
+
+    async def advance(
+        self,
+        session_id: str,
+        expected_version: Optional[int],
+        state: str,
+        context: Dict[str, Any] = None
+    ) -> SessionFlowState:
+        """
+        Move to `state` only if the session is still at `expected_version`
+        (None skips the check). Raises StaleStateError otherwise.
+        """
+        return await self._transition(session_id, expected_version, state, context)
+
+    async def restore(self, session_id: str, flow_state: SessionFlowState):
+        """Put back a previously read state (e.g. after the writes that followed it were rolled back)"""
+        await self.backend.set(session_id, _encode(flow_state), self.ttl_seconds)
+
+    async def discard(self, session_id: str):
+        await self.backend.delete(session_id)
+
+    async def _transition(
+        self,
+        session_id: str,
+        expected_version: Optional[int],
+        state: str,
+        context: Optional[Dict[str, Any]]
+    ) -> SessionFlowState:
+        while True:
+            raw = await self.backend.get(session_id)
+            current = _decode(raw)
+            if current and expected_version is not None and current.version != expected_version:
+                raise StaleStateError(current)
+
+            flow_state = SessionFlowState(
+                state=state,
+                version=current.version + 1 if current else 1,
+                context=context if context is not None else (current.context if current else {})
+            )
+            if await self.backend.compare_and_set(session_id, raw, _encode(flow_state), self.ttl_seconds):
+                return flow_state
+            # Another request moved the session in between; re-read and check again
+
+
+def _encode(flow_state: SessionFlowState) -> bytes:
+    return encode_json({"state": flow_state.state, "version": flow_state.version, "context": flow_state.context})
+
+
+def _decode(raw: Optional[bytes]) -> Optional[SessionFlowState]:
+    return SessionFlowState(**json.loads(raw)) if raw is not None else None
+
+
+# Singleton instance
+flow_state_store = FlowStateStore(
+    backend=shared_cache("flow", max_entries=settings.flow_state_store_size),
+    ttl_seconds=settings.flow_state_ttl_seconds
+)
@@ -1,43 +1,133 @@
-import google.generativeai as genai
+from typing import AsyncIterator
 from app.config import get_settings
+from app.services.metrics import gemini_duration, gemini_errors
+from app.services.tracing import tracer, KIND_CLIENT
+from app.services.admission import llm_admission
+import asyncio
+import threading
+import time
 
 settings = get_settings()
 
-# Configure Gemini
-genai.configure(api_key=settings.gemini_api_key)
+# Returned instead of raising when Gemini fails
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble connecting right now. Please try again in a moment."
+
+# Calls nobody is waiting on yet; they only run if a slot is free right away
+SPECULATIVE_CALL_SITES = {"ask_ai_prefetch"}
 
 class GeminiService:
     def __init__(self):
-        self.model = genai.GenerativeModel(settings.gemini_model)
+        self._model = None
+        self._lock = threading.Lock()
+    
+    @property
+    def model(self):
+        """
+        The Gemini model, created on first use: importing the SDK takes over
+        half a second, so it happens in the startup warm-up (or the first
+        call) rather than when the app is imported.
+        """
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=settings.gemini_api_key)
+                    self._model = genai.GenerativeModel(settings.gemini_model)
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    async def _get_model(self):
+        # A call that beats the warm-up creates the model in a worker thread, not on the event loop
+        if self._model is not None:
+            return self._model
+        return await asyncio.to_thread(getattr, self, "model")
         
-    async def generate_response(self, prompt: str, conversation_history: list = None) -> str:
+    async def generate_response(self, prompt: str, conversation_history: list = None, call_site: str = "other") -> str:
         """
         Generate a response using Gemini
         
         Args:
             prompt: User's message
             conversation_history: List of previous messages (optional)
+            call_site: What the call is for, used to label its metrics
         
         Returns:
             AI generated response
+        
+        Raises:
+            LLMOverloaded: if admission control shed the call
         """
+        async with llm_admission.slot(wait=call_site not in SPECULATIVE_CALL_SITES):
+            return await self._generate(prompt, conversation_history, call_site)
+    
+    async def _generate(self, prompt: str, conversation_history: list, call_site: str) -> str:
+        start = time.perf_counter()
+        span = tracer.start_span("gemini.generate_response", KIND_CLIENT, **{"gemini.call_site": call_site})
         try:
             # Start a chat session
-            chat = self.model.start_chat(history=conversation_history or [])
+            chat = (await self._get_model()).start_chat(history=conversation_history or [])
             
-            # Generate response
-            response = chat.send_message(prompt)
+            # Generate response (the SDK call blocks, so keep it off the event loop)
+            response = await asyncio.to_thread(chat.send_message, prompt)
+            text = response.text
             
-            return response.text
+            gemini_duration.observe(time.perf_counter() - start, call_site=call_site, outcome="ok")
+            return text
             
         except Exception as e:
             print(f"Error generating response: {str(e)}")
-            return "I apologize, but I'm having trouble connecting right now. Please try again in a moment."
+            gemini_duration.observe(time.perf_counter() - start, call_site=call_site, outcome="error")
+            gemini_errors.inc(call_site=call_site)
+            if span:
+                span.fail(e)
+            return FALLBACK_RESPONSE
+        finally:
+            tracer.end_span(span)
+    
+    async def stream_response(self, prompt: str, conversation_history: list = None, call_site: str = "other") -> AsyncIterator[str]:
+        """
+        Generate a response using Gemini, yielding text chunks as they arrive.
+        The SDK's stream is blocking, so each chunk is pulled in a worker thread.
+        Raises LLMOverloaded (before the first chunk) if admission control sheds it.
+        """
+        async with llm_admission.slot(wait=call_site not in SPECULATIVE_CALL_SITES):
+            async for chunk in self._stream(prompt, conversation_history, call_site):
+                yield chunk
+    
+    async def _stream(self, prompt: str, conversation_history: list, call_site: str) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        span = tracer.start_span("gemini.stream_response", KIND_CLIENT, **{"gemini.call_site": call_site})
+        try:
+            chat = (await self._get_model()).start_chat(history=conversation_history or [])
+            response = await asyncio.to_thread(chat.send_message, prompt, stream=True)
+            chunks = iter(response)
+            
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk.text:
+                    yield chunk.text
+            
+            gemini_duration.observe(time.perf_counter() - start, call_site=call_site, outcome="ok")
+                    
+        except Exception as e:
+            print(f"Error streaming response: {str(e)}")
+            gemini_duration.observe(time.perf_counter() - start, call_site=call_site, outcome="error")
+            gemini_errors.inc(call_site=call_site)
+            if span:
+                span.fail(e)
+            yield FALLBACK_RESPONSE
+        finally:
+            tracer.end_span(span)
     
     async def test_connection(self) -> dict:
         """Test if Gemini API is working"""
         try:
-            response = await self.generate_response("Say 'Connection successful!' if you can read this.")
+            response = await self.generate_response("Say 'Connection successful!' if you can read this.", call_site="test")
             return {
                 "status": "success",
                 "message": "Gemini API connected successfully",
@@ -0,0 +1,248 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Union
+from app.config import get_settings
+from app.services.shared_cache import shared_cache
+import asyncio
+import base64
+import hashlib
+import json
+import time
+import uuid
+
+settings = get_settings()
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """A completed response, replayed verbatim for retries with the same key"""
+    fingerprint: str  # sha256 of the request body the key was first used with
+    status: int
+    headers: Tuple[Tuple[bytes, bytes], ...]
+    body: bytes
+
+
+class IdempotencyStore:
+    """
+    Responses by idempotency key in the shared cache, with a TTL.
+
+    Also records which keys have a first request still running (a claim
+    renewed while the request runs, so it only lapses `lock_seconds` after
+    its worker dies), so a retry that arrives mid-flight (e.g. during a
+    Gemini call) waits for that result instead of executing again; with
+    the redis backend this holds even when the retry lands on another worker.
+    """
+
+    def __init__(self, backend, ttl_seconds: float = 3600, lock_seconds: float = 30, poll_seconds: float = 0.05):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        self._local: Dict[str, Tuple[bytes, asyncio.Event]] = {}  # Claims held by this worker, to wake its waiters at once
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[StoredResponse]:
+        raw = await self.backend.get("response:" + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _decode(raw)
+
+    async def set(self, key: str, response: StoredResponse):
+        await self.backend.set("response:" + key, _encode(response), self.ttl_seconds)
+
+    async def begin(self, key: str) -> Optional[bytes]:
+        """
+        Claim the key for a first request; returns the claim's token (pass it
+        to hold and finish), or None if another request already holds it
+        """
+        token = uuid.uuid4().hex.encode("ascii")
+        if not await self.backend.set("lock:" + key, token, self.lock_seconds, nx=True):
+            return None
+        previous = self._local.get(key)
+        if previous is not None:
+            previous[1].set()  # An earlier claim from this worker lapsed; don't leave its waiters hanging
+        self._local[key] = (token, asyncio.Event())
+        return token
+
+    async def hold(self, key: str, token: bytes):
+        """Keep renewing a claim from begin() until cancelled, however long the request takes"""
+        while True:
+            await asyncio.sleep(self.lock_seconds / 3)
+            if not await self.backend.compare_and_set("lock:" + key, token, token, self.lock_seconds):
+                return  # Lapsed (the worker stalled past lock_seconds) and another request claimed it
+
+    async def finish(self, key: str, token: bytes):
+        """Release the claim, unless it lapsed and now belongs to another request"""
+        await self.backend.delete_if("lock:" + key, token)
+        local = self._local.get(key)
+        if local is not None and local[0] == token:
+            del self._local[key]
+            local[1].set()
+
+    async def wait(self, key: str, timeout: float) -> bool:
+        """Wait for the request holding `key` to finish; False if it's still running after `timeout`"""
+        deadline = time.monotonic() + timeout
+        while await self.backend.get("lock:" + key) is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            local = self._local.get(key)
+            if local is not None:
+                try:
+                    await asyncio.wait_for(local[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+            else:
+                # Held by another worker: poll until its claim is released (or expires)
+                await asyncio.sleep(min(self.poll_seconds, remaining))
+        return True
+
+    async def clear(self):
+        await self.backend.clear()
+
+
+def _encode(response: StoredResponse) -> bytes:
+    return json.dumps({
+        "fingerprint": response.fingerprint,
+        "status": response.status,
+        "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.headers],
+        "body": base64.b64encode(response.body).decode("ascii")
+    }).encode("utf-8")
+
+
+def _decode(raw: bytes) -> StoredResponse:
+    data = json.loads(raw)
+    return StoredResponse(
+        fingerprint=data["fingerprint"],
+        status=data["status"],
+        headers=tuple((name.encode("latin-1"), value.encode("latin-1")) for name, value in data["headers"]),
+        body=base64.b64decode(data["body"])
+    )
+
+
+class IdempotencyMiddleware:
+    """
+    Honours an Idempotency-Key header on POST requests under `path_prefix`.
+
+    The first request with a key runs normally and its 2xx response is
+    stored; retries with the same key and body get the stored response
+    (marked Idempotent-Replayed: true) without running the endpoint again.
+    Reusing a key with a different body is a 422. Failed requests aren't
+    stored, so they can be retried.
+    """
+
+    def __init__(self, app, store: IdempotencyStore = None, path_prefix: str = "/api/v2/", wait_seconds: float = None):
+        self.app = app
+        self.store = store or idempotency_store
+        self.path_prefix = path_prefix
+        self.wait_seconds = wait_seconds if wait_seconds is not None else settings.idempotency_wait_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            return await self.app(scope, receive, send)
+
+        raw_key = next((value for name, value in scope["headers"] if name == IDEMPOTENCY_HEADER), None)
+        if raw_key is None:
+            return await self.app(scope, receive, send)
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            return await _send_error(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        key = f"{scope['path']}:{raw_key.decode('latin-1')}"
+
+        while True:
+            stored = await self.store.get(key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    return await _send_error(send, 422, "Idempotency-Key was already used with a different request body")
+                return await _replay(stored, send)
+
+            token = await self.store.begin(key)
+            if token is not None:
+                break
+            if not await self.store.wait(key, self.wait_seconds):
+                return await _send_error(send, 409, {
+                    "code": "in_progress",
+                    "message": "A request with this Idempotency-Key is still being processed"
+                }, headers=[(b"retry-after", b"1")])
+            # The first attempt finished: replay it, or run again if it failed
+
+        renewal = asyncio.create_task(self.store.hold(key, token))
+        try:
+            response = {"status": None, "headers": (), "body": []}
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = tuple(message.get("headers", ()))
+                elif message["type"] == "http.response.body":
+                    response["body"].append(message.get("body", b""))
+                await send(message)
+
+            await self.app(scope, replay_body(body, receive), capture)
+
+            if response["status"] is not None and 200 <= response["status"] < 300:
+                await self.store.set(key, StoredResponse(
+                    fingerprint=fingerprint,
+                    status=response["status"],
+                    headers=response["headers"],
+                    body=b"".join(response["body"])
+                ))
+        finally:
+            renewal.cancel()
+            await self.store.finish(key, token)
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def replay_body(body: bytes, receive):
+    """A receive() that hands the already-read body to the app, then defers to the real one"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _replay(stored: StoredResponse, send):
+    await send({
+        "type": "http.response.start",
+        "status": stored.status,
+        "headers": [*stored.headers, (b"idempotent-replayed", b"true")]
+    })
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+async def _send_error(send, status: int, detail: Union[str, dict], headers: list = ()):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Singleton instance
+idempotency_store = IdempotencyStore(
+    backend=shared_cache("idempotency", max_entries=settings.idempotency_store_size),
+    ttl_seconds=settings.idempotency_ttl_seconds
+)
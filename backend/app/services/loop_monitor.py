@@ -0,0 +1,161 @@
+from collections import Counter as Tally, deque
+from datetime import datetime
+from typing import Dict, Optional
+from app.config import get_settings
+from app.services.metrics import registry, Counter, Histogram, route_template
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+settings = get_settings()
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # backend/app
+MAX_STACK_FRAMES = 20
+
+
+class LoopMonitor:
+    """
+    Event-loop lag monitor. A heartbeat task sleeps `interval_seconds` at a
+    time and records how late it wakes up (scheduler delay: the time some
+    callback held the loop). A watchdog thread checks the heartbeat; once it
+    is `threshold_seconds` overdue, the loop is blocked right now, so it
+    grabs the loop thread's stack (the blocking frame is on it) and the
+    request the running task belongs to. The stall is recorded when the loop
+    recovers, with its full duration.
+    """
+
+    def __init__(self, enabled: bool = True, interval_seconds: float = 0.1, threshold_seconds: float = 0.1,
+                 history: int = 100):
+        self.enabled = enabled
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self.stalls = deque(maxlen=history)
+        self.by_location = Tally()
+        self._requests: Dict[asyncio.Task, dict] = {}  # Running request task -> ASGI scope
+        self._loop = None
+        self._loop_thread = None
+        self._deadline = None  # When the heartbeat should next wake up
+        self._pending = None  # Stall captured by the watchdog, finished by the heartbeat
+        self._task = None
+
+    def start(self):
+        """Start monitoring the running loop (call from the startup hook)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="loop-monitor", daemon=True).start()
+
+    def track(self, task: asyncio.Task, scope: dict):
+        self._requests[task] = scope
+
+    def untrack(self, task: asyncio.Task):
+        self._requests.pop(task, None)
+
+    async def _heartbeat(self):
+        while True:
+            self._deadline = time.monotonic() + self.interval_seconds
+            await asyncio.sleep(self.interval_seconds)
+            lag = max(0.0, time.monotonic() - self._deadline)
+            loop_lag.observe(lag)
+
+            stall, self._pending = self._pending, None
+            if stall is not None:
+                stall["lag_ms"] = round(lag * 1000, 1)
+                self.stalls.append(stall)
+                self.by_location[(stall["route"], stall["location"])] += 1
+                loop_stalls.inc(route=stall["route"], location=stall["location"])
+
+    def _watchdog(self):
+        check_every = min(self.interval_seconds, self.threshold_seconds) / 2
+        while True:
+            time.sleep(check_every)
+            deadline = self._deadline
+            if deadline is None or self._pending is not None:
+                continue
+            if time.monotonic() - deadline >= self.threshold_seconds:
+                try:
+                    stall = self._capture()
+                except Exception as e:
+                    print(f"Error capturing blocked loop stack: {e}")
+                    continue
+                if self._deadline == deadline:  # Still the same stall (the loop didn't recover meanwhile)
+                    self._pending = stall
+
+    def _capture(self) -> Optional[dict]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)[-MAX_STACK_FRAMES:]
+
+        task = asyncio.current_task(self._loop)
+        scope = self._requests.get(task)
+        if scope is not None:
+            route = route_template(scope)
+        elif task is not None:
+            route = f"task:{task.get_coro().__qualname__}"  # Background work, e.g. a prefetch
+        else:
+            route = "(loop callback)"
+
+        # The innermost frame in our own code is the call to fix, even when it blocks inside a library
+        blocking = next((f for f in reversed(stack) if f.filename.startswith(APP_DIR)), stack[-1])
+        return {
+            "at": datetime.utcnow().isoformat(),
+            "route": route,
+            "location": f"{os.path.relpath(blocking.filename, os.path.dirname(APP_DIR))}:{blocking.lineno} {blocking.name}",
+            "stack": [f"{f.filename}:{f.lineno} in {f.name}: {f.line}" for f in stack],
+            "lag_ms": None
+        }
+
+    def report(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval_seconds": self.interval_seconds,
+            "threshold_seconds": self.threshold_seconds,
+            "top": [
+                {"route": route, "location": location, "stalls": count}
+                for (route, location), count in self.by_location.most_common(20)
+            ],
+            "recent": list(reversed(self.stalls))
+        }
+
+
+class LoopMonitorMiddleware:
+    """Remembers which request each running task serves, so a stall can be attributed to its route"""
+
+    def __init__(self, app, monitor: LoopMonitor = None):
+        self.app = app
+        self.monitor = monitor or loop_monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        task = asyncio.current_task()
+        self.monitor.track(task, scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack(task)
+
+
+loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer scheduled every interval (scheduler delay)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+))
+loop_stalls = registry.register(Counter(
+    "event_loop_stalls_total", "Event loop stalls over the threshold by route and blocking code location",
+    ("route", "location")
+))
+
+# Singleton instance
+loop_monitor = LoopMonitor(
+    enabled=settings.loop_monitor_enabled,
+    interval_seconds=settings.loop_monitor_interval_seconds,
+    threshold_seconds=settings.loop_monitor_threshold_seconds,
+    history=settings.loop_monitor_history
+)
@@ -0,0 +1,258 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from sqlalchemy import event
+from starlette.routing import Match
+import threading
+import time
+
+# Seconds; wide enough for both SQLite queries and multi-second Gemini calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _Metric:
+    """Base for in-process metrics rendered in the Prometheus text format"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), fn: Callable = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._fn = fn  # Values are read from fn() at scrape time instead of being recorded
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, tuple, float]]:
+        values = self._fn() if self._fn else self._snapshot()
+        for key, value in values.items():
+            yield self.name, key if isinstance(key, tuple) else (key,), value
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_labels(self.labelnames, key)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in self._snapshot().items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+# HTTP
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route, method and status", ("route", "method", "status")
+))
+http_in_flight = registry.register(Gauge("http_requests_in_flight", "HTTP requests currently being handled"))
+
+# Gemini
+gemini_duration = registry.register(Histogram(
+    "gemini_request_duration_seconds", "Gemini call latency by call site and outcome", ("call_site", "outcome")
+))
+gemini_errors = registry.register(Counter("gemini_errors_total", "Failed Gemini calls by call site", ("call_site",)))
+
+# Database
+db_queries_per_request = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ("route",),
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16, 24, 32, 64)
+))
+db_time_per_request = registry.register(Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL statements per HTTP request", ("route",)
+))
+db_queries = registry.register(Counter("db_queries_total", "SQL statements executed, including background jobs"))
+
+# Email
+smtp_send_duration = registry.register(Histogram(
+    "smtp_send_duration_seconds", "SMTP send latency (including connection checkout) by outcome", ("outcome",)
+))
+
+
+_routes: Dict[Callable, str] = {}
+
+
+def route_template(scope) -> str:
+    """The path template of the route a request matched ("unmatched" if none), for low-cardinality labels"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        # Never reached the router (e.g. an idempotent replay): match it ourselves
+        for route in scope["app"].routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return "unmatched"
+    route = _routes.get(endpoint)
+    if route is None:
+        paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+        route = _routes[endpoint] = paths.get(endpoint, "unmatched")
+    return route
+
+
+class _QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Per-request query tally; asyncio.to_thread copies the context, so DB work in worker threads still counts
+_request_queries: ContextVar[Optional[_QueryStats]] = ContextVar("request_queries", default=None)
+
+
+def instrument_engine(engine):
+    """Count and time every SQL statement run on `engine`"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.inc()
+        stats = _request_queries.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and DB usage of every HTTP request, labelled by
+    route template (not raw path, so session ids don't explode the label set).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        queries = _QueryStats()
+        token = _request_queries.set(queries)
+
+        async def capture(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            _request_queries.reset(token)
+
+            route = route_template(scope)
+            http_requests.inc(route=route, method=scope["method"], status=status)
+            http_request_duration.observe(elapsed, route=route, method=scope["method"], status=status)
+            db_queries_per_request.observe(queries.count, route=route)
+            db_time_per_request.observe(queries.seconds, route=route)
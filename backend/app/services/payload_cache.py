@@ -0,0 +1,67 @@
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+from app.services.state_machine import state_machine
+import threading
+
+try:
+    import orjson
+
+    def encode_json(value: Any) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  # Fall back to the stdlib encoder
+    import json
+
+    def encode_json(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PayloadCache:
+    """
+    JSON bytes for UI payloads that are identical on every request (category
+    buttons, lead form, and any flow state whose ui_component has no
+    {placeholders}). Flow payloads are keyed on the compiled flow, so a hot
+    reload of flows.json starts a fresh cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flow = None
+        self._states: Dict[str, Optional[bytes]] = {}
+        self._static: Dict[Hashable, bytes] = {}
+
+    def ui_component(self, state: str, rendered: Optional[Dict[str, Any]]) -> Union[bytes, Dict[str, Any], None]:
+        """Pre-encoded ui_component of a static state, else the rendered dict unchanged"""
+        flow = state_machine.flow
+        if flow is not self._flow:
+            with self._lock:
+                if flow is not self._flow:
+                    self._states = {}
+                    self._flow = flow
+
+        if state not in self._states:
+            index = flow.state_index.get(state)
+            encoded = None
+            if index is not None and not flow.templated[index][1]:
+                component = flow.responses[index].ui_component
+                if component is not None:
+                    encoded = encode_json({"type": component.type, "data": component.data})
+            self._states[state] = encoded
+
+        encoded = self._states[state]
+        return encoded if encoded is not None else rendered
+
+    def static(self, key: Hashable, build: Callable[[], Any]) -> bytes:
+        """Encode build() once and reuse the bytes for every later call with the same key"""
+        encoded = self._static.get(key)
+        if encoded is None:
+            encoded = self._static[key] = encode_json(build())
+        return encoded
+
+    def clear(self):
+        with self._lock:
+            self._flow = None
+            self._states = {}
+            self._static = {}
+
+
+# Singleton instance
+payload_cache = PayloadCache()
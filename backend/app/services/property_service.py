@@ -1,14 +1,33 @@
 import json
+import threading
 from pathlib import Path
 from typing import List, Dict, Optional
 
 current_file_path = Path(__file__).resolve()
 json_file_path = current_file_path.parent.parent.parent / 'data' / 'properties.json'
 
+# Fields a property card renders (no description / amenities)
+CARD_FIELDS = ("id", "type", "name", "location", "price", "bedrooms", "possession")
+
 class PropertyService:
     def __init__(self):
         self.properties_file = Path(json_file_path)
-        self.properties = self._load_properties()
+        self._properties: Optional[List[Dict]] = None  # Loaded on first use (or by the startup warm-up)
+        self._lock = threading.Lock()
+    
+    @property
+    def properties(self) -> List[Dict]:
+        if self._properties is None:
+            self.load()
+        return self._properties
+    
+    def load(self):
+        """Load and index the catalog, once"""
+        with self._lock:
+            if self._properties is None:
+                properties = self._load_properties()
+                self._build_index(properties)
+                self._properties = properties
     
     def _load_properties(self) -> List[Dict]:
         """Load properties from JSON file"""
@@ -19,6 +38,24 @@ class PropertyService:
             print(f"⚠️ Properties file not found: {self.properties_file}")
             return []
     
+    def _build_index(self, properties: List[Dict]):
+        """Index the catalog by id, and by type as pre-projected cards"""
+        self._by_id = {p["id"]: p for p in properties if p.get("id")}
+        self._cards_by_type: Dict[str, List[Dict]] = {}
+        for p in properties:
+            self._cards_by_type.setdefault(p.get("type"), []).append(self._to_card(p))
+    
+    def _to_card(self, prop: Dict) -> Dict:
+        card = {field: prop.get(field) for field in CARD_FIELDS}
+        card["image_url"] = prop.get("image_url") or prop.get("image_path")
+        return card
+    
+    def get_property_cards(self, property_type: str, limit: int = 6) -> List[Dict]:
+        """Compact cards for a type, straight from the index (shared dicts: don't mutate)"""
+        if self._properties is None:
+            self.load()
+        return self._cards_by_type.get(property_type, [])[:limit]
+    
     def get_properties_by_type(self, property_type: str, limit: int = 6) -> List[Dict]:
         """Get properties filtered by type"""
         filtered = [p for p in self.properties if p.get("type") == property_type]
@@ -38,7 +75,9 @@ class PropertyService:
     
     def get_property_by_id(self, property_id: str) -> Optional[Dict]:
         """Get single property by ID"""
-        return next((p for p in self.properties if p.get("id") == property_id), None)
+        if self._properties is None:
+            self.load()
+        return self._by_id.get(property_id)
 
 # Singleton
 property_service = PropertyService()
\ No newline at end of file
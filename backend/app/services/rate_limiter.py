@@ -0,0 +1,191 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+from app.config import get_settings
+from app.services.idempotency import read_body, replay_body
+from app.services.shared_cache import shared_cache
+import ipaddress
+import json
+import math
+
+settings = get_settings()
+
+# Endpoints that call Gemini; everything else under /api/ gets the (larger) default budget
+LLM_PATHS = {"/api/chat", "/api/chat-test", "/api/v2/chat/ask-ai", "/test-gemini"}
+
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in settings.trusted_proxies.split(",") if entry.strip()
+]
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Token bucket: `per_minute` sustained, bursts of up to `burst`"""
+    per_minute: float
+    burst: int
+
+    @property
+    def per_second(self) -> float:
+        return self.per_minute / 60
+
+
+class RateLimiter:
+    """
+    Checks a request against two buckets of its budget class ("llm" or
+    "default"): one for the client IP and one for the chat session. The
+    buckets live in the shared cache, so with the redis backend the limits
+    hold across all workers (with memory, each worker enforces them alone).
+    """
+
+    def __init__(self, store, limits: Dict[str, Dict[str, RateLimit]], enabled: bool = True):
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+        self.rejected = 0
+
+    async def check(self, budget: str, ip: Optional[str], session_id: Optional[str]) -> float:
+        """0 if the request may proceed, else seconds to wait (Retry-After)"""
+        if not self.enabled:
+            return 0.0
+        limits = self.limits[budget]
+        for kind, value in (("ip", ip), ("session", session_id)):
+            if value:
+                limit = limits[kind]
+                wait = await self.store.take_tokens(f"{budget}:{kind}:{value}", limit.per_second, limit.burst)
+                if wait:
+                    self.rejected += 1
+                    return wait
+        return 0.0
+
+
+class RateLimitMiddleware:
+    """
+    Rate limits /api/ requests (and /test-gemini) per client IP and per
+    session_id, taken from the JSON body or the `session_id` path segment.
+    Over-limit requests get a 429 with Retry-After.
+    """
+
+    def __init__(self, app, limiter: RateLimiter = None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled:
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        budget = "llm" if path in LLM_PATHS else "default"
+        if budget == "default" and not path.startswith("/api/"):
+            return await self.app(scope, receive, send)
+
+        session_id = None
+        if scope["method"] == "POST":
+            body = await read_body(receive)
+            receive = replay_body(body, receive)
+            session_id = _session_id_from_body(body)
+        else:
+            session_id = _session_id_from_path(path)
+
+        wait = await self.limiter.check(budget, client_ip(scope), session_id)
+        if wait:
+            return await _send_too_many(send, wait)
+        await self.app(scope, receive, send)
+
+
+def client_ip(scope) -> Optional[str]:
+    """
+    The client's address for an HTTP or WebSocket scope: the socket peer, or,
+    when the peer is a trusted proxy, the nearest address it forwarded for
+    that isn't a trusted proxy itself (X-Forwarded-For is appended to by each
+    hop, so only the entries our own proxies added can be believed).
+    """
+    peer = scope["client"][0] if scope.get("client") else None
+    if not peer or not _is_trusted_proxy(peer):
+        return peer
+
+    hops = _forwarded_for(scope.get("headers") or ())
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def _forwarded_for(headers) -> list:
+    """Client chain, nearest last, from Forwarded (RFC 7239) or else X-Forwarded-For"""
+    forwarded = [value.decode("latin-1") for name, value in headers if name == b"forwarded"]
+    if forwarded:
+        hops = []
+        for element in ",".join(forwarded).split(","):
+            for pair in element.split(";"):
+                name, _, value = pair.strip().partition("=")
+                if name.lower() == "for" and value:
+                    hops.append(_strip_port(value.strip('"')))
+        return hops
+
+    forwarded_for = [value.decode("latin-1") for name, value in headers if name == b"x-forwarded-for"]
+    return [_strip_port(hop.strip()) for hop in ",".join(forwarded_for).split(",") if hop.strip()]
+
+
+def _strip_port(node: str) -> str:
+    # "[2001:db8::1]:4711" -> "2001:db8::1", "192.0.2.1:80" -> "192.0.2.1"; bare IPv6 stays as is
+    if node.startswith("["):
+        return node[1:].split("]", 1)[0]
+    if node.count(":") == 1:
+        return node.split(":", 1)[0]
+    return node
+
+
+def _session_id_from_body(body: bytes) -> Optional[str]:
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        return None
+    session_id = data.get("session_id") if isinstance(data, dict) else None
+    return session_id if isinstance(session_id, str) else None
+
+
+def _session_id_from_path(path: str) -> Optional[str]:
+    # e.g. /api/chat/history/{session_id}
+    if "/history/" in path:
+        return path.rsplit("/", 1)[-1] or None
+    return None
+
+
+async def _send_too_many(send, wait: float):
+    retry_after = max(1, math.ceil(wait))
+    body = json.dumps({"detail": f"Too many requests; retry in {retry_after} seconds"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Singleton instance
+rate_limiter = RateLimiter(
+    store=shared_cache("ratelimit"),
+    limits={
+        "llm": {
+            "session": RateLimit(settings.rate_limit_llm_session_per_minute, settings.rate_limit_llm_session_burst),
+            "ip": RateLimit(settings.rate_limit_llm_ip_per_minute, settings.rate_limit_llm_ip_burst),
+        },
+        "default": {
+            "session": RateLimit(settings.rate_limit_session_per_minute, settings.rate_limit_session_burst),
+            "ip": RateLimit(settings.rate_limit_ip_per_minute, settings.rate_limit_ip_burst),
+        },
+    },
+    enabled=settings.rate_limit_enabled
+)
@@ -0,0 +1,193 @@
+from sqlalchemy import delete, exists, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.horizontal_shard import set_shard_id
+from app.models.lead import ChatMessage, ChatSession, ChatArchive
+from app.config import get_settings
+from app.database import SessionLocal, engines, shard_ids
+from datetime import datetime, timedelta
+import asyncio
+import gzip
+import json
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class RetentionService:
+    """
+    Moves messages of long-ended sessions out of the hot chat_messages table
+    into compressed per-session archives.
+    """
+
+    def __init__(self):
+        self.retention_days = settings.retention_days
+        self.batch_size = settings.retention_batch_size
+        self.interval_hours = settings.retention_interval_hours
+        self.vacuum_pages = settings.retention_vacuum_pages
+
+    def archive_ended_sessions(self, db: Session, older_than_days: int = None) -> dict:
+        """
+        Archive and delete messages of sessions ended more than `older_than_days` ago.
+        Each batch of sessions is archived and deleted in one transaction.
+        """
+        days = older_than_days if older_than_days is not None else self.retention_days
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        sessions_archived = 0
+        messages_archived = 0
+
+        for shard_id in shard_ids():
+            last_id = 0
+
+            while True:
+                # Ended sessions that still have hot messages, walked by id
+                batch = db.query(ChatSession.id, ChatSession.session_id).options(
+                    set_shard_id(shard_id)
+                ).filter(
+                    ChatSession.ended_at < cutoff,
+                    ChatSession.id > last_id,
+                    exists().where(ChatMessage.session_id == ChatSession.session_id)
+                ).order_by(ChatSession.id).limit(self.batch_size).all()
+
+                if not batch:
+                    break
+
+                last_id = batch[-1].id
+                session_ids = [row.session_id for row in batch]
+
+                for session_id in session_ids:
+                    messages_archived += self._archive_session(db, session_id)
+
+                db.execute(
+                    delete(ChatMessage).where(ChatMessage.session_id.in_(session_ids)),
+                    execution_options={"synchronize_session": False},
+                    bind_arguments={"shard_id": shard_id}
+                )
+                db.commit()
+
+                sessions_archived += len(session_ids)
+
+        if sessions_archived:
+            self._incremental_vacuum()
+
+        logger.info(
+            "Archived %d messages from %d sessions ended before %s",
+            messages_archived, sessions_archived, cutoff.isoformat()
+        )
+
+        return {
+            "sessions_archived": sessions_archived,
+            "messages_archived": messages_archived,
+            "cutoff": cutoff.isoformat()
+        }
+
+    def get_transcript(self, db: Session, session_id: str) -> list:
+        """Full transcript for a session: archived messages followed by any still in the hot table"""
+        transcript = []
+
+        archive = db.query(ChatArchive).filter(ChatArchive.session_id == session_id).first()
+        if archive:
+            transcript.extend(self._decompress(archive.payload))
+
+        messages = db.query(ChatMessage).filter(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).all()
+        transcript.extend(self._serialize_message(msg) for msg in messages)
+
+        return transcript
+
+    async def run_periodically(self):
+        """Background loop: run the retention job every `interval_hours`"""
+        while True:
+            db = SessionLocal()
+            try:
+                await asyncio.to_thread(self.archive_ended_sessions, db)
+            except Exception as e:
+                logger.exception("Error running retention job: %s", e)
+            finally:
+                db.close()
+
+            await asyncio.sleep(self.interval_hours * 3600)
+
+    def _archive_session(self, db: Session, session_id: str) -> int:
+        """Write a session's hot messages into its archive row (merging with any earlier archive)"""
+        messages = [
+            self._serialize_message(msg)
+            for msg in db.query(ChatMessage).filter(
+                ChatMessage.session_id == session_id
+            ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+        ]
+
+        archive = db.query(ChatArchive).filter(ChatArchive.session_id == session_id).first()
+        if archive:
+            messages = self._decompress(archive.payload) + messages
+        else:
+            archive = ChatArchive(session_id=session_id)
+            db.add(archive)
+
+        archive.payload = gzip.compress(json.dumps(messages).encode("utf-8"))
+        archive.message_count = len(messages)
+        timestamps = [msg["timestamp"] for msg in messages if msg["timestamp"]]
+        archive.first_message_at = datetime.fromisoformat(timestamps[0]) if timestamps else None
+        archive.last_message_at = datetime.fromisoformat(timestamps[-1]) if timestamps else None
+        archive.archived_at = datetime.utcnow()
+
+        return len(messages)
+
+    def enable_incremental_vacuum(self) -> dict:
+        """
+        Switch existing SQLite files to incremental auto_vacuum (new ones are
+        created that way). Needs a full VACUUM, which rewrites the file under
+        an exclusive lock, so it's only ever run on request, off-peak.
+        """
+        converted = []
+        for shard_id, engine in engines.items():
+            if engine.dialect.name != "sqlite":
+                continue
+
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                    logger.warning("Converting shard %s to incremental auto_vacuum (full VACUUM)", shard_id)
+                    conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                    conn.execute(text("VACUUM"))
+                    converted.append(shard_id)
+        return {"converted_shards": converted}
+
+    def _incremental_vacuum(self):
+        """Return up to `vacuum_pages` freed pages per shard to the OS (SQLite with incremental auto_vacuum only)"""
+        for shard_id, engine in engines.items():
+            if engine.dialect.name != "sqlite":
+                continue
+
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+                if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                    logger.info("Shard %s doesn't use incremental auto_vacuum; freed pages stay in the file", shard_id)
+                    continue
+
+                # Step through every result row, or only the first page is freed (no rows: nothing to free)
+                result = conn.execute(text(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})"))
+                if result.returns_rows:
+                    result.fetchall()
+
+    @staticmethod
+    def _serialize_message(msg: ChatMessage) -> dict:
+        return {
+            "id": msg.id,
+            "role": msg.role,
+            "message": msg.message,
+            "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
+            "intent": msg.intent,
+            "sentiment": msg.sentiment
+        }
+
+    @staticmethod
+    def _decompress(payload: bytes) -> list:
+        return json.loads(gzip.decompress(payload).decode("utf-8"))
+
+
+# Singleton instance
+retention_service = RetentionService()
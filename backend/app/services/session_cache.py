@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from app.config import get_settings
+import threading
+import time
+
+settings = get_settings()
+
+
+@dataclass(frozen=True)
+class LeadSnapshot:
+    """Read-only copy of the Lead fields the chat flows need"""
+    name: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    purpose: Optional[str] = None
+    selected_category: Optional[str] = None
+    location: Optional[str] = None
+    budget: Optional[str] = None
+    timeline: Optional[str] = None
+    property_type: Optional[str] = None
+    lead_status: Optional[str] = None
+    is_qualified: Optional[bool] = None
+    notes: Optional[str] = None
+
+    @classmethod
+    def from_lead(cls, lead) -> "LeadSnapshot":
+        return cls(**{name: getattr(lead, name) for name in cls.__dataclass_fields__})
+
+
+@dataclass(frozen=True)
+class SessionSnapshot:
+    """Read-only copy of a ChatSession's state"""
+    session_id: str
+    is_active: bool = True
+    lead_captured: bool = False
+    context: Dict[str, Any] = field(default_factory=dict)
+
+
+# Cached marker for "looked it up, no row exists". Only for rows nobody can
+# create later (session ids are generated by create_session), never for leads.
+MISSING = object()
+
+
+class SessionCache:
+    """
+    Bounded LRU of per-session snapshots with a TTL.
+
+    DatabaseService reads through it and refreshes or drops entries on every
+    write, so within a process entries never go stale; the TTL bounds staleness
+    when several workers write the same session.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, session_id: str):
+        """Return the cached value, MISSING for a cached absence, or None on a cache miss"""
+        key = (kind, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, kind: str, session_id: str, value):
+        """Store a snapshot (or MISSING), evicting the least recently used entry when full"""
+        key = (kind, session_id)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind: str, session_id: str):
+        with self._lock:
+            self._entries.pop((kind, session_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Singleton instance
+session_cache = SessionCache(
+    max_entries=settings.session_cache_size,
+    ttl_seconds=settings.session_cache_ttl_seconds
+)
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+from app.config import get_settings
+import threading
+import time
+
+settings = get_settings()
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for RedisBackend, with the same (async) API and
+    semantics: a bounded LRU with per-key TTLs. Each namespace gets its own
+    instance (and bound), so a flood of rate limit buckets can't evict
+    session flow state. Only shared within one worker; use it for a single
+    worker, tests and benchmarks.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [value, expires_at or None]
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._get_locked(key)
+            return entry[0] if entry else None
+
+    async def set(self, key: str, value: bytes, ttl: float = None, nx: bool = False) -> bool:
+        """Store `value`, expiring after `ttl` seconds; with nx, only if the key is absent"""
+        with self._lock:
+            if nx and self._get_locked(key) is not None:
+                return False
+            self._put_locked(key, value, ttl)
+            return True
+
+    async def compare_and_set(self, key: str, expected: Optional[bytes], value: bytes, ttl: float = None) -> bool:
+        """Store `value` only if the key currently holds `expected` (None: is absent)"""
+        with self._lock:
+            entry = self._get_locked(key)
+            if (entry[0] if entry else None) != expected:
+                return False
+            self._put_locked(key, value, ttl)
+            return True
+
+    async def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def delete_if(self, key: str, expected: bytes) -> bool:
+        """Delete the key only if it currently holds `expected`"""
+        with self._lock:
+            entry = self._get_locked(key)
+            if entry is None or entry[0] != expected:
+                return False
+            del self._entries[key]
+            return True
+
+    async def take_tokens(self, key: str, per_second: float, burst: int, cost: float = 1) -> float:
+        """Token bucket: spend `cost` tokens; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._get_locked(key)
+            tokens, ts = entry[0] if entry else (float(burst), now)
+            tokens = min(burst, tokens + (now - ts) * per_second)
+
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / per_second
+            self._put_locked(key, (tokens, now), burst / per_second + 1)
+            return wait
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_locked(self, key: str) -> Optional[list]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_locked(self, key: str, value, ttl: Optional[float]):
+        self._entries[key] = [value, time.monotonic() + ttl if ttl is not None else None]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (ARGV[1] == '1' and current ~= ARGV[2]) or (ARGV[1] == '0' and current) then
+    return 0
+end
+if ARGV[4] == '' then
+    redis.call('SET', KEYS[1], ARGV[3])
+else
+    redis.call('SET', KEYS[1], ARGV[3], 'PX', ARGV[4])
+end
+return 1
+"""
+
+_DELETE_IF_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Same bucket arithmetic as MemoryBackend.take_tokens, atomically on the Redis server (using its clock)
+_TAKE_TOKENS_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """
+    The same operations against Redis (or anything speaking its protocol,
+    e.g. Valkey or KeyDB), shared by every worker. Uses the redis.asyncio
+    client, so the round trips never block the event loop. Keys are prefixed
+    with the namespace; size bounds are left to the server's maxmemory policy.
+    """
+
+    def __init__(self, client, prefix: str):
+        self.prefix = prefix
+        self._client = client
+        self._cas = client.register_script(_CAS_SCRIPT)
+        self._delete_if = client.register_script(_DELETE_IF_SCRIPT)
+        self._take_tokens = client.register_script(_TAKE_TOKENS_SCRIPT)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float = None, nx: bool = False) -> bool:
+        return bool(await self._client.set(self.prefix + key, value, px=_millis(ttl), nx=nx))
+
+    async def compare_and_set(self, key: str, expected: Optional[bytes], value: bytes, ttl: float = None) -> bool:
+        args = ["0" if expected is None else "1", expected or b"", value, _millis(ttl) or ""]
+        return bool(await self._cas(keys=[self.prefix + key], args=args))
+
+    async def delete(self, key: str):
+        await self._client.delete(self.prefix + key)
+
+    async def delete_if(self, key: str, expected: bytes) -> bool:
+        return bool(await self._delete_if(keys=[self.prefix + key], args=[expected]))
+
+    async def take_tokens(self, key: str, per_second: float, burst: int, cost: float = 1) -> float:
+        return float(await self._take_tokens(keys=[self.prefix + key], args=[per_second, burst, cost]))
+
+    async def clear(self):
+        async for key in self._client.scan_iter(match=self.prefix + "*", count=1000):
+            await self._client.delete(key)
+
+
+def _millis(ttl: Optional[float]) -> Optional[int]:
+    return max(1, int(ttl * 1000)) if ttl is not None else None
+
+
+_redis_client = None
+_backends: Dict[str, object] = {}
+
+
+def shared_cache(namespace: str, max_entries: int = 100000):
+    """
+    The cache backend for one namespace ("flow", "idempotency", ...), per
+    settings.cache_backend: 'memory' (this worker only) or 'redis' (shared
+    by all workers at settings.redis_url). `max_entries` bounds the memory
+    backend only.
+    """
+    backend = _backends.get(namespace)
+    if backend is None:
+        if settings.cache_backend == "redis":
+            backend = RedisBackend(_redis(), prefix=f"{settings.cache_key_prefix}{namespace}:")
+        else:
+            backend = MemoryBackend(max_entries)
+        _backends[namespace] = backend
+    return backend
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis.asyncio
+        _redis_client = redis.asyncio.Redis.from_url(settings.redis_url)
+    return _redis_client
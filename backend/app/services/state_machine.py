@@ -1,6 +1,16 @@
 from enum import Enum
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass, replace
+from pathlib import Path
+from string import Formatter
+from app.prompts.system_prompts import CATEGORIES
+import json
+import os
+import threading
+import time
+
+current_file_path = Path(__file__).resolve()
+flows_file_path = current_file_path.parent.parent.parent / 'data' / 'flows.json'
 
 
 class FlowState(str, Enum):
@@ -34,340 +44,325 @@ class FlowState(str, Enum):
     ASK_FOLLOWUP = "ask_followup"
     
     # Terminal
-    HANDOFF = "handoff"
     ENDED = "ended"
 
 
-@dataclass
+@dataclass(frozen=True)
 class UIComponent:
     """Defines a UI component to show in chat"""
     type: str  # "buttons", "form", "dropdown", "multiselect", "text_input", "date_picker"
     data: Dict[str, Any]
     
     
-@dataclass
+@dataclass(frozen=True)
 class StateResponse:
     """Response for a given state"""
     message: str
     ui_component: Optional[UIComponent] = None
-    next_state: Optional[FlowState] = None
+    next_state: Optional[str] = None  # Default transition, if any
     show_menu_button: bool = True
     requires_llm: bool = False
     metadata: Dict[str, Any] = None
 
 
-class StateMachine:
-    """Manages chatbot state transitions and responses"""
+class FlowDefinitionError(ValueError):
+    """Raised when a flow definition file is malformed, dangling or has unreachable states"""
+
+
+# Column 0 of every transition table row: the state's fallback transition
+ANY_ACTION = "*"
+
+
+@dataclass(frozen=True)
+class CompiledFlow:
+    """
+    Immutable, validated flow. Transitions are a dense table:
+    table[state_index][action_index] -> state_index, with every fallback
+    (global transition, then the state's "*" transition, then staying put)
+    already resolved, so a lookup is two dict hits and two list indexes.
+    """
+    version: str
+    menu_state: str
+    categories: Dict[str, str]
+    default_category: str
+    state_names: Tuple[str, ...]
+    state_index: Dict[str, int]
+    action_index: Dict[str, int]
+    table: Tuple[Tuple[int, ...], ...]
+    responses: Tuple[StateResponse, ...]
+    templated: Tuple[Tuple[bool, bool], ...]
+    captures: Tuple[Optional[str], ...]
+    action_labels: Tuple[Dict[str, str], ...]
     
-    def __init__(self):
-        self.lead_context = {"name":None, "email":None, "phone":None}
-        self.state_config = self._build_state_config()
-        
+    def next_state(self, state: str, action: Optional[str]) -> str:
+        """O(1) transition; unknown states behave like the main menu"""
+        row = self.table[self.state_index.get(state, self.state_index[self.menu_state])]
+        return self.state_names[row[self.action_index.get(action, 0)]]
     
-    def _build_state_config(self) -> Dict[FlowState, StateResponse]:
-        """Build configuration for all states"""
-        return {
-            # ====== BROCHURE FLOW ======
-            FlowState.BROCHURE_SEND: StateResponse(
-                message="✅ Perfect! Our brochure is on its way to your email.",
-                ui_component=None,
-                next_state=FlowState.BROCHURE_COMPLETE,
-                show_menu_button=True
-            ),
-            
-            FlowState.BROCHURE_COMPLETE: StateResponse(
-                message="Let's find properties that match your needs! 🏡",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "explore_properties ", "label": "Explore Properties"},
-                            {"value": "back_to_menu", "label": "Back to Menu"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.HANDOFF,
-                show_menu_button=True
-            ),
-            
-            """ FlowState.BROCHURE_PREFERENCES: StateResponse(
-                message="Please share your preferences:",
-                ui_component=UIComponent(
-                    type="preference_form",
-                    data={
-                        "fields": [
-                            {
-                                "name": "budget",
-                                "label": "💰 Budget Range",
-                                "type": "dropdown",
-                                "options": [
-                                    {"value": "under_50", "label": "Under ₹50 Lakhs"},
-                                    {"value": "50_100", "label": "₹50L - ₹1 Crore"},
-                                    {"value": "100_200", "label": "₹1 Cr - ₹2 Crore"},
-                                    {"value": "200_plus", "label": "₹2 Crore+"}
-                                ],
-                                "required": True
-                            },
-                            {
-                                "name": "location",
-                                "label": "📍 Preferred Location",
-                                "type": "multiselect_chips",
-                                "options": ["OMR", "ECR", "Velachery", "Anna Nagar", "T Nagar"],
-                                "required": True
-                            },
-                            {
-                                "name": "property_type",
-                                "label": "🏠 Property Type",
-                                "type": "buttons",
-                                "options": [
-                                    {"value": "apartment", "label": "🏢 Apartments"},
-                                    {"value": "villa", "label": "🏡 Villas"},
-                                    {"value": "plot", "label": "📐 Plots"},
-                                    {"value": "commercial", "label": "🏪 Commercial"}
-                                ],
-                                "required": True
-                            }
-                        ],
-                        "submit_label": "Find Properties"
-                    }
-                ),
-                next_state=FlowState.BROCHURE_PREFERENCES_COLLECTED,
-                show_menu_button=True
-            ),
-            
-            FlowState.BROCHURE_PREFERENCES_COLLECTED: StateResponse(
-                message="Great! Based on your preferences, we'll send you tailored recommendations.",
-                ui_component=None,
-                next_state=FlowState.BROCHURE_COMPLETE,
-                show_menu_button=True
-            ), """ : '',
-            
-            
-            # ====== CALL SCHEDULE FLOW ======
-            FlowState.BOOKING_START: StateResponse(
-                message="Great! Let’s schedule a quick call with our property expert.",
-                ui_component=UIComponent(
-                    type="number_confirmation",
-                    data={
-                        "fields": [
-                            {"name": "number_field", "label": str(self.lead_context["phone"]), "options": [{"value": "confirm", "label": "Continue"}]}
-                        ]
-                    }
-                ),
-                next_state=FlowState.BOOKING_TIME_SELECTION,
-                show_menu_button=True
-            ),
-            FlowState.BOOKING_TIME_SELECTION: StateResponse(
-                message="When works best for you?",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "morning", "label": "🌞 Morning (9 AM – 12 PM)"},
-                            {"value": "afternoon", "label": "☀️ Afternoon (12 PM – 4 PM)"},
-                            {"value": "evening", "label": "🌇 Evening (4 PM – 8 PM)"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.BOOKING_CONFIRMATION,
-                show_menu_button=True
-            ),
-            FlowState.BOOKING_CONFIRMATION: StateResponse(
-                message="✅ All set! Your appointment has been scheduled.\n\nOur property expert will call you during the {time_slot}.",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                            "options": [
-                            {"value": "explore_properties", "label": "🏡 Explore Properties"},
-                            {"value": "back_to_menu", "label": "🏠 Back to Menu"}
-                            ]
-                        }
-                ),
-                next_state=FlowState.HANDOFF,
-                show_menu_button=False
-            ),
-            # ====== EXPLORE PROPERTIES FLOW ======
-            FlowState.EXPLORE_START: StateResponse(
-                message="🏡 Let's find your ideal property!\n\nPlease choose the type of property you're interested in:",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "apartment", "label": "🏢 Apartments"},
-                            {"value": "villa", "label": "🏡 Villas"},
-                            {"value": "plot", "label": "📐 Residential Plots"},
-                            {"value": "commercial", "label": "🏪 Commercial Spaces"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.EXPLORE_PROPERTY_TYPE,
-                show_menu_button=True
-            ),
-            FlowState.EXPLORE_PROPERTY_TYPE: StateResponse(
-            message="Here are some available {property_type_label} in Chennai:",
-            ui_component=UIComponent(
-                type="property_cards",
-                data={
-                    "property_type": "{property_type}",
-                    "limit": 6
-                }
-            ),
-            next_state=FlowState.EXPLORE_SHOW_MORE,
-            show_menu_button=True
-            ),
-            FlowState.EXPLORE_SHOW_MORE: StateResponse(
-                message="Want to see more properties? Let me know your preferences to narrow it down:",
-                ui_component=UIComponent(
-                    type="preference_form",
-                    data={
-                        "fields": [
-                            {
-                                "name": "budget",
-                                "label": "💰 Budget Range",
-                                "type": "dropdown",
-                                "options": [
-                                    {"value": "under_50", "label": "Under ₹50 Lakhs"},
-                                    {"value": "50_100", "label": "₹50L - ₹1 Crore"},
-                                    {"value": "100_200", "label": "₹1 Cr - ₹2 Crore"},
-                                    {"value": "200_plus", "label": "₹2 Crore+"}
-                                ],
-                                "required": False
-                            },
-                            {
-                                "name": "location",
-                                "label": "📍 Preferred Location",
-                                "type": "multiselect_chips",
-                                "options": ["OMR", "ECR", "Velachery", "Anna Nagar", "T Nagar"],
-                                "required": False
-                            }
-                        ],
-                        "submit_label": "Show Matching Properties"
-                    }
-                ),
-                next_state=FlowState.EXPLORE_FILTERED_RESULTS,
-                show_menu_button=True
-            ),
-
-            FlowState.EXPLORE_FILTERED_RESULTS: StateResponse(
-                message="Here are the properties matching your preferences:",
-                ui_component=UIComponent(
-                    type="property_cards",
-                    data={
-                        "filtered": True,
-                        "preferences": "{preferences}"
-                    }
-                ),
-                next_state=FlowState.EXPLORE_PROPERTY_ACTION,
-                show_menu_button=True
-            ),
+    def capture(self, state: str, action: Optional[str]) -> Dict[str, Any]:
+        """User data a state records from the chosen action (e.g. property_type)"""
+        index = self.state_index.get(state)
+        if index is None or not self.captures[index] or action is None:
+            return {}
+        
+        # With labels defined, only the state's own options are captured (not e.g. "menu")
+        labels = self.action_labels[index]
+        if labels and action not in labels:
+            return {}
+        
+        key = self.captures[index]
+        captured = {key: action}
+        if action in labels:
+            captured[f"{key}_label"] = labels[action]
+        return captured
 
-            FlowState.EXPLORE_PROPERTY_ACTION: StateResponse(
-                message="✅ Got it! Our team will reach out soon with detailed information about this property.",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "another", "label": "🏡 See More Properties"},
-                            {"value": "menu", "label": "🏠 Back to Menu"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.HANDOFF,
-                show_menu_button=False
-            ),
-            # ====== ASK AI FLOW ======
-            FlowState.ASK_START: StateResponse(
-                message="💬 Sure! You can ask me anything about our properties, locations, prices, or availability.\n\nI'll do my best to help you out!\n\n💡 Try asking questions using the input field below:",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "omr_projects", "label": "Projects near OMR?"},
-                            {"value": "3bhk_price", "label": "3BHK apartment prices?"},
-                            {"value": "ecr_plots", "label": "Plots in ECR?"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.ASK_QUERY_RECEIVED,
-                show_menu_button=True,
-                requires_llm=False
-            ),
 
-            FlowState.ASK_QUERY_RECEIVED: StateResponse(
-                message="🔍 Let me check that for you...",
-                ui_component=None,
-                next_state=FlowState.ASK_RESPONSE,
-                show_menu_button=True,
-                requires_llm=True  # This will trigger RAG + LLM
-            ),
+def compile_flow(definition: Dict[str, Any], refs: Dict[str, Any] = None) -> CompiledFlow:
+    """Validate a flow definition and compile it into a CompiledFlow"""
+    refs = refs or {}
+    states = definition.get("states") or {}
+    if not states:
+        raise FlowDefinitionError("Flow definition has no states")
+    
+    menu_state = definition.get("menu_state")
+    categories = definition.get("categories") or {}
+    global_transitions = definition.get("global_transitions") or {}
+    default_category = definition.get("default_category")
+    
+    # Dangling references
+    def check_target(target: str, where: str):
+        if target not in states:
+            raise FlowDefinitionError(f"{where} points to unknown state '{target}'")
+    
+    check_target(menu_state, "menu_state")
+    if default_category not in categories:
+        raise FlowDefinitionError(f"default_category '{default_category}' is not a category")
+    for category, target in categories.items():
+        check_target(target, f"Category '{category}'")
+    for action, target in global_transitions.items():
+        check_target(target, f"Global transition '{action}'")
+    for name, spec in states.items():
+        for action, target in (spec.get("transitions") or {}).items():
+            check_target(target, f"Transition '{name}' --{action}-->")
+    
+    # Unreachable states (entry points: menu, categories, global transitions)
+    reachable = set()
+    pending = [menu_state, *categories.values(), *global_transitions.values()]
+    while pending:
+        name = pending.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        pending.extend((states[name].get("transitions") or {}).values())
+    unreachable = sorted(set(states) - reachable)
+    if unreachable:
+        raise FlowDefinitionError(f"Unreachable states: {', '.join(unreachable)}")
+    
+    state_names = tuple(states)
+    state_index = {name: i for i, name in enumerate(state_names)}
+    
+    actions = [ANY_ACTION]
+    for action in [*global_transitions, *(a for spec in states.values() for a in (spec.get("transitions") or {}))]:
+        if action not in actions:
+            actions.append(action)
+    action_index = {action: i for i, action in enumerate(actions)}
+    
+    table = []
+    responses = []
+    templated = []
+    for name in state_names:
+        spec = states[name]
+        transitions = spec.get("transitions") or {}
+        fallback = transitions.get(ANY_ACTION, name)
+        
+        table.append(tuple(
+            state_index[transitions.get(action) or global_transitions.get(action) or fallback]
+            for action in actions
+        ))
+        
+        ui_spec = spec.get("ui_component")
+        ui_component = None
+        if ui_spec:
+            ui_component = UIComponent(type=ui_spec["type"], data=_resolve_refs(ui_spec.get("data", {}), refs))
+        
+        response = StateResponse(
+            message=spec.get("message", ""),
+            ui_component=ui_component,
+            next_state=transitions.get(ANY_ACTION),
+            show_menu_button=spec.get("show_menu_button", True),
+            requires_llm=spec.get("requires_llm", False)
+        )
+        responses.append(response)
+        templated.append((
+            _has_placeholders(response.message),
+            ui_component is not None and _has_placeholders(ui_component.data)
+        ))
+    
+    return CompiledFlow(
+        version=str(definition.get("version", "")),
+        menu_state=menu_state,
+        categories=dict(categories),
+        default_category=default_category,
+        state_names=state_names,
+        state_index=state_index,
+        action_index=action_index,
+        table=tuple(table),
+        responses=tuple(responses),
+        templated=tuple(templated),
+        captures=tuple(states[name].get("capture") for name in state_names),
+        action_labels=tuple(states[name].get("action_labels") or {} for name in state_names)
+    )
 
-            FlowState.ASK_RESPONSE: StateResponse(
-                message="{ai_response}",  # Will be filled by LLM
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "brochure", "label": "📋 Get Brochure"},
-                            {"value": "callback", "label": "📞 Schedule Call"},
-                            {"value": "another_q", "label": "❓ Ask Another"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.ASK_FOLLOWUP,
-                show_menu_button=True,
-                requires_llm=False
-            ),
 
-            FlowState.ASK_FOLLOWUP: StateResponse(
-                message="Would you like me to help you further?",
-                ui_component=UIComponent(
-                    type="buttons",
-                    data={
-                        "options": [
-                            {"value": "menu", "label": "🏠 Main Menu"},
-                            {"value": "end", "label": "👋 End Chat"}
-                        ]
-                    }
-                ),
-                next_state=FlowState.HANDOFF,
-                show_menu_button=False
-            ),
-        }
+class StateMachine:
+    """
+    Manages chatbot state transitions and responses.
+    
+    Flows are defined in data/flows.json and compiled into an immutable
+    CompiledFlow shared by every request; per-request values are filled in by
+    get_state_response on a copy. Edits to the file are picked up without a
+    restart (an invalid edit is reported and the previous flow kept).
+    """
+    
+    reload_check_interval = 1.0  # seconds between mtime checks
+    
+    def __init__(self, flows_file: Path = flows_file_path):
+        self.flows_file = Path(flows_file)
+        self._reload_lock = threading.Lock()
+        self._next_check = 0.0
+        self._mtime = None
+        self._flow: Optional[CompiledFlow] = None  # Compiled on first use (or by the startup warm-up)
+    
+    @property
+    def flow(self) -> CompiledFlow:
+        """Current compiled flow (hot-reloaded if the definition file changed)"""
+        if self._flow is None:
+            return self.load()
+        self.reload_if_changed()
+        return self._flow
+    
+    def load(self) -> CompiledFlow:
+        """Compile the flow definition, once"""
+        with self._reload_lock:
+            if self._flow is None:
+                self._mtime = os.stat(self.flows_file).st_mtime
+                self._flow = self._load()
+                self._next_check = time.monotonic() + self.reload_check_interval
+        return self._flow
+    
+    def _load(self) -> CompiledFlow:
+        with open(self.flows_file, 'r', encoding='utf-8') as f:
+            definition = json.load(f)
+        
+        categories = [
+            {"id": key, "label": value["label"], "emoji": value["emoji"]}
+            for key, value in CATEGORIES.items()
+        ]
+        return compile_flow(definition, refs={"categories": categories})
+    
+    def reload_if_changed(self) -> bool:
+        """Recompile if the definition file changed; returns True when a new flow was loaded"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        
+        with self._reload_lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.reload_check_interval
+            
+            try:
+                mtime = os.stat(self.flows_file).st_mtime
+                if mtime == self._mtime:
+                    return False
+                self._mtime = mtime
+                self._flow = self._load()
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Keeping previous flow definition, reload failed: {e}")
+                return False
+        
+        print(f"🔄 Reloaded flow definition (version {self._flow.version})")
+        return True
     
     def get_state_response(
         self,
-        state: FlowState,
+        state: str,
         context: Dict[str, Any] = None
     ) -> StateResponse:
         """Get response for a given state with context"""
-        self.lead_context = context
-        self.state_config = self._build_state_config()
-        response = self.state_config.get(state)
+        flow = self.flow
+        index = flow.state_index.get(state)
         
-        if not response:
+        if index is None:
             raise ValueError(f"Unknown state: {state}")
         
-        # Format message with context if provided
-        if context and response.message:
-            try:
-                response.message = response.message.format(**context)
-            except KeyError:
-                pass  # Message doesn't need formatting
+        response = flow.responses[index]
+        message_templated, ui_templated = flow.templated[index]
+        if not context or not (message_templated or ui_templated):
+            return response  # Static state: share the compiled instance
         
-        return response
+        # Render a copy; the compiled response is shared across requests
+        changes = {}
+        if message_templated:
+            changes["message"] = _render(response.message, context)
+        if ui_templated:
+            changes["ui_component"] = UIComponent(
+                type=response.ui_component.type,
+                data=_render(response.ui_component.data, context)
+            )
+        
+        return replace(response, **changes)
     
     def get_next_state(
         self,
-        current_state: FlowState,
+        current_state: str,
         user_action: str = None
-    ) -> FlowState:
+    ) -> str:
         """Determine next state based on current state and user action"""
-        response = self.state_config.get(current_state)
-        
-        if response and response.next_state:
-            return response.next_state
-        
-        return current_state
+        return self.flow.next_state(current_state, user_action)
+
+
+def _has_placeholders(value: Any) -> bool:
+    """Whether a string (or any string nested in dicts/lists) contains {fields}"""
+    if isinstance(value, str):
+        return any(field is not None for _, field, _, _ in Formatter().parse(value))
+    if isinstance(value, dict):
+        return any(_has_placeholders(v) for v in value.values())
+    if isinstance(value, list):
+        return any(_has_placeholders(v) for v in value)
+    return False
+
+
+def _resolve_refs(value: Any, refs: Dict[str, Any]) -> Any:
+    """Replace "$name" strings in a definition with values supplied by the app"""
+    if isinstance(value, str) and value.startswith("$"):
+        if value[1:] not in refs:
+            raise FlowDefinitionError(f"Unknown reference '{value}'")
+        return refs[value[1:]]
+    if isinstance(value, dict):
+        return {k: _resolve_refs(v, refs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve_refs(v, refs) for v in value]
+    return value
+
+
+def _render(value: Any, context: Dict[str, Any]) -> Any:
+    """
+    Fill {fields} from context, returning new objects; unknown fields leave the
+    string as-is. A string that is exactly one "{field}" takes the raw value.
+    """
+    if isinstance(value, str):
+        if value.startswith("{") and value.endswith("}") and value[1:-1].isidentifier():
+            return context.get(value[1:-1], value)
+        try:
+            return value.format(**context)
+        except KeyError:
+            return value  # Message doesn't need formatting
+    if isinstance(value, dict):
+        return {k: _render(v, context) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_render(v, context) for v in value]
+    return value
 
 
 # Singleton instance
@@ -0,0 +1,342 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import List, Optional
+from app.config import get_settings
+from app.services.metrics import route_template
+import functools
+import inspect
+import json
+import queue
+import random
+import threading
+import time
+
+settings = get_settings()
+
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+
+class Span:
+    """One timed operation of a trace (OpenTelemetry data model, minus events/links)"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.error = f"{type(error).__name__}: {error}"
+
+
+# Marks a trace that lost the sampling draw, so its descendants are skipped without a new draw
+_UNSAMPLED = object()
+
+_current: ContextVar[Optional[object]] = ContextVar("current_span", default=None)
+
+_NOT_TRACED = nullcontext()
+
+
+class Tracer:
+    """
+    Minimal tracer: spans nest through a ContextVar (so they follow asyncio
+    tasks and asyncio.to_thread), the sampling decision is made once per
+    trace at its root, and finished spans are handed to an exporter.
+    """
+
+    def __init__(self, enabled: bool, sample_rate: float, exporter=None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def span(self, name: str, kind: int = KIND_INTERNAL, **attributes):
+        """Time a block as a child of the current span (or a new sampled-or-not trace)"""
+        if not self.enabled or _current.get() is _UNSAMPLED:
+            return _NOT_TRACED
+        return self._span(name, kind, attributes)
+
+    @contextmanager
+    def _span(self, name: str, kind: int, attributes: dict):
+        span = self.start_span(name, kind, **attributes)
+        if span is None:
+            # Lost the sampling draw; mark the context so nested spans don't draw again
+            token = _current.set(_UNSAMPLED)
+            try:
+                yield None
+            finally:
+                _current.reset(token)
+            return
+
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(span)
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, parent: tuple = None, **attributes) -> Optional[Span]:
+        """
+        Start a span without making it current (for async generators, whose
+        context can't be reset across yields); None if it isn't sampled.
+        `parent` is an incoming (trace_id, span_id, sampled) to continue.
+        """
+        if not self.enabled:
+            return None
+
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+            if not sampled:
+                return None
+            return Span(trace_id, parent_id, name, kind, attributes)
+
+        current = _current.get()
+        if current is _UNSAMPLED:
+            return None
+        if current is None:
+            if random.random() >= self.sample_rate:
+                return None
+            return Span(f"{random.getrandbits(128):032x}", None, name, kind, attributes)
+        return Span(current.trace_id, current.span_id, name, kind, attributes)
+
+    def end_span(self, span: Optional[Span]):
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if span.status == STATUS_UNSET:
+            span.status = STATUS_OK
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def traced(self, name: str = None, **attributes):
+        """Decorator: run a sync or async function inside a span"""
+
+        def decorate(fn):
+            span_name = name or fn.__qualname__
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    if not self.enabled or _current.get() is _UNSAMPLED:
+                        return await fn(*args, **kwargs)
+                    with self._span(span_name, KIND_INTERNAL, attributes):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    if not self.enabled or _current.get() is _UNSAMPLED:
+                        return fn(*args, **kwargs)
+                    with self._span(span_name, KIND_INTERNAL, attributes):
+                        return fn(*args, **kwargs)
+            return wrapper
+
+        return decorate
+
+    def trace_methods(self, cls, prefix: str, exclude: tuple = ()):
+        """Wrap every public static/regular method of `cls` in a span named `prefix.method`"""
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr in exclude:
+                continue
+            if isinstance(value, staticmethod):
+                setattr(cls, attr, staticmethod(self.traced(f"{prefix}.{attr}")(value.__func__)))
+            elif inspect.isfunction(value):
+                setattr(cls, attr, self.traced(f"{prefix}.{attr}")(value))
+        return cls
+
+
+class BatchExporter:
+    """
+    Buffers finished spans and writes them in batches from a daemon thread,
+    as OTLP/JSON: one ExportTraceServiceRequest per line to a file, or POSTed
+    to an OTLP/HTTP collector's /v1/traces. Spans are dropped (and counted)
+    if the buffer is full rather than slowing requests down.
+    """
+
+    def __init__(self, file_path: str = None, otlp_endpoint: str = None, service_name: str = "app",
+                 max_queue: int = 10000, batch_size: int = 512, interval_seconds: float = 5):
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint.rstrip("/") + "/v1/traces" if otlp_endpoint else None
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.dropped = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Write out everything buffered so far (called on shutdown)"""
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error exporting traces: {e}")
+
+    def _take(self, limit: int) -> List[Span]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Span]):
+        document = json.dumps(self.encode(batch), separators=(",", ":"))
+        if self.file_path:
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write(document + "\n")
+        if self.otlp_endpoint:
+            import httpx
+            httpx.post(self.otlp_endpoint, content=document, headers={"Content-Type": "application/json"}, timeout=10)
+
+    def encode(self, batch: List[Span]) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": self.service_name})},
+            "scopeSpans": [{"scope": {"name": "app.services.tracing"}, "spans": [_encode_span(s) for s in batch]}]
+        }]}
+
+
+def _encode_span(span: Span) -> dict:
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _attributes(span.attributes),
+        "status": {"code": span.status, **({"message": span.error} if span.error else {})}
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+def _attributes(attributes: dict) -> list:
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            encoded.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            encoded.append({"key": key, "value": {"doubleValue": value}})
+        elif value is not None:
+            encoded.append({"key": key, "value": {"stringValue": str(value)}})
+    return encoded
+
+
+def parse_traceparent(header: bytes) -> Optional[tuple]:
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None if malformed"""
+    try:
+        version, trace_id, span_id, flags = header.decode("ascii").strip().split("-")[:4]
+        if len(trace_id) != 32 or len(span_id) != 16 or int(trace_id, 16) == 0:
+            return None
+        return trace_id, span_id, bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+
+
+class TracingMiddleware:
+    """
+    Root span per HTTP request, named by route template. Continues the
+    caller's trace (and its sampling decision) when a traceparent header is
+    sent, and returns a traceparent header for sampled requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            return await self.app(scope, receive, send)
+
+        header = next((value for name, value in scope["headers"] if name == b"traceparent"), None)
+        parent = parse_traceparent(header) if header else None
+        span = self.tracer.start_span("HTTP " + scope["method"], KIND_SERVER, parent=parent,
+                                      **{"http.method": scope["method"], "http.target": scope["path"]})
+        if span is None:
+            token = _current.set(_UNSAMPLED)
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                _current.reset(token)
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                span.set(**{"http.status_code": message["status"]})
+                if message["status"] >= 500:
+                    span.status = STATUS_ERROR
+                message = {**message, "headers": [
+                    *message.get("headers", ()), (b"traceparent", f"00-{span.trace_id}-{span.span_id}-01".encode())
+                ]}
+            await send(message)
+
+        token = _current.set(span)
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            route = route_template(scope)
+            span.name = f"{scope['method']} {route}"
+            span.set(**{"http.route": route})
+            self.tracer.end_span(span)
+
+
+def _build_exporter() -> Optional[BatchExporter]:
+    if not settings.tracing_enabled:
+        return None
+    return BatchExporter(
+        file_path=settings.tracing_file_path if settings.tracing_exporter in ("file", "both") else None,
+        otlp_endpoint=settings.tracing_otlp_endpoint if settings.tracing_exporter in ("otlp", "both") else None,
+        service_name=settings.app_name
+    )
+
+
+# Singleton instance
+tracer = Tracer(
+    enabled=settings.tracing_enabled,
+    sample_rate=settings.tracing_sample_rate,
+    exporter=_build_exporter()
+)
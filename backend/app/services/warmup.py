@@ -0,0 +1,49 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+
+class WarmUp:
+    """
+    Startup work (database schema, Gemini SDK, property catalog, flow
+    definition) run in the background, so the process starts serving - and
+    /health answers - right away. Each step is also done lazily by its first
+    user, so an early request still works, it just pays for what it needs.
+    /ready reports 503 until every step has finished.
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], None]]] = []
+        self.status: Dict[str, str] = {}  # step -> 'pending', 'done' or the error
+        self.seconds: Dict[str, float] = {}
+        self.ready = False
+        self.finished_at: Optional[float] = None
+
+    def add(self, name: str, fn: Callable[[], None]):
+        """Register a blocking step; steps run in order, each in a worker thread"""
+        self._steps.append((name, fn))
+        self.status[name] = "pending"
+
+    async def run(self):
+        for name, fn in self._steps:
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(fn)
+                self.status[name] = "done"
+            except Exception as e:
+                print(f"⚠️ Warm-up step '{name}' failed: {e}")
+                self.status[name] = f"failed: {e}"
+            self.seconds[name] = round(time.perf_counter() - start, 3)
+
+        self.ready = all(status == "done" for status in self.status.values())
+        self.finished_at = time.time()
+
+    def report(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "starting" if self.finished_at is None else "failed",
+            "steps": {name: {"status": self.status[name], "seconds": self.seconds.get(name)} for name, _ in self._steps}
+        }
+
+
+# Singleton instance
+warm_up = WarmUp()
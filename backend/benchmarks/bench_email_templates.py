@@ -0,0 +1,64 @@
+"""
+Micro-benchmark: rendering lead digests with the compiled email templates.
+
+Compares building a digest from the fragments cached on each outbox row at
+capture time against re-rendering every lead's fragment at flush time, for
+digests of a few thousand leads.
+
+Run from backend/:  python -m benchmarks.bench_email_templates
+"""
+import random
+import timeit
+from datetime import datetime
+from app.services.email_service import email_service
+
+CAPTURED_AT = datetime(2024, 1, 15, 10, 30)
+LOCATIONS = ["OMR", "ECR", "Velachery", "Anna Nagar", None]
+
+
+def make_leads(count: int) -> list:
+    rng = random.Random(count)
+    return [
+        ({
+            "name": f"Lead {i} <{rng.choice('ABC')}>",  # Exercise escaping
+            "email": f"lead{i}@example.com",
+            "phone": f"98{i:08d}",
+            "purpose": "buy",
+            "location": rng.choice(LOCATIONS),
+            "budget": rng.choice(["50L", "1Cr", None]),
+            "timeline": rng.choice(["3 months", None]),
+            "property_type": rng.choice(["apartment", "villa", None]),
+        }, f"session-{i:06d}")
+        for i in range(count)
+    ]
+
+
+def main(sizes=(1000, 5000, 10000), repeat: int = 5):
+    leads = make_leads(1)
+    html, text = email_service.render_lead(*leads[0], CAPTURED_AT)
+    assert "&lt;" in html and "<A>" not in html and "<" in text
+
+    number = 2000
+    seconds = min(timeit.repeat(lambda: email_service.render_lead(*leads[0], CAPTURED_AT), number=number, repeat=repeat))
+    print(f"{'lead fragment (html + text)':<32} {seconds / number * 1e6:8.2f} µs / lead")
+    print()
+    print(f"{'leads':>8}  {'cached fragments':>18}  {'re-rendered':>14}  {'digest size':>12}")
+
+    for size in sizes:
+        leads = make_leads(size)
+        fragments = [email_service.render_lead(lead, session_id, CAPTURED_AT) for lead, session_id in leads]
+
+        cached = min(timeit.repeat(lambda: email_service.create_digest(fragments), number=1, repeat=repeat))
+        rerendered = min(timeit.repeat(
+            lambda: email_service.create_digest(
+                [email_service.render_lead(lead, session_id, CAPTURED_AT) for lead, session_id in leads]
+            ),
+            number=1, repeat=repeat
+        ))
+        _, body, text = email_service.create_digest(fragments)
+        size_kib = (len(body.encode()) + len(text.encode())) / 1024
+        print(f"{size:>8}  {cached * 1e3:15.2f} ms  {rerendered * 1e3:11.2f} ms  {size_kib:9.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark: encoding a chat response the way FastAPI does for a
+response_model (validate ChatResponse, jsonable_encoder, JSONResponse) vs.
+encode_json of the dynamic fields with the pre-encoded ui_component spliced in.
+
+Run from backend/:  python -m benchmarks.bench_payloads
+"""
+import json
+import timeit
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.api.chat_v2 import ChatResponse, _chat_response
+from app.services.flow_manager import flow_manager
+from app.services.payload_cache import payload_cache
+from app.services.state_machine import FlowState
+
+CONTEXT = {"name": "Asha", "email": "asha@example.com", "phone": "9876543210"}
+STATES = [
+    FlowState.CATEGORY_SELECTION,
+    FlowState.BOOKING_TIME_SELECTION,
+    FlowState.EXPLORE_START,
+    FlowState.EXPLORE_SHOW_MORE,
+]
+RESULTS = [flow_manager._state_result(state.value, CONTEXT) for state in STATES]
+
+
+def fields(result):
+    return dict(
+        session_id="3f2b8c1e-5a4d-4c6e-9f7a-1b2c3d4e5f60",
+        message=result["message"],
+        current_state=result["current_state"],
+        next_state=result["next_state"],
+        show_menu_button=result["show_menu_button"],
+        state_version=7
+    )
+
+
+def response_model():
+    for result in RESULTS:
+        model = ChatResponse.model_validate({**fields(result), "ui_component": result["ui_component"]})
+        JSONResponse(jsonable_encoder(model)).body
+
+
+def pre_encoded():
+    for result in RESULTS:
+        ui_component = payload_cache.ui_component(result["current_state"], result["ui_component"])
+        _chat_response(ui_component=ui_component, **fields(result)).body
+
+
+def main(number: int = 2000):
+    # Both paths must produce the same document
+    for result in RESULTS:
+        expected = jsonable_encoder(ChatResponse(**fields(result), ui_component=result["ui_component"]))
+        ui_component = payload_cache.ui_component(result["current_state"], result["ui_component"])
+        assert json.loads(_chat_response(ui_component=ui_component, **fields(result)).body) == expected
+
+    for label, fn in (("response_model", response_model), ("pre-encoded", pre_encoded)):
+        seconds = min(timeit.repeat(fn, number=number, repeat=5))
+        per_call_us = seconds / (number * len(RESULTS)) * 1e6
+        print(f"{label:<22} {per_call_us:8.2f} µs / response")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Startup benchmark: cold start of a fresh interpreter.
+
+Times, in a new process per run, how long `import app.main` takes (what a
+worker pays before it can bind), how long until startup hooks have run and
+/health would answer, and how long until the background warm-up finishes
+and /ready reports 200. Also lists the slowest modules app.main imports (from
+`python -X importtime`) so regressions are easy to attribute.
+
+Run from backend/:  python -m benchmarks.bench_startup
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def boot():
+    await app.main.app.router.startup()
+    started = time.perf_counter()
+    while not app.main.warm_up.finished_at:
+        await asyncio.sleep(0.005)
+    return started, time.perf_counter()
+
+started, ready = asyncio.run(boot())
+print(json.dumps({"import": imported - start, "serving": started - start, "ready": ready - start}))
+"""
+
+
+def run_probe(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, top: int = 8) -> list:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], env=env, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if cumulative.strip().isdigit() and depth == 1:
+            rows.append((int(cumulative) / 1000, name.strip()))  # Modules app.main imports directly
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(runs: int = 5):
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db", "PYTHONPATH": os.getcwd()}
+
+    samples = [run_probe(env) for _ in range(runs)]
+    print(f"cold start, best of {runs}")
+    for phase in ("import", "serving", "ready"):
+        print(f"  {phase:<8} {min(s[phase] for s in samples) * 1000:8.0f} ms")
+
+    print("slowest imports made by app.main (cumulative)")
+    for ms, name in slowest_imports(env):
+        print(f"  {name:<40} {ms:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
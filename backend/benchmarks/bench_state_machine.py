@@ -0,0 +1,51 @@
+"""
+Micro-benchmark: rendering a state response (plus transition lookup) from the
+compiled flow vs. compiling the flow definition on every request.
+
+Run from backend/:  python -m benchmarks.bench_state_machine
+"""
+import json
+import timeit
+from app.services.state_machine import state_machine, compile_flow, FlowState
+
+CONTEXT = {"name": "Asha", "email": "asha@example.com", "phone": "9876543210", "user_response": "morning"}
+STATES = [
+    FlowState.BROCHURE_SEND,
+    FlowState.BOOKING_START,
+    FlowState.BOOKING_TIME_SELECTION,
+    FlowState.BOOKING_CONFIRMATION,
+    FlowState.EXPLORE_START,
+    FlowState.ASK_START,
+]
+
+
+with open(state_machine.flows_file, encoding="utf-8") as f:
+    DEFINITION = json.load(f)
+
+
+def rebuild_per_request():
+    for state in STATES:
+        flow = compile_flow(DEFINITION, refs={"categories": []})
+        flow.next_state(state, "confirm")
+        response = flow.responses[flow.state_index[state]]
+        try:
+            response.message.format(**CONTEXT)
+        except KeyError:
+            pass
+
+
+def compiled():
+    for state in STATES:
+        state_machine.get_next_state(state, "confirm")
+        state_machine.get_state_response(state, CONTEXT)
+
+
+def main(number: int = 2000):
+    for label, fn in (("rebuild per request", rebuild_per_request), ("compiled", compiled)):
+        seconds = min(timeit.repeat(fn, number=number, repeat=5))
+        per_call_us = seconds / (number * len(STATES)) * 1e6
+        print(f"{label:<22} {per_call_us:8.2f} µs / transition + render")
+
+
+if __name__ == "__main__":
+    main()
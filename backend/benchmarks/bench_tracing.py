@@ -0,0 +1,93 @@
+"""
+Micro-benchmark: tracing overhead.
+
+Measures the cost of one span (tracing off, trace not sampled, sampled) and
+of a full chat request through the app with tracing off, on at the default
+sample rate, and on for every request. Spans go to an in-memory exporter so
+only the instrumentation itself is timed.
+
+Run from backend/:  python -m benchmarks.bench_tracing
+"""
+import asyncio
+import os
+import tempfile
+import time
+import timeit
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ["TRACING_ENABLED"] = "true"  # So the middleware is installed; toggled per run below
+
+import httpx
+from app.config import get_settings
+from app.database import init_db
+from app.main import app
+from app.services.rate_limiter import rate_limiter
+from app.services.tracing import tracer
+
+settings = get_settings()
+
+
+class NullExporter:
+    def __init__(self):
+        self.spans = 0
+
+    def export(self, span):
+        self.spans += 1
+
+
+def span_cost(number: int = 100000):
+    def one_span():
+        with tracer.span("bench"):
+            pass
+
+    rows = []
+    for label, enabled, rate in (("tracing off", False, 0), ("not sampled", True, 0), ("sampled", True, 1)):
+        tracer.enabled, tracer.sample_rate = enabled, rate
+        seconds = min(timeit.repeat(one_span, number=number, repeat=5))
+        rows.append((label, seconds / number * 1e9))
+    return rows
+
+
+async def request_cost(requests: int = 200):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        session_id = (await client.post("/api/v2/chat/init", json={})).json()["session_id"]
+
+        async def run():
+            start = time.perf_counter()
+            for _ in range(requests):
+                await client.post("/api/v2/chat/menu", json={"session_id": session_id})
+            return (time.perf_counter() - start) / requests
+
+        configs = (
+            ("tracing off", False, 0),
+            (f"sampled {settings.tracing_sample_rate:.0%}", True, settings.tracing_sample_rate),
+            ("sampled 100%", True, 1),
+        )
+        best = {label: float("inf") for label, _, _ in configs}
+        await run()  # Warm up
+        for _ in range(5):  # Interleaved, so drift affects every configuration alike
+            for label, enabled, rate in configs:
+                tracer.enabled, tracer.sample_rate = enabled, rate
+                best[label] = min(best[label], await run())
+        return [(label, best[label] * 1e6) for label, _, _ in configs]
+
+
+def main():
+    init_db()
+    rate_limiter.enabled = False  # One client hammering one session
+    tracer.exporter = NullExporter()
+
+    print("per span")
+    for label, ns in span_cost():
+        print(f"  {label:<16} {ns:8.0f} ns")
+
+    print("per POST /api/v2/chat/menu (request span + DB spans)")
+    rows = asyncio.run(request_cost())
+    baseline = rows[0][1]
+    for label, us in rows:
+        print(f"  {label:<16} {us:8.0f} µs  ({(us - baseline) / baseline:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
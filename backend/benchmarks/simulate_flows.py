@@ -0,0 +1,371 @@
+"""
+End-to-end simulation of the v2 chat flows through the real FastAPI app
+(in-process ASGI client, throwaway SQLite database, fake LLM).
+
+Every path (brochure, booking, explore, ask, menu, end) is walked the way the
+widget does it, checking the state after each step; together they must reach
+every FlowState. Two passes are run:
+
+- load: `--users` widgets per path at `--concurrency`, repeated `--runs`
+  times, for latency percentiles (the median of each run's), DB query
+  counts and LLM calls per endpoint
+- profile: each path once at a time under tracemalloc, for allocations
+
+Results are compared against benchmarks/baselines/simulate_flows.json.
+Query and LLM call counts are deterministic, so any increase is a regression
+and fails `--check`, as does a FlowState no path reaches. Latency and allocations depend on the machine and its
+load, so growth over `--max-regression` % is only reported.
+
+Run from backend/:  python -m benchmarks.simulate_flows [--save-baseline] [--check]
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+# Point the app at a throwaway database (and dummy credentials) before it is imported
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='simulate_flows_')}/simulate.db"
+os.environ["SHARD_COUNT"] = "1"
+for name, value in (("GEMINI_API_KEY", "fake"), ("SMTP_SERVER", ""), ("SMTP_PORT", "587"),
+                    ("SMTP_USERNAME", ""), ("SMTP_PASSWORD", ""), ("ADMIN_EMAIL", "")):
+    os.environ.setdefault(name, value)
+
+import httpx
+from sqlalchemy import event
+from app.main import app
+from app.database import engines, init_db
+from app.services.gemini_service import gemini_service, SPECULATIVE_CALL_SITES
+from app.services.rate_limiter import rate_limiter
+from app.services.state_machine import FlowState
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines" / "simulate_flows.json"
+
+# Per-request query and LLM call counters (one-item lists so the hooks can bump them)
+_queries = contextvars.ContextVar("simulate_flows_queries", default=None)
+_llm_calls = contextvars.ContextVar("simulate_flows_llm_calls", default=None)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+for _engine in engines.values():
+    event.listen(_engine, "before_cursor_execute", _count_query)
+
+
+class SimulationError(Exception):
+    """A flow didn't behave as the widget expects"""
+
+
+class FakeLLM:
+    """Stands in for GeminiService's network calls"""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+
+    async def generate_response(self, prompt: str, conversation_history: list = None, call_site: str = "other") -> str:
+        counter = _llm_calls.get()
+        if counter is not None and call_site not in SPECULATIVE_CALL_SITES:  # Prefetches may outlive the request
+            counter[0] += 1
+        await asyncio.sleep(self.latency)
+        return "Sunshine Residency on OMR has 2 and 3 BHK apartments from 50L, ready to move in."
+
+    async def stream_response(self, prompt: str, conversation_history: list = None, call_site: str = "other"):
+        yield await self.generate_response(prompt, conversation_history)
+
+    def install(self):
+        gemini_service.generate_response = self.generate_response
+        gemini_service.stream_response = self.stream_response
+
+
+class Recorder:
+    """Per-endpoint samples"""
+
+    def __init__(self, trace_allocations: bool = False):
+        self.trace_allocations = trace_allocations
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.llm_calls = defaultdict(list)
+        self.allocations = defaultdict(list)
+        self.visited = set()
+
+
+class SimulatedWidget:
+    """One chat session, driven the way ChatWidget.jsx drives the API"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, user: int):
+        self.client = client
+        self.recorder = recorder
+        self.user = user
+        self.session_id = None
+        self.state_version = None
+
+    async def call(self, path: str, body: dict = None, params: dict = None, expect: str = None) -> dict:
+        counter, llm_calls = [0], [0]
+        token, llm_token = _queries.set(counter), _llm_calls.set(llm_calls)
+        if self.recorder.trace_allocations:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(path, json=body, params=params)
+        finally:
+            elapsed = time.perf_counter() - start
+            _queries.reset(token)
+            _llm_calls.reset(llm_token)
+
+        endpoint = f"POST {path}"
+        self.recorder.latencies[endpoint].append(elapsed * 1000)
+        self.recorder.queries[endpoint].append(counter[0])
+        self.recorder.llm_calls[endpoint].append(llm_calls[0])
+        if self.recorder.trace_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            self.recorder.allocations[endpoint].append((peak - baseline) / 1024)
+
+        if response.status_code != 200:
+            raise SimulationError(f"{endpoint} -> {response.status_code}: {response.text}")
+        data = response.json()
+
+        if data.get("state_version") is not None:
+            self.state_version = data["state_version"]
+        if "current_state" in data:
+            self.recorder.visited.add(data["current_state"])
+            if expect and data["current_state"] != expect:
+                raise SimulationError(f"{endpoint} went to '{data['current_state']}', expected '{expect}'")
+        return data
+
+    async def start(self, category: str, expect: str):
+        """init -> pick a category -> fill in the lead form"""
+        data = await self.call("/api/v2/chat/init", {}, expect=FlowState.GREETING.value)
+        self.session_id = data["session_id"]
+        await self.select(category, expect=FlowState.LEAD_CAPTURE.value)
+        await self.call("/api/v2/chat/submit-lead", {
+            "session_id": self.session_id,
+            "category": category,
+            "name": f"Sim User {self.user}",
+            "email": f"sim{self.user}@example.com",
+            "phone": "9876543210"
+        }, expect=expect)
+
+    async def select(self, category: str, expect: str):
+        await self.call("/api/v2/chat/select-category", {
+            "session_id": self.session_id,
+            "category": {"id": category, "label": category.title()}
+        }, expect=expect)
+
+    async def input(self, input_type: str, input_data, expect: str):
+        await self.call("/api/v2/chat/input", {
+            "session_id": self.session_id,
+            "input_type": input_type,
+            "input_data": input_data,
+            "state_version": self.state_version
+        }, expect=expect)
+
+    async def menu(self):
+        await self.call("/api/v2/chat/menu", {"session_id": self.session_id}, expect=FlowState.CATEGORY_SELECTION.value)
+
+
+async def brochure_path(widget: SimulatedWidget):
+    await widget.start("brochure", expect=FlowState.BROCHURE_SEND.value)
+    await widget.input("assisstant", "continue", expect=FlowState.BROCHURE_COMPLETE.value)
+    await widget.input("button", {"value": "back_to_menu", "label": "🏠 Back to Menu"}, expect=FlowState.CATEGORY_SELECTION.value)
+
+
+async def booking_path(widget: SimulatedWidget):
+    await widget.start("booking", expect=FlowState.BOOKING_START.value)
+    await widget.input("text", "9876543210", expect=FlowState.BOOKING_TIME_SELECTION.value)
+    await widget.input("button", {"value": "morning", "label": "🌅 Morning"}, expect=FlowState.BOOKING_CONFIRMATION.value)
+    await widget.menu()
+
+
+async def explore_path(widget: SimulatedWidget):
+    await widget.start("explore", expect=FlowState.EXPLORE_START.value)
+    await widget.input("button", {"value": "apartment", "label": "🏢 Apartments"}, expect=FlowState.EXPLORE_PROPERTY_TYPE.value)
+    await widget.input("button", "show_more", expect=FlowState.EXPLORE_SHOW_MORE.value)
+    await widget.input("form", {"budget": "50_100", "location": ["OMR"]}, expect=FlowState.EXPLORE_FILTERED_RESULTS.value)
+    await widget.call("/api/v2/chat/property-action", {
+        "session_id": widget.session_id,
+        "action": "brochure",
+        "property_id": "prop_001"
+    }, expect=FlowState.EXPLORE_PROPERTY_ACTION.value)
+    await widget.menu()
+
+
+async def ask_path(widget: SimulatedWidget):
+    await widget.start("question", expect=FlowState.ASK_START.value)
+    await widget.input("button", {"value": "omr_projects", "label": "OMR projects"}, expect=FlowState.ASK_QUERY_RECEIVED.value)
+    await widget.call("/api/v2/chat/ask-ai", {"session_id": widget.session_id, "question": "omr_projects"})
+    await widget.input("assisstant", "continue", expect=FlowState.ASK_RESPONSE.value)
+    await widget.input("text", "thanks", expect=FlowState.ASK_FOLLOWUP.value)
+    await widget.input("button", {"value": "end", "label": "👋 End Chat"}, expect=FlowState.ENDED.value)
+
+
+async def menu_path(widget: SimulatedWidget):
+    await widget.start("explore", expect=FlowState.EXPLORE_START.value)
+    await widget.menu()
+    # The lead is known now, so the category starts straight away
+    await widget.select("booking", expect=FlowState.BOOKING_START.value)
+    await widget.menu()
+
+
+async def end_path(widget: SimulatedWidget):
+    await widget.start("brochure", expect=FlowState.BROCHURE_SEND.value)
+    await widget.call("/api/v2/chat/end", params={"session_id": widget.session_id})
+
+
+PATHS = {
+    "brochure": brochure_path,
+    "booking": booking_path,
+    "explore": explore_path,
+    "ask": ask_path,
+    "menu": menu_path,
+    "end": end_path,
+}
+
+
+async def simulate(client: httpx.AsyncClient, recorder: Recorder, users: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    counter = iter(range(sys.maxsize))
+
+    async def walk(path):
+        async with semaphore:
+            await path(SimulatedWidget(client, recorder, next(counter)))
+
+    await asyncio.gather(*(walk(path) for _ in range(users) for path in PATHS.values()))
+
+
+def percentile(samples: list, pct: int) -> float:
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+def summarize(loads: list, profile: Recorder) -> dict:
+    """Per endpoint: latency percentiles as the median over the load runs, counts as the mean per request"""
+    endpoints = {}
+    for endpoint in sorted(loads[0].latencies):
+        runs = [load.latencies[endpoint] for load in loads]
+        endpoints[endpoint] = {
+            "requests": len(runs[0]),
+            **{f"p{pct}_ms": round(statistics.median(percentile(run, pct) for run in runs), 3) for pct in (50, 95, 99)},
+            "queries": round(statistics.mean(n for load in loads for n in load.queries[endpoint]), 2),
+            "llm_calls": round(statistics.mean(n for load in loads for n in load.llm_calls[endpoint]), 2),
+            "alloc_kib": round(statistics.mean(profile.allocations[endpoint]), 1) if profile.allocations[endpoint] else None
+        }
+    return {
+        "endpoints": endpoints,
+        "unvisited_states": sorted({state.value for state in FlowState} - set().union(*(load.visited for load in loads)))
+    }
+
+
+def print_report(summary: dict):
+    print(f"{'endpoint':<34} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'LLM':>6} {'alloc KiB':>10}")
+    for endpoint, row in summary["endpoints"].items():
+        print(
+            f"{endpoint:<34} {row['requests']:>5} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+            f"{row['p99_ms']:>8.2f} {row['queries']:>8.2f} {row['llm_calls']:>6.2f} {row['alloc_kib'] or 0:>10.1f}"
+        )
+    if summary["unvisited_states"]:
+        print(f"\n!! FlowState values no path reaches: {', '.join(summary['unvisited_states'])}")
+
+
+def compare(summary: dict, baseline: dict, max_regression: float) -> list:
+    """
+    Print changes against the baseline; returns the regressions (more queries
+    or LLM calls). Latency/allocation growth is marked "~~" but not returned.
+    """
+    regressions = []
+    print(f"\nAgainst baseline ({BASELINE_FILE.name}):")
+
+    for endpoint, row in summary["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            print(f"  + {endpoint} (new)")
+            continue
+
+        for metric in ("queries", "llm_calls", "p50_ms", "p95_ms", "p99_ms", "alloc_kib"):
+            old, new = before.get(metric), row.get(metric)
+            if old is None or new is None or old == new:
+                continue
+            change = (new - old) / old * 100 if old else float("inf")
+            deterministic = metric in ("queries", "llm_calls")
+            if deterministic:
+                marker = "!!" if new > old else "  "
+            else:
+                marker = "~~" if change > max_regression else "  "
+            if deterministic or abs(change) > max_regression:
+                print(f"  {marker} {endpoint:<34} {metric:<9} {old:>9} -> {new:<9} ({change:+.1f}%)")
+            if deterministic and new > old:
+                regressions.append((endpoint, metric))
+
+    for endpoint in baseline["endpoints"].keys() - summary["endpoints"].keys():
+        print(f"  - {endpoint} (gone)")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+async def main(args) -> int:
+    init_db()
+    FakeLLM(args.llm_latency_ms).install()
+    rate_limiter.enabled = False  # Every simulated user shares one client address
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://simulate") as client:
+        await simulate(client, Recorder(), users=1, concurrency=1)  # Warm-up
+
+        loads = []
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            loads.append(Recorder())
+            await simulate(client, loads[-1], users=args.users, concurrency=args.concurrency)
+        elapsed = (time.perf_counter() - started) / args.runs
+
+        profile = Recorder(trace_allocations=True)
+        tracemalloc.start()
+        try:
+            await simulate(client, profile, users=args.profile_users, concurrency=1)
+        finally:
+            tracemalloc.stop()
+
+    walks = args.users * len(PATHS)
+    print(f"{walks} flows x {args.runs} runs, concurrency {args.concurrency}, "
+          f"{elapsed:.2f}s per run ({walks / elapsed:.1f} flows/s)\n")
+    summary = summarize(loads, profile)
+    print_report(summary)
+
+    if args.save_baseline:
+        BASELINE_FILE.parent.mkdir(exist_ok=True)
+        BASELINE_FILE.write_text(json.dumps(summary, indent=2) + "\n", encoding="utf-8")
+        print(f"\nSaved baseline to {BASELINE_FILE}")
+        return 0
+
+    if BASELINE_FILE.exists():
+        regressions = compare(summary, json.loads(BASELINE_FILE.read_text(encoding="utf-8")), args.max_regression)
+        if regressions and args.check:
+            return 1
+    if summary["unvisited_states"] and args.check:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20, help="widgets per path in the load pass")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=3, help="load passes; latency percentiles are their median")
+    parser.add_argument("--profile-users", type=int, default=3, help="widgets per path in the allocation pass")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="simulated Gemini latency")
+    parser.add_argument("--max-regression", type=float, default=25, help="%% growth in latency/allocations reported")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if queries or LLM calls increased or a state went unreached")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -182,7 +182,23 @@ const ChatWidget = () => {
         content: response.message,
         uiComponent: response.ui_component,
       });
+
+      // A quick-reply question: its answer was prefetched when the Ask AI screen opened
+      if (response.current_state === 'ask_query_received' && inputData && inputData.value) {
+        const answer = await chatAPI.askAI(sessionId, inputData.value);
+        addMessage({
+          role: 'assistant',
+          content: answer.message,
+          uiComponent: answer.ui_component,
+        });
+      }
     } catch (error) {
+      const detail = error.response && error.response.data && error.response.data.detail;
+      if (error.response && error.response.status === 409 && detail && detail.code === 'stale_state') {
+        // Duplicate or out-of-date submission; the server already moved on
+        setCurrentState(detail.current_state);
+        return;
+      }
       console.error('Input error:', error);
       addMessage({ role: 'assistant', content: 'Something went wrong. Please try again.' });
     } finally {
@@ -287,6 +303,7 @@ const ChatWidget = () => {
               propertyType={component.data.property_type}
               filtered={component.data.filtered}
               preferences={component.data.preferences}
+              initialProperties={component.data.properties}
               onAction={async (action, propertyId) => {
                 addMessage({ role: 'user', content: `Requested ${action} for property` });
                 setIsLoading(true);
@@ -2,13 +2,16 @@ import { useState, useEffect } from 'react';
 import PropertyCard from './PropertyCard';
 import axios from 'axios';
 
-const PropertyCards = ({ propertyType, filtered, preferences, onAction, onShowMore }) => {
-  const [properties, setProperties] = useState([]);
-  const [loading, setLoading] = useState(true);
+const PropertyCards = ({ propertyType, filtered, preferences, initialProperties, onAction, onShowMore }) => {
+  const [properties, setProperties] = useState(initialProperties || []);
+  const [loading, setLoading] = useState(!initialProperties);
 
   useEffect(() => {
-    fetchProperties();
-  }, [propertyType, preferences]);
+    // Cards embedded in the chat response need no extra request
+    if (!initialProperties) {
+      fetchProperties();
+    }
+  }, [propertyType, preferences, initialProperties]);
 
   const fetchProperties = async () => {
     setLoading(true);
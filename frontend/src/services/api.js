@@ -5,6 +5,58 @@ const api = axios.create({
   headers: { 'Content-Type': 'application/json' },
 });
 
+// Version of the server-side conversation state this client last saw.
+// Sent with every input so a double-click or replayed request gets a 409.
+let stateVersion = null;
+
+const MAX_RETRIES = 2;
+
+const newIdempotencyKey = () =>
+  (window.crypto && window.crypto.randomUUID)
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+// Each POST gets an Idempotency-Key; retries reuse it, so the server
+// replays the first response instead of running the action twice.
+api.interceptors.request.use((config) => {
+  if (config.method === 'post' && !config.headers['Idempotency-Key']) {
+    config.headers['Idempotency-Key'] = newIdempotencyKey();
+  }
+  return config;
+});
+
+api.interceptors.response.use(
+  (response) => {
+    if (response.data && response.data.state_version != null) {
+      stateVersion = response.data.state_version;
+    }
+    return response;
+  },
+  async (error) => {
+    const config = error.config;
+    // No response at all: the network dropped the request or the reply, so retry it
+    if (!error.response && config && config.method === 'post' && (config.retryCount || 0) < MAX_RETRIES) {
+      config.retryCount = (config.retryCount || 0) + 1;
+      await new Promise((resolve) => setTimeout(resolve, 500 * config.retryCount));
+      return api(config);
+    }
+
+    const detail = error.response && error.response.data && error.response.data.detail;
+    // The first attempt with this key is still running (e.g. on another worker): ask again shortly
+    if (error.response && error.response.status === 409 && detail && detail.code === 'in_progress'
+        && (config.retryCount || 0) < MAX_RETRIES) {
+      config.retryCount = (config.retryCount || 0) + 1;
+      const retryAfter = Number(error.response.headers['retry-after']) || 1;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+      return api(config);
+    }
+    if (error.response && error.response.status === 409 && detail && detail.state_version != null) {
+      stateVersion = detail.state_version;
+    }
+    return Promise.reject(error);
+  }
+);
+
 export const chatAPI = {
   // Initialize chat
   init: async () => {
@@ -38,6 +90,7 @@ export const chatAPI = {
     const { data } = await api.post('/chat/input', {
       session_id: sessionId,
       current_state: currentState,
+      state_version: stateVersion,
       input_type: inputType,
       input_data: inputData,
     });
@@ -67,6 +120,15 @@ export const chatAPI = {
     return data;
   },
 
+  // Several actions in one round-trip, e.g. [{ type: 'submit_lead', data: {...} }, { type: 'menu' }]
+  batch: async (sessionId, actions) => {
+    const { data } = await api.post('/chat/batch', {
+      session_id: sessionId,
+      actions,
+    });
+    return data;
+  },
+
   // Property action
   propertyAction: async (sessionId, action, propertyId) => {
     const { data } = await api.post('/chat/property-action', {
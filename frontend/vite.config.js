@@ -10,6 +10,7 @@ export default defineConfig({
       '/api': {
         target: 'http://localhost:8080',
         changeOrigin: true,
+        ws: true,
       }
     },
     allowedHosts:["unsignificantly-logarithmic-deetta.ngrok-free.dev"],